@@ -1,12 +1,17 @@
+from .catalog import Catalog
 from .common import Common, Log, State
 from .database import Database
 from .get_tables import GetTables
 from .grouping import Grouping
+from .log_index import LogIndex
 from .merge_plan import MergePlan
 from .regression import Regression
 from .regression import CalcRegression
 from .repository import Repository
 from .replace import Replace
 from .rules import Rules
+from .segment import Segment
+from .sufficient_stats import SufficientStats
 from .push_param import PushParam
+from .ingest import Ingest
 from .query_progress import QueryProgress
@@ -0,0 +1,155 @@
+"""
+catalog.py
+
+This file defines the catalog of a server in the repository, which is an
+SQLite database that stores the rows of log.csv and the seqids of the
+stat.dat files.
+
+
+  Formatted by black (https://pypi.org/project/black/)
+
+  Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
+"""
+
+import sqlite3
+
+
+class Catalog:
+    """
+    The catalog has the following tables:
+
+      log   : the rows of log.csv, stored in the order they are got. The
+              rowid keeps the order, so the latest row wins as in log.csv.
+      stage : the seqid up to which each stage (tables, grouping and
+              regression) has processed, i.e. the stat.dat files.
+
+    The rows are appended in batches of BATCH_SIZE, and they are committed
+    with the seqid of the tables stage by set_seqid(), so the rows and the
+    seqid are stored atomically.
+    """
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.__conn = sqlite3.connect(path)
+        self.__rows = []
+        self.__conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS log (
+                seqid INTEGER NOT NULL,
+                starttime TEXT,
+                endtime TEXT,
+                database TEXT,
+                pid TEXT,
+                nested_level TEXT,
+                queryid INTEGER NOT NULL,
+                planid INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS log_seqid_idx ON log (seqid);
+            CREATE INDEX IF NOT EXISTS log_database_queryid_idx
+                ON log (database, queryid);
+            CREATE INDEX IF NOT EXISTS log_queryid_planid_idx
+                ON log (queryid, planid);
+            CREATE TABLE IF NOT EXISTS stage (
+                name TEXT PRIMARY KEY,
+                seqid INTEGER NOT NULL
+            );
+            """
+        )
+
+    def __flush(self):
+        if self.__rows:
+            self.__conn.executemany(
+                "INSERT INTO log VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.__rows
+            )
+            self.__rows = []
+
+    def __to_row(self, row):
+        """Return the row as the list of str, as csv.reader() does."""
+        return [str(_v) for _v in row]
+
+    """
+    Public methods
+    """
+
+    def append_row(self, row):
+        """Append a row (seqid, starttime, ..., queryid, planid) to the log table."""
+        self.__rows.append(
+            (int(row[0]),)
+            + tuple(str(_v) for _v in row[1:6])
+            + (int(row[6]), int(row[7]))
+        )
+        if self.BATCH_SIZE <= len(self.__rows):
+            self.__flush()
+
+    def read_rows(self, from_seqid=0, to_seqid=None):
+        """Yield the rows whose seqids are in (from_seqid, to_seqid]."""
+        self.__flush()
+        if to_seqid is None:
+            _cur = self.__conn.execute(
+                "SELECT * FROM log WHERE ? < seqid ORDER BY rowid", (from_seqid,)
+            )
+        else:
+            _cur = self.__conn.execute(
+                "SELECT * FROM log WHERE ? < seqid AND seqid <= ? ORDER BY rowid",
+                (from_seqid, to_seqid),
+            )
+        for _row in _cur:
+            yield self.__to_row(_row)
+
+    def get_first_row_by_queryid(self, queryid):
+        """Return the first row of queryid, or None if not found."""
+        self.__flush()
+        _row = self.__conn.execute(
+            "SELECT * FROM log WHERE queryid = ? ORDER BY rowid LIMIT 1",
+            (int(queryid),),
+        ).fetchone()
+        return None if _row is None else self.__to_row(_row)
+
+    def get_latest_plans(self):
+        """
+        Return {database: {queryid: (planid, seqid)}} of the latest rows.
+        The databases are in the order they appear first.
+        """
+        self.__flush()
+        _cur = self.__conn.execute(
+            "SELECT database, queryid, planid, seqid FROM log ORDER BY rowid"
+        )
+        _plans = {}
+        for (_database, _queryid, _planid, _seqid) in _cur:
+            _plans.setdefault(_database, {})[_queryid] = (_planid, _seqid)
+        return _plans
+
+    def get_seqid(self, stage):
+        """Return the seqid of stage, or 0 if not found."""
+        _row = self.__conn.execute(
+            "SELECT seqid FROM stage WHERE name = ?", (stage,)
+        ).fetchone()
+        return 0 if _row is None else int(_row[0])
+
+    def set_seqid(self, stage, seqid):
+        """Set the seqid of stage, and commit it with the appended rows."""
+        self.__conn.execute(
+            "INSERT OR REPLACE INTO stage (name, seqid) VALUES (?, ?)",
+            (stage, int(seqid)),
+        )
+        self.commit()
+
+    def delete_rows(self):
+        """Delete all rows of the log table."""
+        self.__rows = []
+        self.__conn.execute("DELETE FROM log")
+
+    def rollback(self):
+        """Discard the rows appended after the last commit."""
+        self.__rows = []
+        self.__conn.rollback()
+
+    def commit(self):
+        self.__flush()
+        self.__conn.commit()
+
+    def close(self):
+        self.commit()
+        self.__conn.close()
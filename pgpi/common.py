@@ -6,15 +6,22 @@ common.py
   Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
 """
 
+import concurrent.futures
 import hashlib
 import json
 import os
 import sys
+import zlib
 import configparser
 
 from enum import Enum
 from enum import IntEnum
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 """
 Helper classes
 """
@@ -55,28 +62,57 @@ class Common:
     REPOSITORY_DIR = "pgpi_repository"
     CONF_FILE = "hosts.conf"
     STAT_FILE = "stat.dat"
+    CATALOG_FILE = "catalog.db"
 
     """tables directory"""
     TABLES_DIR = "tables"
     TABLES_FILE = "log.csv"
+    TABLES_INDEX_FILE = "log.idx"
+    TABLES_QUERY_INDEX_FILE = "query.idx"
     TABLES_QUERY_DIR = "query"
     TABLES_PLAN_DIR = "plan"
     TABLES_PLAN_JSON_DIR = "plan_json"
+    TABLES_SEGMENT_DIR = "segment"
 
     """grouping directory"""
     GROUPING_DIR = "grouping"
+    GROUPING_RECORD_EXT = ".rec"
+    GROUPING_EXTRA_EXT = ".ext"
+    GROUPING_STATS_EXT = ".stat"
+    GROUPING_RESERVOIR_EXT = ".res"
+    GROUPING_MANIFEST_DIR = "manifest"
+    GROUPING_STORE_KEY = "SampleStore"
 
     """regression directory"""
     REGRESSION_DIR = "regression"
 
     """formatted regression parameter directory"""
     FORMATTED_REGRESSION_PARAMS_DIR = "reg_params"
+    PUSH_STAT_FILE = "push.dat"
 
     """pg_query_plan"""
     SCHEMA = "query_plan"
     LOG_TABLE = "log"
 
     REG_PARAMS_TABLE = "reg"
+    REG_PARAMS_STAGING_TABLE = "pgpi_reg_stage"
+
+    """
+    codecs of the stored plans
+
+      json    : pretty-printed json (default)
+      compact : json without indents and spaces
+      zlib    : compact json compressed by zlib
+      zstd    : compact json compressed by zstd (requires zstandard)
+
+    The codec is detected on read, so files stored by different codecs
+    can be mixed. PlanCodec is set by Repository.set_plan_codec().
+    """
+    PLAN_CODECS = ("json", "compact", "zlib", "zstd")
+    ZLIB_MAGIC = b"\x78\x9c"
+    ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+    DEFAULT_PLAN_CODEC = "json"
+    PlanCodec = DEFAULT_PLAN_CODEC
 
     """
     Various methods
@@ -94,6 +130,21 @@ class Common:
             sys.exit(1)
         return _serverId
 
+    def run_jobs(self, func, tasks, jobs=1):
+        """
+        Run func(task) for each task in a pool of jobs processes, and Return
+        the list of the results in the same order as tasks.
+        If jobs is 1 or less, they run in this process.
+
+        func must be a module-level function, and the tasks and the results
+        must be picklable.
+        """
+        if jobs <= 1 or len(tasks) <= 1:
+            return [func(_task) for _task in tasks]
+        _chunksize = max(1, len(tasks) // (jobs * 4))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as _executor:
+            return list(_executor.map(func, tasks, chunksize=_chunksize))
+
     def apply_func_in_each_node(self, func, Plans):
         if isinstance(Plans, list):
             for plan in Plans:
@@ -143,44 +194,98 @@ class Common:
         """
         Count the number of nodes in Plans.
         """
+        return len(self.get_node_list(Plans))
 
-        def count_nodes(Plans):
-            if isinstance(Plans, list):
-                for plan in Plans:
-                    count(plan)
-                    if "Plans" in plan:
-                        count_nodes(plan["Plans"])
-                return
-            else:
-                count(Plans)
-                if "Plan" in Plans:
-                    count_nodes(Plans["Plan"])
-                if "Plans" in Plans:
-                    count_nodes(Plans["Plans"])
-                return
+    def get_node_list(self, Plans):
+        """
+        Return the list of all nodes in Plans in pre-order.
 
-        def count(plan):
-            if "Node Type" in plan:
-                self.__num += 1
+        The n-th node counted by count_nodes() is the (n-1)-th element of the
+        list, so the list can be built once per plan and used instead of digging
+        down the plan tree to a specific depth for each node.
+        Iterating it in reverse order visits the nodes from the bottom node
+        to the top node, i.e. all children are visited before their parent.
+
+        The elements are the dicts of the json plan themselves, so the node
+        loops, e.g. Rules.apply_rules() and CalcNode.calc_nodes(), read and
+        update the plan without converting it to another representation.
+        """
+        return [_plan for _plan in self.get_dict_list(Plans) if "Node Type" in _plan]
 
-        self.__num = 0
-        count_nodes(Plans)
-        return self.__num
+    def get_dict_list(self, Plans):
+        """
+        Return the list of all dicts in Plans, i.e. the top-level dict and
+        the nodes, in the same order as apply_func_in_each_node() visits them.
+        """
+        _dicts = []
+        _stack = [Plans]
+        while _stack:
+            _plans = _stack.pop()
+            if isinstance(_plans, list):
+                _stack.extend(reversed(_plans))
+                continue
+            _dicts.append(_plans)
+            if "Plans" in _plans:
+                _stack.append(_plans["Plans"])
+            if "Plan" in _plans:
+                _stack.append(_plans["Plan"])
+        return _dicts
+
+    def encode_text(self, text, codec=None):
+        """
+        Return the bytes of the text, compressed if codec (default: PlanCodec)
+        is zlib or zstd.
+        """
+        _codec = self.PlanCodec if codec is None else codec
+        _data = text.encode("utf-8")
+        if _codec == "zlib":
+            _data = zlib.compress(_data)
+        elif _codec == "zstd":
+            _data = zstandard.ZstdCompressor().compress(_data)
+        return _data
+
+    def decode_text(self, data, path):
+        """
+        Return the text of the bytes read from path, decompressing them if
+        compressed. The magic bytes cannot be the head of a utf-8 text.
+        """
+        if data[:2] == self.ZLIB_MAGIC:
+            data = zlib.decompress(data)
+        elif data[:4] == self.ZSTD_MAGIC:
+            if zstandard is None:
+                print("Error: zstandard is required to read '{}'.".format(path))
+                sys.exit(1)
+            data = zstandard.ZstdDecompressor().decompress(data)
+        return data.decode("utf-8")
+
+    def read_text(self, path):
+        """Read the text from path, decompressing it if compressed."""
+        with open(path, "rb") as _fp:
+            return self.decode_text(_fp.read(), path)
+
+    def write_text(self, text, path, codec=None):
+        """
+        Write the text to path, compressing it if codec (default: PlanCodec)
+        is zlib or zstd.
+        """
+        _data = self.encode_text(text, codec)
+        with open(path, "wb") as _fp:
+            _fp.write(_data)
 
     def read_plan_json(self, planpath):
-        """Read the plan from planpath."""
-        _js = open(planpath, "r")
-        _json_dict = json.load(_js)
-        _js.close()
-        return _json_dict
-
-    def write_plan_json(self, jdict, planpath):
-        """Write the plan (jdict) to planpath."""
-
-        _jdp = json.dumps(jdict, ensure_ascii=False, indent=4, separators=(",", ": "))
-        _fp = open(planpath, "w")
-        _fp.write("{}".format(_jdp))
-        _fp.close()
+        """Read the plan from planpath, whichever codec is used."""
+        return json.loads(self.read_text(planpath))
+
+    def write_plan_json(self, jdict, planpath, codec=None):
+        """Write the plan (jdict) to planpath by codec (default: PlanCodec)."""
+        _codec = self.PlanCodec if codec is None else codec
+        if _codec == "json":
+            _jdp = json.dumps(
+                jdict, ensure_ascii=False, indent=4, separators=(",", ": ")
+            )
+        else:
+            _jdp = json.dumps(jdict, ensure_ascii=False, separators=(",", ":"))
+        self.write_text(_jdp, planpath, _codec)
 
     def isScan(self, plan):
         """Check this plan is scan or not."""
@@ -9,7 +9,6 @@ databse.py
 
 import sys
 import getpass
-import configparser
 import psycopg2
 from .repository import Repository
 from .common import Log
@@ -45,8 +44,7 @@ class Database(Repository):
             sys.exit(1)
 
         _conn = ""
-        _config = configparser.ConfigParser()
-        _config.read(self.get_conf_file_path())
+        _config = self.get_hosts_conf()
         for _section in _config.sections():
             if _section == serverId:
                 _conn = (
@@ -9,8 +9,12 @@ get_tables.py
 """
 
 import configparser
+import json
 import os
+import queue
+import shutil
 import sys
+import threading
 
 from .common import Common, Log
 from .database import Database
@@ -19,6 +23,16 @@ from .repository import Repository
 
 
 class GetTables(MergePlan):
+    """Default number of rows fetched at a time from the server-side cursor."""
+
+    ITERSIZE = 2000
+
+    """Number of threads that write the got rows into the tables dir."""
+    WRITERS = 4
+
+    """Max number of the got rows queued for the writer threads."""
+    QUEUE_SIZE = 256
+
     def __init__(self, base_dir=".", log_level=Log.info):
         self.set_base_dir(base_dir)
         self.ServerId = ""
@@ -26,6 +40,7 @@ class GetTables(MergePlan):
 
     def __set_serverId(self, serverId):
         self.ServerId = serverId
+        self.set_plan_codec(serverId)
 
     def __exec_select_cmd(self, connection, sql):
         _cur = connection.cursor()
@@ -52,81 +67,232 @@ class GetTables(MergePlan):
         _cur.close()
         return _max_seqid if isinstance(_max_seqid, int) == True else 0
 
-    def __get_log(self, connection, current_seqid, max_seqid):
+    def __open_log_cursor(self, connection, from_seqid, to_seqid, itersize):
+        """
+        Open a named (server-side) cursor to get the rows of query_plan.log
+        whose seqids are in (from_seqid, to_seqid]. Since the rows are
+        fetched itersize rows at a time, at most itersize rows, which
+        contain large plan and plan_json texts, are held in memory.
+        """
+        _sql = "SELECT seqid, starttime, endtime, database, pid,"
+        _sql += " nested_level, queryid, query, planid, plan, plan_json"
+        _sql += "   FROM " + self.SCHEMA + "." + self.LOG_TABLE
+        _sql += "     WHERE " + str(from_seqid) + " < seqid AND seqid <= "
+        _sql += str(to_seqid) + " ORDER BY seqid"
+
+        _cur = connection.cursor(name="pgpi_get_log")
+        _cur.itersize = itersize
+        try:
+            _cur.execute(_sql)
+        except Exception as err:
+            _cur.close()
+            if Log.error <= self.LogLevel:
+                print("SQL Error:'{}'".format(_sql))
+            sys.exit(1)
+        return _cur
+
+    def __store_segments(self, segments, seqid, query, plan, plan_json):
+        """
+        Append a row to the segments of the segment-file layout. The parallel
+        worker's rows are added to plan_json here if it is a dict, because the
+        segment files are never rewritten; otherwise, plan_json is the text
+        of the plan whose rows have been added already. query and plan are
+        skipped if None.
+        """
+        for (_kind, _text) in (
+            (self.TABLES_QUERY_DIR, query),
+            (self.TABLES_PLAN_DIR, plan),
+        ):
+            if _text is not None:
+                segments[_kind].append(seqid, _text)
+        if isinstance(plan_json, dict):
+            plan_json = json.dumps(
+                self.merge_workers_rows(plan_json), ensure_ascii=False
+            )
+        segments[self.TABLES_PLAN_JSON_DIR].append(seqid, plan_json)
+
+    def __store_row(self, merger, segments, row):
+        """
+        Store the query, plan and plan_json of a row (seqid, queryid, planid,
+        query, plan, plan_json). The parallel worker's rows are added to the
+        decoded plan_json by merger, and the plan is written only once.
+        """
+        (_seqid, _queryid, _planid, _query, _plan, _plan_json) = row
+
+        if segments is not None:
+            self.__store_segments(
+                segments, _seqid, _query, _plan, json.loads(_plan_json)
+            )
+            return
+
+        def store_log(seqid, dirpath, data):
+            os.makedirs(dirpath, exist_ok=True)
+            self.write_text("{}".format(data), self.path(dirpath, str(seqid)))
+
+        """Store query."""
+        store_log(_seqid, self.get_query_dir_path(self.ServerId, _queryid), _query)
+        """Store plan."""
+        store_log(
+            _seqid, self.get_plan_dir_path(self.ServerId, _queryid, _planid), _plan
+        )
+        """Store plan_json."""
+        _jdirpath = self.get_plan_json_dir_path(self.ServerId, _queryid, _planid)
+        os.makedirs(_jdirpath, exist_ok=True)
+        self.write_plan_json(
+            merger.merge_workers_rows(json.loads(_plan_json)),
+            self.path(_jdirpath, str(_seqid)),
+        )
+
+    def __get_log(self, connection, current_seqid, max_seqid, itersize, chunk_size):
         """
         This function performs the main processing of public method get_tables().
         That is, it gets new log data from query_plan.log table, and stores
         the getting data into appropriate directories.
-        """
 
-        def store_log(seqid, dirpath, data, postfix=""):
-            if os.path.exists(dirpath) == False:
-                os.makedirs(dirpath)
-            _path = self.path(dirpath, str(seqid) + postfix)
-            _qfp = open(_path, mode="w")
-            _qfp.write("{}".format(data))
-            _qfp.close()
+        If chunk_size is greater than 0, the rows are got by the seqid ranges
+        of chunk_size, one query per range.
 
-        if current_seqid >= max_seqid:
-            return 0
+        The rows are got and appended to log.csv (or the catalog) in seqid
+        order by this thread, while their files are written by WRITERS
+        threads through a queue of QUEUE_SIZE rows, so the latencies of the
+        network and the disk overlap. Since the plans are processed by one
+        thread in the segment-file layout, whose files are append-only,
+        only one writer thread is used in that layout.
+        """
 
-        _sql = "SELECT seqid, starttime, endtime, database, pid,"
-        _sql += " nested_level, queryid, query, planid, plan, plan_json"
-        _sql += "   FROM " + self.SCHEMA + "." + self.LOG_TABLE
-        _sql += "     WHERE " + str(current_seqid) + " < seqid AND seqid <= "
-        _sql += str(max_seqid) + " ORDER BY seqid"
-        _cur = self.__exec_select_cmd(connection, _sql)
-        if _cur is None:
+        if current_seqid >= max_seqid:
             return 0
-        _num_rows = _cur.rowcount
 
-        _logfp = open(self.get_log_csv_path(self.ServerId), mode="a")
-        for _row in _cur:
-            _seqid = _row[0]
-            _starttime = _row[1]
-            _endtime = _row[2]
-            _database = _row[3]
-            _pid = _row[4]
-            _nested_level = _row[5]
-            _queryid = int(_row[6])
-            _query = _row[7]
-            if _row[8] is not None:
-                _planid = int(_row[8])
-            else:
-                continue
-            _plan = _row[9]
-            _plan_json = _row[10]
-
-            # Write query info into log.csv.
-            _logfp.write(
-                "{},{},{},{},{},{},{},{}\n".format(
-                    _seqid,
-                    _starttime,
-                    _endtime,
-                    _database,
-                    _pid,
-                    _nested_level,
-                    _queryid,
-                    _planid,
+        _segments = None
+        if self.is_tables_segmented(self.ServerId):
+            _segments = {
+                _kind: self.get_tables_segment(self.ServerId, _kind)
+                for _kind in (
+                    self.TABLES_QUERY_DIR,
+                    self.TABLES_PLAN_DIR,
+                    self.TABLES_PLAN_JSON_DIR,
                 )
-            )
+            }
 
-            """Store query."""
-            store_log(_seqid, self.get_query_dir_path(self.ServerId, _queryid), _query)
-            """Store plan."""
-            store_log(
-                _seqid, self.get_plan_dir_path(self.ServerId, _queryid, _planid), _plan
-            )
-            """Store plan_json."""
-            store_log(
-                _seqid,
-                self.get_plan_json_dir_path(self.ServerId, _queryid, _planid),
-                _plan_json,
-                ".tmp",
+        """
+        If the catalog is used, the rows are committed with the seqid of
+        the tables stage by update_tables_stat_file().
+        """
+        _catalog = None
+        if self.has_catalog(self.ServerId):
+            _catalog = self.get_catalog(self.ServerId)
+        else:
+            _logindex = self.get_log_index(self.ServerId)
+            _logindex.open()
+            _logfp = open(self.get_log_csv_path(self.ServerId), mode="a")
+
+        """
+        Start the writer threads. Each of them has its own MergePlan object,
+        since adding the parallel worker's rows uses the object's state.
+        If a writer fails, the others discard the remaining rows so that
+        this thread is never blocked, and the error is raised at the end.
+        """
+        _queue = queue.Queue(self.QUEUE_SIZE)
+        _errors = []
+
+        def write_rows(merger):
+            while True:
+                _item = _queue.get()
+                if _item is None:
+                    return
+                if _errors:
+                    continue
+                try:
+                    self.__store_row(merger, _segments, _item)
+                except BaseException as err:
+                    _errors.append(err)
+
+        _writers = [
+            threading.Thread(
+                target=write_rows, args=(MergePlan(log_level=self.LogLevel),)
             )
+            for _i in range(1 if _segments is not None else max(1, self.WRITERS))
+        ]
+        for _writer in _writers:
+            _writer.start()
 
-        _logfp.close()
-        _cur.close()
+        """
+        A named cursor can be used only in a transaction, so autocommit is
+        turned off while the rows are got.
+        """
+        _autocommit = connection.autocommit
+        connection.autocommit = False
+
+        _num_rows = 0
+        _from_seqid = current_seqid
+        try:
+            while _from_seqid < max_seqid and not _errors:
+                if chunk_size is not None and 0 < chunk_size:
+                    _to_seqid = min(max_seqid, _from_seqid + chunk_size)
+                else:
+                    _to_seqid = max_seqid
+                _cur = self.__open_log_cursor(
+                    connection, _from_seqid, _to_seqid, itersize
+                )
+
+                for _row in _cur:
+                    _num_rows += 1
+                    _seqid = _row[0]
+                    _starttime = _row[1]
+                    _endtime = _row[2]
+                    _database = _row[3]
+                    _pid = _row[4]
+                    _nested_level = _row[5]
+                    _queryid = int(_row[6])
+                    _query = _row[7]
+                    if _row[8] is not None:
+                        _planid = int(_row[8])
+                    else:
+                        continue
+                    _plan = _row[9]
+                    _plan_json = _row[10]
+
+                    # Write query info into log.csv.
+                    _info = (
+                        _seqid,
+                        _starttime,
+                        _endtime,
+                        _database,
+                        _pid,
+                        _nested_level,
+                        _queryid,
+                        _planid,
+                    )
+                    if _catalog is not None:
+                        _catalog.append_row(_info)
+                    else:
+                        _logindex.add(_seqid, _logfp.tell())
+                        _logfp.write("{},{},{},{},{},{},{},{}\n".format(*_info))
+
+                    _queue.put((_seqid, _queryid, _planid, _query, _plan, _plan_json))
+                    if _errors:
+                        break
+
+                _cur.close()
+                _from_seqid = _to_seqid
+        finally:
+            for _writer in _writers:
+                _queue.put(None)
+            for _writer in _writers:
+                _writer.join()
+            self.close_tables_segments()
+            if _catalog is None:
+                _logfp.close()
+                _logindex.close()
+            """
+            End the transaction that has only read the rows, and give the
+            connection back in its own mode, even if getting the rows failed.
+            """
+            if connection.closed == 0:
+                connection.rollback()
+                connection.autocommit = _autocommit
+        if _errors:
+            raise _errors[0]
 
         return _num_rows
 
@@ -134,7 +300,7 @@ class GetTables(MergePlan):
     Public method
     """
 
-    def get_tables(self, serverId):
+    def get_tables(self, serverId, itersize=None, chunk_size=None, connection=None):
         """
         Get new log data from query_plan.log table, and store the data
         into appropriate directories.
@@ -143,6 +309,14 @@ class GetTables(MergePlan):
         ----------
         serverId : str
           The serverId of the database server that is described in the hosts.conf.
+        itersize : int
+          The number of rows fetched at a time from the server-side cursor
+          (default: ITERSIZE).
+        chunk_size : int
+          If set, the rows are got by the seqid ranges of chunk_size.
+        connection : connection
+          If set, the rows are got through this connection, which is left
+          open; otherwise, a connection is made and closed in this method.
 
         Returns
         -------
@@ -159,10 +333,14 @@ class GetTables(MergePlan):
         self.__set_serverId(serverId)
 
         """Connect to DB server."""
-        db = Database(self.base_dir)
-        _conn = db.connect(serverId)
-        if Log.info <= self.LogLevel:
-            print("Info: Connection established to '{}'.".format(self.ServerId))
+        if connection is None:
+            db = Database(self.base_dir)
+            _conn = db.connect(serverId)
+            del db
+            if Log.info <= self.LogLevel:
+                print("Info: Connection established to '{}'.".format(self.ServerId))
+        else:
+            _conn = connection
         """Get max seqid."""
         _max_seqid = self.__get_max_seqid(_conn)
 
@@ -170,12 +348,36 @@ class GetTables(MergePlan):
         self.check_tables_dir(serverId)
         _current_seqid = self.get_seqid_from_tables_stat(serverId)
 
+        """
+        Recover from an interrupted get_tables(). The rows above the current
+        seqid are removed from log.csv, and their files are written again
+        when the rows are got again. In the catalog, such rows have never
+        been committed, so they are discarded if they are still pending in
+        this object. The .tmp files are left by the older versions, which
+        wrote the plans before adding the parallel worker's rows.
+        """
+        if self.has_catalog(serverId):
+            self.get_catalog(serverId).rollback()
+        else:
+            for _row in self.truncate_log_csv(serverId, _current_seqid):
+                _jpath = self.get_plan_json_path(
+                    serverId, int(_row[0]), int(_row[6]), int(_row[7])
+                )
+                if os.path.isfile(_jpath + ".tmp"):
+                    os.remove(_jpath + ".tmp")
+
         """Get data from log table and write to tables directory."""
         if Log.info <= self.LogLevel:
             print("Info: Getting query_plan.log table data.")
-        _num_rows = self.__get_log(_conn, _current_seqid, _max_seqid)
+        _num_rows = self.__get_log(
+            _conn,
+            _current_seqid,
+            _max_seqid,
+            self.ITERSIZE if itersize is None else itersize,
+            chunk_size,
+        )
         if _num_rows > 0:
-            self.add_workers_rows(serverId, _current_seqid, _max_seqid)
+            self.update_query_index(serverId)
             """Update the stat file."""
             self.update_tables_stat_file(serverId, _max_seqid)
         else:
@@ -184,10 +386,108 @@ class GetTables(MergePlan):
 
         """Commit transaction and Close database connection."""
         _conn.commit()
-        _conn.close()
-        if Log.info <= self.LogLevel:
-            print("Info: Connection closed.")
+        if connection is None:
+            _conn.close()
+            if Log.info <= self.LogLevel:
+                print("Info: Connection closed.")
+
+        return _num_rows
+
+    def migrate_tables(self, serverId):
+        """
+        Convert the tables dir of serverId to the segment-file layout, i.e.
+        pack the query, plan and plan_json files of each seqid into the
+        segment files, and remove them. After that, get_tables() appends
+        new rows to the segment files.
 
-        del db
+        The segment files are made in a temporary dir which is renamed at
+        last, so an interrupted migration can simply be run again.
+
+        Parameters
+        ----------
+        serverId : str
+          The serverId of the database server that is described in the hosts.conf.
+
+        Returns
+        -------
+        _num_rows : int
+           Return the number of migrated rows.
+        """
+
+        if self.check_serverId(serverId) == False:
+            if Log.error <= self.LogLevel:
+                print("Error: serverId '{}' is not registered.".format(serverId))
+            sys.exit(1)
+
+        self.__set_serverId(serverId)
+        self.check_tables_dir(serverId)
+
+        _num_rows = 0
+        _segdirpath = self.get_tables_segment_dir_path(self.ServerId)
+        if os.path.exists(_segdirpath):
+            if Log.info <= self.LogLevel:
+                print("Info: '{}' already uses segment files.".format(self.ServerId))
+        else:
+            _tmpdirpath = _segdirpath[:-1] + ".tmp/"
+            if os.path.exists(_tmpdirpath):
+                shutil.rmtree(_tmpdirpath)
+            os.mkdir(_tmpdirpath, self.DEFAULT_DIR_MODE)
+            _segments = {
+                _kind: self.new_tables_segment(_tmpdirpath, _kind)
+                for _kind in (
+                    self.TABLES_QUERY_DIR,
+                    self.TABLES_PLAN_DIR,
+                    self.TABLES_PLAN_JSON_DIR,
+                )
+            }
+
+            def read_text(path):
+                if os.path.isfile(path) == False:
+                    return None
+                return self.read_text(path)
+
+            for _row in self.read_log_csv(self.ServerId):
+                _seqid = int(_row[0])
+                _queryid = int(_row[6])
+                _planid = int(_row[7])
+                _query = read_text(
+                    self.get_query_dir_path(self.ServerId, _queryid) + str(_seqid)
+                )
+                _plan = read_text(
+                    self.get_plan_dir_path(self.ServerId, _queryid, _planid)
+                    + str(_seqid)
+                )
+                _jpath = self.get_plan_json_path(
+                    self.ServerId, _seqid, _queryid, _planid
+                )
+                """Read the plan_json left as .tmp as json to add the rows."""
+                _plan_json = read_text(_jpath)
+                if _plan_json is None and os.path.isfile(_jpath + ".tmp"):
+                    _plan_json = self.read_plan_json(_jpath + ".tmp")
+                if _plan_json is None:
+                    if Log.warning <= self.LogLevel:
+                        print("Warning: seqid({}) is not found.".format(_seqid))
+                    continue
+                self.__store_segments(_segments, _seqid, _query, _plan, _plan_json)
+                _num_rows += 1
+
+            for _segment in _segments.values():
+                _segment.close()
+            os.rename(_tmpdirpath, _segdirpath)
+
+        """Remove the files that have been packed."""
+        for _dir in (
+            self.TABLES_QUERY_DIR,
+            self.TABLES_PLAN_DIR,
+            self.TABLES_PLAN_JSON_DIR,
+        ):
+            _dirpath = self.dirpath([self.ServerId, self.TABLES_DIR, _dir])
+            if os.path.exists(_dirpath):
+                if Log.debug2 <= self.LogLevel:
+                    print("Debug2: rm dir '{}'".format(_dirpath))
+                shutil.rmtree(_dirpath)
+
+        if Log.info <= self.LogLevel:
+            print("Info: {} rows are migrated.".format(_num_rows))
 
         return _num_rows
@@ -7,15 +7,21 @@ grouping.py
   Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
 """
 
-import csv
+import copy
+import hashlib
+import heapq
+import json
+import math
 import os
+import struct
 import sys
 
 from .common import Common, Log
 from .repository import Repository
+from .sufficient_stats import SufficientStats
 
 
-class Grouping(Repository):
+class Grouping(Repository, SufficientStats):
     def __init__(self, base_dir=".", log_level=Log.info):
         self.ServerId = ""
         self.is_parallel = False
@@ -23,9 +29,15 @@ class Grouping(Repository):
         self.numPlanWorkers = 1
         self.set_base_dir(base_dir)
         self.LogLevel = log_level
+        self.__stores = {}
+        self.__stats = {}
+        self.__reservoirs = {}
+        self.__sample_cap = 0
+        self.__sample_decay = 0.0
 
     def __set_serverId(self, serverId):
         self.ServerId = serverId
+        self.set_plan_codec(serverId)
 
     UNNECESSARY_OBJECTS = (
         "I/O Read Time",
@@ -119,70 +131,490 @@ class Grouping(Repository):
                 del node[_i]
         return node
 
-    def __convert_to_list(self, Plans):
-        """Covert to the list type in order to append the object."""
+    """
+    Sample store
+
+    The grouped plan of each queryid+planid consists of the following files:
+
+      <queryid>.<planid>     : skeleton, i.e. the json plan whose grouping
+                               objects are null, with the layout of the
+                               samples (GROUPING_STORE_KEY), written once.
+      <queryid>.<planid>.rec : fixed-width records; each record is the seqid
+                               and the numeric grouping objects of a sample.
+      <queryid>.<planid>.ext : json lines of the other grouping objects,
+                               e.g. "Filter" and "Workers", of the samples.
+
+    Each grouping object is a slot [node number, key, kind], where the node
+    number is the index of Common.get_dict_list() and the kind is 'q' (int),
+    'd' (float) or 'j' (json). A numeric value whose type differs from the
+    kind of its slot is stored in the extra file as an override.
+
+    Since both the record file and the extra file are append-only, the cost
+    of adding a sample does not depend on the number of stored samples.
+    Repository.read_grouping_plan() restores the grouped plan.
+    """
 
-        def to_list(plan):
+    def __slot_kind(self, value):
+        if isinstance(value, bool):
+            return "j"
+        if isinstance(value, int):
+            return "q" if -(2 ** 63) <= value < 2 ** 63 else "j"
+        if isinstance(value, float):
+            return "d"
+        return "j"
+
+    def __make_skeleton(self, Plans, get_value):
+        """
+        Make the skeleton of Plans. The kind of each slot is decided by
+        get_value(value of the grouping object).
+        """
+        _skeleton = copy.deepcopy(Plans)
+        _slots = []
+        for _no, _plan in enumerate(self.get_dict_list(_skeleton)):
             for _go in self.GROUPING_OBJECTS:
-                if _go in plan:
-                    plan.update({_go: [plan[_go]]})
-
-        if isinstance(Plans, list):
-            for _plan in Plans:
-                to_list(_plan)
-                if "Plans" in _plan:
-                    self.__convert_to_list(_plan["Plans"])
-            return
+                if _go in _plan:
+                    _slots.append([_no, _go, self.__slot_kind(get_value(_plan[_go]))])
+                    _plan[_go] = None
+        _format = "<q" + "".join([_s[2] for _s in _slots if _s[2] != "j"])
+        _skeleton[self.GROUPING_STORE_KEY] = {"Slots": _slots, "Format": _format}
+        return _skeleton
+
+    def __get_values(self, store, Plans, get_value):
+        _dicts = self.get_dict_list(Plans)
+        return [
+            get_value(_dicts[_no][_key]) if _key in _dicts[_no] else None
+            for (_no, _key, _kind) in store["Slots"]
+        ]
+
+    def __pack_sample(self, store, values, seqid):
+        """Return the fields of the record, the extra values and the overrides."""
+        _fields = [seqid]
+        _extra = []
+        _override = {}
+        for _i, (_no, _key, _kind) in enumerate(store["Slots"]):
+            _value = values[_i]
+            if _kind == "j":
+                _extra.append(_value)
+            elif self.__slot_kind(_value) == _kind:
+                _fields.append(_value)
+            else:
+                _fields.append(0)
+                _override[str(_i)] = _value
+        return (_fields, _extra, _override)
+
+    def __append_sample(self, planpath, store, values, seqid):
+        """
+        Append a sample to the record file and the extra file.
+        If seqid is not greater than the seqid of the last record, the sample
+        has already been appended, so nothing is done. (seqid=0 is always
+        appended.)
+        """
+        _struct = struct.Struct(store["Format"])
+        (_fields, _extra, _override) = self.__pack_sample(store, values, seqid)
+
+        with open(planpath + self.GROUPING_RECORD_EXT, "a+b") as _fp:
+            _size = _fp.seek(0, os.SEEK_END)
+            if _size % _struct.size != 0:
+                """Discard the torn record."""
+                _size -= _size % _struct.size
+                _fp.truncate(_size)
+            if 0 < _size and 0 < seqid:
+                _fp.seek(_size - _struct.size)
+                (_last_seqid,) = struct.unpack("<q", _fp.read(8))
+                if seqid <= _last_seqid:
+                    return
+            """
+            Write the extra line first, so that each record has its extra
+            line even if the process is interrupted.
+            """
+            if 0 < len(_extra) or 0 < len(_override):
+                with open(planpath + self.GROUPING_EXTRA_EXT, "a") as _efp:
+                    _efp.write(
+                        json.dumps(
+                            [_size // _struct.size, _extra, _override],
+                            ensure_ascii=False,
+                        )
+                        + "\n"
+                    )
+            _fp.write(_struct.pack(*_fields))
+
+    def __convert_grouped_plan(self, planpath, Plans):
+        """
+        Convert the grouped plan stored by the previous versions, whose
+        grouping objects are lists, to the sample store.
+        """
+        _skeleton = self.__make_skeleton(Plans, lambda v: v[0] if v else None)
+        _store = _skeleton[self.GROUPING_STORE_KEY]
+        for _ext in (
+            self.GROUPING_RECORD_EXT,
+            self.GROUPING_EXTRA_EXT,
+            self.GROUPING_RESERVOIR_EXT,
+        ):
+            if os.path.exists(planpath + _ext):
+                os.remove(planpath + _ext)
+        _num = 0
+        if 0 < len(_store["Slots"]):
+            (_no, _key, _kind) = _store["Slots"][0]
+            _num = len(self.get_dict_list(Plans)[_no][_key])
+        for _r in range(0, _num):
+            _values = self.__get_values(_store, Plans, lambda v: v[_r])
+            self.__append_sample(planpath, _store, _values, 0)
+        """Replace the grouped plan with the skeleton at last."""
+        self.write_plan_json(_skeleton, planpath + ".tmp")
+        os.replace(planpath + ".tmp", planpath)
+        return _store
+
+    def __get_store(self, planpath, Plans):
+        """Return the layout of the samples of planpath, creating it if not found."""
+        if planpath in self.__stores:
+            return self.__stores[planpath]
+        if os.path.exists(planpath):
+            _json_dict = self.read_plan_json(planpath)
+            if self.GROUPING_STORE_KEY in _json_dict:
+                _store = _json_dict[self.GROUPING_STORE_KEY]
+            else:
+                if Log.debug1 <= self.LogLevel:
+                    print("Debug1: convert {} to the sample store.".format(planpath))
+                _store = self.__convert_grouped_plan(planpath, _json_dict)
         else:
-            to_list(Plans)
-            if "Plan" in Plans:
-                self.__convert_to_list(Plans["Plan"])
-            if "Plans" in Plans:
-                self.__convert_to_list(Plans["Plans"])
+            for _ext in (
+                self.GROUPING_RECORD_EXT,
+                self.GROUPING_EXTRA_EXT,
+                self.GROUPING_RESERVOIR_EXT,
+            ):
+                if os.path.exists(planpath + _ext):
+                    os.remove(planpath + _ext)
+            _skeleton = self.__make_skeleton(Plans, lambda v: v)
+            self.write_plan_json(_skeleton, planpath)
+            _store = _skeleton[self.GROUPING_STORE_KEY]
+        self.__stores[planpath] = _store
+        return _store
+
+    def __get_stats(self, planpath, store):
+        """
+        Return the sufficient statistics of planpath. If not found, they are
+        made from all samples stored so far.
+        """
+        if planpath in self.__stats:
+            return self.__stats[planpath]
+        _stats = self.read_grouping_stats(planpath)
+        if _stats is None:
+            _json_dict = self.read_grouping_plan(planpath)
+            _stats = self.new_statistics(_json_dict)
+            self.update_statistics(
+                _stats, _json_dict, self.get_grouping_last_seqid(planpath, store)
+            )
+            self.__dirty_stats.add(planpath)
+        self.__stats[planpath] = _stats
+        return _stats
+
+    """
+    Sample cap
+
+    If sample_cap is set to the server (see
+    Repository.get_grouping_sample_policy()), each grouped plan keeps at
+    most sample_cap samples. Each sample has a key, and when the store is
+    full, a new sample replaces the sample whose key is the lowest if its
+    key is higher. The key of the n-th sample of a plan is
+
+      key = decay * n - ln(-ln(u))
+
+    where u is a uniform random number in (0, 1) hashed from its seqid.
+    If decay is 0 ('reservoir'), the kept samples are a uniform random
+    sample of all samples seen; otherwise ('decay'), they are a weighted
+    random sample whose weights are exp(decay * n), i.e. the weight of a
+    sample is halved every sample_half_life executions. Since u is hashed
+    from seqid, the kept samples do not depend on jobs.
+
+    The state is stored in <queryid>.<planid>.res:
+
+      header : the number of the samples seen, the seqid of the last one,
+               and the number of the lines of the extra file ("<qqq").
+      keys   : the key of each record ("<d").
+
+    A replaced record is overwritten in place and its extra line is
+    appended, so the extra file is compacted when it has grown.
+    The statistics of the touched plans are made from the kept samples.
+    """
+
+    RESERVOIR_HEADER = struct.Struct("<qqq")
+    RESERVOIR_KEY = struct.Struct("<d")
+
+    def __sample_key(self, seqid, n):
+        _h = hashlib.blake2b(struct.pack("<q", seqid), digest_size=8).digest()
+        _u = ((int.from_bytes(_h, "little") >> 12) * 2 + 1) / 2.0 ** 53
+        return self.__sample_decay * n - math.log(-math.log(_u))
+
+    def __read_records(self, planpath, store):
+        """Return the records in the record file; a torn record is ignored."""
+        _struct = struct.Struct(store["Format"])
+        _data = b""
+        if os.path.exists(planpath + self.GROUPING_RECORD_EXT):
+            with open(planpath + self.GROUPING_RECORD_EXT, "rb") as _fp:
+                _data = _fp.read()
+        _num = len(_data) // _struct.size
+        return list(_struct.iter_unpack(_data[: _num * _struct.size]))
+
+    def __read_extra_lines(self, planpath):
+        """Return {record number: [extra, override]}; the last line wins."""
+        _lines = {}
+        if os.path.exists(planpath + self.GROUPING_EXTRA_EXT):
+            with open(planpath + self.GROUPING_EXTRA_EXT, "r") as _fp:
+                for _line in _fp:
+                    try:
+                        (_no, _extra, _override) = json.loads(_line)
+                    except ValueError:
+                        continue
+                    _lines[_no] = [_extra, _override]
+        return _lines
+
+    def __write_reservoir(self, planpath, res, slots=None):
+        """
+        Write the header and the keys of slots of res to the reservoir file.
+        If slots is None, the whole file is rewritten.
+        """
+        _path = planpath + self.GROUPING_RESERVOIR_EXT
+        _header = self.RESERVOIR_HEADER.pack(res["Seen"], res["Seqid"], res["Lines"])
+        if slots is None:
+            with open(_path + ".tmp", "wb") as _fp:
+                _fp.write(_header)
+                for _key in res["Keys"]:
+                    _fp.write(self.RESERVOIR_KEY.pack(_key))
+            os.replace(_path + ".tmp", _path)
             return
+        with open(_path, "r+b") as _fp:
+            for _slot in slots:
+                _fp.seek(self.RESERVOIR_HEADER.size + _slot * self.RESERVOIR_KEY.size)
+                _fp.write(self.RESERVOIR_KEY.pack(res["Keys"][_slot]))
+            _fp.seek(0)
+            _fp.write(_header)
+
+    def __compact_samples(self, planpath, store, res, slots):
+        """
+        Rewrite the record file and the extra file so that they have the
+        records of slots only, and one extra line per record at most.
+        """
+        _struct = struct.Struct(store["Format"])
+        _records = self.__read_records(planpath, store)
+        _lines = self.__read_extra_lines(planpath)
+        _keys = res["Keys"]
+        res["Keys"] = []
+        res["Lines"] = 0
+        _rpath = planpath + self.GROUPING_RECORD_EXT
+        _epath = planpath + self.GROUPING_EXTRA_EXT
+        with open(_rpath + ".tmp", "wb") as _fp, open(_epath + ".tmp", "w") as _efp:
+            for _no, _slot in enumerate(slots):
+                _fp.write(_struct.pack(*_records[_slot]))
+                if _slot in _lines and (_lines[_slot][0] or _lines[_slot][1]):
+                    _efp.write(
+                        json.dumps([_no] + _lines[_slot], ensure_ascii=False) + "\n"
+                    )
+                    res["Lines"] += 1
+                res["Keys"].append(_keys[_slot])
+        os.replace(_epath + ".tmp", _epath)
+        os.replace(_rpath + ".tmp", _rpath)
+        self.__write_reservoir(planpath, res)
 
-    def __append_objects(self, target_Plans, Plans):
-        def append_value_to_list(targetplan, plan):
-            for _go in self.GROUPING_OBJECTS:
-                if _go in targetplan:
-                    targetplan[_go] += plan[_go]
-
-        if isinstance(target_Plans, list):
-            for _i in range(0, len(target_Plans)):
-                append_value_to_list(target_Plans[_i], Plans[_i])
-                if "Plans" in target_Plans[_i]:
-                    self.__append_objects(target_Plans[_i]["Plans"], Plans[_i]["Plans"])
+    def __get_reservoir(self, planpath, store):
+        """
+        Return the state of the capped samples of planpath. If the reservoir
+        file is not found or does not match the record file, e.g. the
+        samples were stored without the cap, it is made from the records.
+        """
+        if planpath in self.__reservoirs:
+            return self.__reservoirs[planpath]
+
+        _res = {"Seen": 0, "Seqid": 0, "Lines": 0, "Keys": []}
+        _path = planpath + self.GROUPING_RESERVOIR_EXT
+        if os.path.exists(_path):
+            with open(_path, "rb") as _fp:
+                _data = _fp.read()
+            if self.RESERVOIR_HEADER.size <= len(_data):
+                (_res["Seen"], _res["Seqid"], _res["Lines"]) = (
+                    self.RESERVOIR_HEADER.unpack_from(_data)
+                )
+                _data = _data[self.RESERVOIR_HEADER.size :]
+                _data = _data[: len(_data) - len(_data) % self.RESERVOIR_KEY.size]
+                _res["Keys"] = [_k for (_k,) in self.RESERVOIR_KEY.iter_unpack(_data)]
+
+        _num = 0
+        if os.path.exists(planpath + self.GROUPING_RECORD_EXT):
+            _num = os.path.getsize(planpath + self.GROUPING_RECORD_EXT)
+            _num //= struct.calcsize(store["Format"])
+        if os.path.exists(_path) == False or len(_res["Keys"]) != _num:
+            _records = self.__read_records(planpath, store)
+            _res["Seen"] = max(_res["Seen"], len(_records))
+            _res["Seqid"] = max([_res["Seqid"]] + [_r[0] for _r in _records])
+            _res["Lines"] = len(self.__read_extra_lines(planpath))
+            _res["Keys"] = [
+                self.__sample_key(_r[0], _n + 1) for _n, _r in enumerate(_records)
+            ]
+            self.__write_reservoir(planpath, _res)
+
+        _keys = _res["Keys"]
+        if self.__sample_cap < len(_keys):
+            """Keep the samples whose keys are the highest, in the stored order."""
+            _slots = heapq.nlargest(
+                self.__sample_cap, range(len(_keys)), key=_keys.__getitem__
+            )
+            self.__compact_samples(planpath, store, _res, sorted(_slots))
+
+        _res["Heap"] = [(_k, _slot) for _slot, _k in enumerate(_res["Keys"])]
+        heapq.heapify(_res["Heap"])
+        self.__reservoirs[planpath] = _res
+        return _res
+
+    def __write_sample(self, planpath, store, values, seqid, slot, res):
+        """Write a sample to slot of the record file, appending its extra line."""
+        _struct = struct.Struct(store["Format"])
+        (_fields, _extra, _override) = self.__pack_sample(store, values, seqid)
+        _rpath = planpath + self.GROUPING_RECORD_EXT
+        with open(_rpath, "r+b" if os.path.exists(_rpath) else "w+b") as _fp:
+            _size = _fp.seek(0, os.SEEK_END)
+            """The extra line of a replaced record must supersede the old one."""
+            if slot * _struct.size < _size or 0 < len(_extra) or 0 < len(_override):
+                with open(planpath + self.GROUPING_EXTRA_EXT, "a") as _efp:
+                    _efp.write(
+                        json.dumps([slot, _extra, _override], ensure_ascii=False) + "\n"
+                    )
+                res["Lines"] += 1
+            _fp.seek(slot * _struct.size)
+            _fp.write(_struct.pack(*_fields))
+
+    def __sample(self, planpath, store, values, seqid):
+        """Add a sample to the capped samples of planpath."""
+        _res = self.__get_reservoir(planpath, store)
+        if seqid <= _res["Seqid"]:
             return
+        _res["Seen"] += 1
+        _res["Seqid"] = seqid
+        _key = self.__sample_key(seqid, _res["Seen"])
+        _keys = _res["Keys"]
+        if len(_keys) < self.__sample_cap:
+            _slot = len(_keys)
+            _keys.append(_key)
+            heapq.heappush(_res["Heap"], (_key, _slot))
+        elif _res["Heap"][0][0] < _key:
+            _slot = _res["Heap"][0][1]
+            _keys[_slot] = _key
+            heapq.heapreplace(_res["Heap"], (_key, _slot))
         else:
-            append_value_to_list(target_Plans, Plans)
-            if "Plan" in target_Plans:
-                self.__append_objects(target_Plans["Plan"], Plans["Plan"])
-            if "Plans" in target_Plans:
-                self.__append_objects(target_Plans["Plans"], Plans["Plans"])
+            """The sample is not kept."""
+            self.__write_reservoir(planpath, _res, [])
             return
+        self.__write_sample(planpath, store, values, seqid, _slot, _res)
+        self.__write_reservoir(planpath, _res, [_slot])
 
-    def __combine_plan(self, planpath, logpath):
-        """Combine the plan (planpath) with the combined plan (logpath)."""
-
-        _json_dict = self.read_plan_json(logpath)
+    def __update_capped_stats(self, planpath):
+        """
+        Compact the extra file of planpath if it has grown, and Make the
+        statistics from the kept samples.
+        """
+        _store = self.__stores[planpath]
+        _res = self.__reservoirs[planpath]
+        if 2 * max(self.__sample_cap, 1) < _res["Lines"]:
+            self.__compact_samples(
+                planpath, _store, _res, list(range(len(_res["Keys"])))
+            )
+        _json_dict = self.read_grouping_plan(planpath)
+        _stats = self.new_statistics(_json_dict)
+        self.update_statistics(_stats, _json_dict, _res["Seqid"])
+        self.__stats[planpath] = _stats
+        self.__dirty_stats.add(planpath)
+
+    def __combine_plan(self, planpath, json_dict, seqid):
+        """Append the plan (json_dict) of seqid to the grouped plan (planpath)."""
+
+        _json_dict = json_dict
         self.delete_unnecessary_objects(self.__delete_objects, _json_dict)
-        self.__convert_to_list(_json_dict)
-        if os.path.exists(planpath):
-            _target_json_dict = self.read_plan_json(planpath)
-            self.__append_objects(_target_json_dict, _json_dict)
-            self.write_plan_json(_target_json_dict, planpath)
-        else:
-            self.write_plan_json(_json_dict, planpath)
+        _store = self.__get_store(planpath, _json_dict)
+        _values = self.__get_values(_store, _json_dict, lambda v: v)
+        if 0 < self.__sample_cap:
+            """The statistics are made after all rows are processed."""
+            self.__sample(planpath, _store, _values, seqid)
+            return
+        self.__append_sample(planpath, _store, _values, seqid)
+
+        """Add the sample to the statistics unless it has been added."""
+        _stats = self.__get_stats(planpath, _store)
+        if _stats["Seqid"] < seqid:
+            self.update_statistics(_stats, _json_dict, seqid)
+            self.__dirty_stats.add(planpath)
 
     """
     Public method
     """
 
-    def grouping(self, serverId):
+    def grouping_rows(self, serverId, rows):
+        """
+        Append the json plans of rows to the grouped plans, and Write their
+        statistics. Return the set of the touched plans (subdir, filename).
+
+        This is called by grouping() directly or by its workers, one call
+        per set of hash subdirs.
+
+        Parameters
+        ----------
+        serverId : str
+        rows : list of (seqid, queryid, planid)
+          The rows of log.csv in seqid order.
+        """
+        self.__set_serverId(serverId)
+        self.__stores = {}
+        self.__stats = {}
+        self.__reservoirs = {}
+        self.__dirty_stats = set()
+        (self.__sample_cap, self.__sample_decay) = self.get_grouping_sample_policy(
+            serverId
+        )
+        _touched = set()
+
+        for (_seqid, _queryid, _planid) in rows:
+            """
+            Read the plan (_queryid and _planid) that is stored in the Tables dir.
+            """
+            _json_dict = self.read_tables_plan_json(
+                self.ServerId, _seqid, _queryid, _planid
+            )
+
+            if _json_dict is None:
+                if Log.debug1 <= self.LogLevel:
+                    print("Debug1: seqid({}) is not found.)".format(_seqid))
+                continue
+            """
+            Get the path of the combined plan (_queryid and _planid),
+            stored in the Grouping dir.
+            """
+            _plandirpath = self.get_grouping_plan_dir_path(self.ServerId, _planid)
+            _planpath = self.get_grouping_plan_path(self.ServerId, _queryid, _planid)
+            if os.path.exists(_plandirpath) == False:
+                os.mkdir(_plandirpath)
+            """
+            Append the plan (_json_dict) to the grouped plan (_planpath).
+            """
+            self.__combine_plan(_planpath, _json_dict, _seqid)
+            _touched.add((self.hash_dir(_planid), str(_queryid) + "." + str(_planid)))
+            if Log.debug3 <= self.LogLevel:
+                print("Debug3: planpath={}".format(_planpath))
+                print("Debug3:    seqid={}".format(_seqid))
+
+        """Write the updated statistics."""
+        for _planpath in self.__reservoirs:
+            self.__update_capped_stats(_planpath)
+        for _planpath in self.__dirty_stats:
+            self.write_grouping_stats(self.__stats[_planpath], _planpath)
+
+        return _touched
+
+    def grouping(self, serverId, jobs=1):
         """
         Combine the json plans with the same queryId+planId, which are stored
         in the Tables directory, into one json plan, and store it under the
         Grouping directory.
+
+        If jobs is greater than 1, the hash subdirs are processed by a pool of
+        jobs processes. Since the plans in a hash subdir are processed by one
+        process in seqid order, the results are the same as jobs=1.
         """
 
         if self.check_serverId(serverId) == False:
@@ -209,46 +641,37 @@ class Grouping(Repository):
         Read log.csv to get the queryid and planid between current_seqid
         and max_seqid.
         """
-        with open(self.get_log_csv_path(self.ServerId), newline="") as f:
-            _reader = csv.reader(f, delimiter=",", quoting=csv.QUOTE_NONE)
-
-            for _row in _reader:
-                _seqid = int(_row[0])
-                _queryid = int(_row[6])
-                _planid = int(_row[7])
-
-                if _current_seqid < _seqid and _seqid <= _max_seqid:
-                    """
-                    Get the path of the combined plan (_queryid and _planid),
-                    stored in the Grouping dir.
-                    """
-                    _logpath = self.get_plan_json_path(
-                        self.ServerId, _seqid, _queryid, _planid
-                    )
+        _rows = []
+        for _row in self.read_log_csv(self.ServerId, _current_seqid, _max_seqid):
+            _rows.append((int(_row[0]), int(_row[6]), int(_row[7])))
 
-                    if os.path.isfile(_logpath) == False:
-                        if Log.debug1 <= self.LogLevel:
-                            print("Debug1: seqid({}) is not found.)".format(_seqid))
-                        continue
-                    """
-                    Get the path of the plan (_queryid and _planid) that is stored
-                    in the Tables dir.
-                    """
-                    _plandirpath = self.get_grouping_plan_dir_path(
-                        self.ServerId, _planid
-                    )
-                    _planpath = self.get_grouping_plan_path(
-                        self.ServerId, _queryid, _planid
-                    )
-                    if os.path.exists(_plandirpath) == False:
-                        os.mkdir(_plandirpath)
-                    """
-                    Combine the plan (_planpath) with the combined plan (_logpath).
-                    """
-                    self.__combine_plan(_planpath, _logpath)
-                    if Log.debug3 <= self.LogLevel:
-                        print("Debug3: planpath={}".format(_planpath))
-                        print("Debug3:    logpath={}".format(_logpath))
-
-            """Update grouping/stat.dat."""
-            self.update_grouping_stat_file(self.ServerId, _max_seqid)
+        _touched = set()
+        if jobs <= 1:
+            _touched = self.grouping_rows(self.ServerId, _rows)
+        else:
+            """Divide the rows by the hash subdir."""
+            _buckets = {}
+            for _row in _rows:
+                _buckets.setdefault(self.hash_dir(_row[2]), []).append(_row)
+            _tasks = [
+                (self.base_dir[:-1], self.LogLevel, self.ServerId, _buckets[_b])
+                for _b in sorted(_buckets)
+            ]
+            for _t in self.run_jobs(grouping_worker, _tasks, jobs):
+                _touched |= _t
+
+        """
+        Write the manifest of the touched plans, and Update grouping/stat.dat
+        after all rows are processed.
+        """
+        self.write_grouping_manifest(
+            self.ServerId, _current_seqid, _max_seqid, _touched
+        )
+        self.update_grouping_stat_file(self.ServerId, _max_seqid)
+
+
+def grouping_worker(task):
+    """Run Grouping.grouping_rows() in a worker process of Grouping.grouping()."""
+    (_base_dir, _log_level, _serverId, _rows) = task
+    _gp = Grouping(_base_dir, log_level=_log_level)
+    return _gp.grouping_rows(_serverId, _rows)
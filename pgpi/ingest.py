@@ -0,0 +1,313 @@
+"""
+ingest.py
+
+This file defines Ingest, which gets the rows from the servers and
+updates their grouping and regression, i.e. runs the stages of
+'repo_mgr.py get', for several servers concurrently, or for a server
+continuously.
+
+
+  Formatted by black (https://pypi.org/project/black/)
+
+  Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
+"""
+
+import concurrent.futures
+import signal
+import sys
+import threading
+import time
+
+from .common import Log
+from .database import Database
+from .get_tables import GetTables
+from .grouping import Grouping
+from .regression import Regression
+from .repository import Repository
+
+
+class Ingest(Repository):
+    """The stages run for each server, in this order."""
+
+    STAGES = ("get_tables", "grouping", "regression")
+
+    """Default interval in seconds to poll the query_plan.log table in follow()."""
+    FOLLOW_INTERVAL = 10
+
+    def __init__(self, base_dir=".", log_level=Log.info):
+        self.set_base_dir(base_dir)
+        self.LogLevel = log_level
+
+    def __run_stage(self, result, stage, func, *args, **kwargs):
+        _start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            result[stage] = time.perf_counter() - _start
+
+    """
+    Public methods
+    """
+
+    def get_serverId_list(self):
+        """Return the list of the serverIds in the hosts.conf."""
+        _config = self.get_hosts_conf()
+        return [_s for _s in _config.sections() if "host" in _config[_s]]
+
+    def ingest_server(self, serverId, jobs=1):
+        """
+        Get the rows from serverId, and update its grouping and regression
+        if there are new rows.
+
+        Parameters
+        ----------
+        serverId : str
+          The serverId of the database server that is described in the hosts.conf.
+        jobs : int
+          Number of processes for grouping and regression.
+
+        Returns
+        -------
+        _result : dict
+          {"rows": the number of the got rows, <stage>: elapsed seconds}.
+          If a stage fails, "error" and "stage" are set, and the stages
+          after it are not run.
+        """
+        _result = {"rows": 0}
+        _stage = self.STAGES[0]
+        try:
+            _gt = GetTables(self.base_dir, log_level=self.LogLevel)
+            _result["rows"] = self.__run_stage(
+                _result, _stage, _gt.get_tables, serverId
+            )
+            if _result["rows"] > 0:
+                _stage = self.STAGES[1]
+                _gp = Grouping(self.base_dir, log_level=self.LogLevel)
+                self.__run_stage(_result, _stage, _gp.grouping, serverId, jobs=jobs)
+                _stage = self.STAGES[2]
+                _rg = Regression(self.base_dir, log_level=self.LogLevel)
+                self.__run_stage(_result, _stage, _rg.regression, serverId, jobs=jobs)
+        except (Exception, SystemExit) as err:
+            """SystemExit is raised after the error has been shown."""
+            _result["stage"] = _stage
+            _result["error"] = "" if isinstance(err, SystemExit) else str(err).strip()
+        return _result
+
+    def ingest(self, serverIds=None, workers=1, jobs=1):
+        """
+        Run ingest_server() for each server in serverIds by a pool of
+        workers processes. An error in a server does not stop the others.
+
+        Parameters
+        ----------
+        serverIds : list
+          The serverIds to be ingested. If None, all the servers in the
+          hosts.conf are ingested.
+        workers : int
+          Number of servers ingested concurrently.
+        jobs : int
+          Number of processes for grouping and regression of each server.
+
+        Returns
+        -------
+        _summary : dict
+          {serverId: the result of ingest_server()}.
+        """
+
+        if serverIds is None:
+            serverIds = self.get_serverId_list()
+        for _serverId in serverIds:
+            if self.check_serverId(_serverId) == False:
+                if Log.error <= self.LogLevel:
+                    print("Error: serverId '{}' is not registered.".format(_serverId))
+                sys.exit(1)
+        if not serverIds:
+            if Log.info <= self.LogLevel:
+                print("Info: There is no server.")
+            return {}
+
+        _tasks = [
+            (self.base_dir, self.LogLevel, _serverId, jobs) for _serverId in serverIds
+        ]
+        _summary = {}
+        if workers <= 1 or len(_tasks) <= 1:
+            for _task in _tasks:
+                _summary[_task[2]] = ingest_worker(_task)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(workers, len(_tasks))
+            ) as _pool:
+                _futures = {_pool.submit(ingest_worker, _t): _t[2] for _t in _tasks}
+                for _future in concurrent.futures.as_completed(_futures):
+                    _serverId = _futures[_future]
+                    try:
+                        _summary[_serverId] = _future.result()
+                    except Exception as err:
+                        """The worker process has died, e.g. killed by a signal."""
+                        _summary[_serverId] = {
+                            "rows": 0,
+                            "stage": "worker",
+                            "error": str(err).strip(),
+                        }
+
+        _summary = {_serverId: _summary[_serverId] for _serverId in serverIds}
+
+        """
+        Show the summary.
+        """
+        _failed = [_s for _s in serverIds if "error" in _summary[_s]]
+        if Log.info <= self.LogLevel:
+            print("Info: Summary:")
+            for _serverId in serverIds:
+                _result = _summary[_serverId]
+                _timings = ", ".join(
+                    "{} {:.2f}s".format(_stage, _result[_stage])
+                    for _stage in self.STAGES
+                    if _stage in _result
+                )
+                if "error" in _result:
+                    print(
+                        "\t{}: failed in {}{} ({})".format(
+                            _serverId,
+                            _result["stage"],
+                            ": " + _result["error"] if _result["error"] else "",
+                            _timings,
+                        )
+                    )
+                else:
+                    print(
+                        "\t{}: {} rows ({})".format(
+                            _serverId, _result["rows"], _timings
+                        )
+                    )
+        if _failed and Log.error <= self.LogLevel:
+            print(
+                "Error: Could not ingest {} of {} servers: {}".format(
+                    len(_failed), len(serverIds), ", ".join(_failed)
+                )
+            )
+
+        return _summary
+
+    def follow(self, serverId, interval=None, jobs=1):
+        """
+        Poll the query_plan.log table of serverId every interval seconds,
+        and run the new rows through grouping and regression as soon as
+        they are got, until SIGINT or SIGTERM is received.
+
+        Unlike running 'repo_mgr.py get' periodically, one connection and
+        one object of each stage are kept during the loop. Since each stage
+        processes only the rows after its stat file, each batch costs only
+        the new rows. The signals are deferred until the current batch is
+        done, so the stages are never interrupted.
+
+        If the connection is lost, it is made again at the next poll.
+
+        Parameters
+        ----------
+        serverId : str
+          The serverId of the database server that is described in the hosts.conf.
+        interval : float
+          Seconds between polls (default: FOLLOW_INTERVAL).
+        jobs : int
+          Number of processes for grouping and regression.
+
+        Returns
+        -------
+        _num_rows : int
+          The total number of the got rows.
+        """
+
+        if self.check_serverId(serverId) == False:
+            if Log.error <= self.LogLevel:
+                print("Error: serverId '{}' is not registered.".format(serverId))
+            sys.exit(1)
+        if interval is None:
+            interval = self.FOLLOW_INTERVAL
+
+        """The messages of each poll are suppressed unless rows are got."""
+        _gt = GetTables(self.base_dir, log_level=min(self.LogLevel, Log.notice))
+        _gp = Grouping(self.base_dir, log_level=min(self.LogLevel, Log.notice))
+        _rg = Regression(self.base_dir, log_level=min(self.LogLevel, Log.notice))
+        _db = Database(self.base_dir, log_level=self.LogLevel)
+
+        _stop = threading.Event()
+
+        def stop(signum, frame):
+            _stop.set()
+
+        _handlers = {
+            _sig: signal.signal(_sig, stop) for _sig in (signal.SIGINT, signal.SIGTERM)
+        }
+
+        _conn = _db.connect(serverId)
+        if Log.info <= self.LogLevel:
+            print("Info: Following '{}' every {} seconds.".format(serverId, interval))
+
+        _num_rows = 0
+        try:
+            while _stop.is_set() == False:
+                if _conn is None:
+                    try:
+                        _conn = _db.connect(serverId)
+                    except SystemExit:
+                        _stop.wait(interval)
+                        continue
+                    if Log.info <= self.LogLevel:
+                        print("Info: Connection established to '{}'.".format(serverId))
+
+                _result = {"rows": 0}
+                try:
+                    _result["rows"] = self.__run_stage(
+                        _result,
+                        self.STAGES[0],
+                        _gt.get_tables,
+                        serverId,
+                        connection=_conn,
+                    )
+                except (Exception, SystemExit):
+                    if _conn.closed == 0:
+                        raise
+                    if Log.warning <= self.LogLevel:
+                        print("Warning: Connection to '{}' is lost.".format(serverId))
+                    _conn = None
+                    _stop.wait(interval)
+                    continue
+
+                if _result["rows"] > 0:
+                    self.__run_stage(
+                        _result, self.STAGES[1], _gp.grouping, serverId, jobs=jobs
+                    )
+                    self.__run_stage(
+                        _result, self.STAGES[2], _rg.regression, serverId, jobs=jobs
+                    )
+                    _num_rows += _result["rows"]
+                    if Log.info <= self.LogLevel:
+                        print(
+                            "Info: {} rows ({}).".format(
+                                _result["rows"],
+                                ", ".join(
+                                    "{} {:.2f}s".format(_stage, _result[_stage])
+                                    for _stage in self.STAGES
+                                ),
+                            )
+                        )
+
+                _stop.wait(interval)
+        finally:
+            for (_sig, _handler) in _handlers.items():
+                signal.signal(_sig, _handler)
+            if _conn is not None:
+                _conn.close()
+
+        if Log.info <= self.LogLevel:
+            print("Info: Stopped following '{}': {} rows.".format(serverId, _num_rows))
+
+        return _num_rows
+
+
+def ingest_worker(task):
+    """Run Ingest.ingest_server() in a worker process of Ingest.ingest()."""
+    (_base_dir, _log_level, _serverId, _jobs) = task
+    _ig = Ingest(_base_dir, log_level=_log_level)
+    return _ig.ingest_server(_serverId, jobs=_jobs)
@@ -0,0 +1,101 @@
+"""
+log_index.py
+
+This file defines a sparse seqid index of log.csv, which lets the readers
+of log.csv seek to the first row they need instead of reading all rows.
+
+
+  Formatted by black (https://pypi.org/project/black/)
+
+  Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
+"""
+
+import bisect
+import os
+import struct
+
+
+class LogIndex:
+    """
+    A sparse index of log.csv, which is stored in idxpath.
+
+    An entry (max_seqid, offset) is appended every INTERVAL rows, where
+    offset is the byte offset of a row in log.csv and max_seqid is the max
+    seqid of all the rows before offset. Since max_seqid never decreases,
+    the offset from which the rows whose seqids are greater than a seqid
+    are found can be bisected, even if some rows are stored twice, e.g.
+    after a crash of get_tables().
+    """
+
+    FORMAT = "<qq"
+    SIZE = struct.calcsize(FORMAT)
+    INTERVAL = 1024
+
+    def __init__(self, csvpath, idxpath):
+        self.csvpath = csvpath
+        self.idxpath = idxpath
+        self.__idxfp = None
+        self.__max_seqid = 0
+        self.__num_rows = 0
+
+    def __read_entries(self):
+        if os.path.exists(self.idxpath) == False:
+            return []
+        with open(self.idxpath, "rb") as _fp:
+            _data = _fp.read()
+        """Ignore the torn entry at the end, if any."""
+        _data = _data[: len(_data) - len(_data) % self.SIZE]
+        _size = os.path.getsize(self.csvpath) if os.path.exists(self.csvpath) else 0
+        return [_e for _e in struct.iter_unpack(self.FORMAT, _data) if _e[1] <= _size]
+
+    def __add_entry(self, offset):
+        self.__idxfp.write(struct.pack(self.FORMAT, self.__max_seqid, offset))
+        self.__num_rows = 0
+
+    """
+    Public methods
+    """
+
+    def find_offset(self, seqid):
+        """
+        Return the byte offset of log.csv from which all the rows whose
+        seqids are greater than seqid are found.
+        """
+        _entries = self.__read_entries()
+        _i = bisect.bisect_right([_e[0] for _e in _entries], seqid)
+        return 0 if _i == 0 else _entries[_i - 1][1]
+
+    def open(self):
+        """
+        Open the index to append entries. The rows after the last entry,
+        i.e. the rows appended without the index, are indexed here.
+        """
+        _entries = self.__read_entries()
+        (self.__max_seqid, _offset) = (0, 0) if not _entries else _entries[-1]
+        self.__idxfp = open(self.idxpath, "ab")
+        self.__idxfp.truncate(len(_entries) * self.SIZE)
+        self.__idxfp.seek(0, os.SEEK_END)
+        self.__num_rows = 0
+        if os.path.exists(self.csvpath):
+            with open(self.csvpath, "rb") as _fp:
+                _fp.seek(_offset)
+                for _line in _fp:
+                    if self.INTERVAL <= self.__num_rows:
+                        self.__add_entry(_offset)
+                    _seqid = _line.split(b",", 1)[0]
+                    if _seqid.isdigit():
+                        self.__max_seqid = max(self.__max_seqid, int(_seqid))
+                    self.__num_rows += 1
+                    _offset += len(_line)
+
+    def add(self, seqid, offset):
+        """Add the row of seqid which is written at offset of log.csv."""
+        if self.INTERVAL <= self.__num_rows:
+            self.__add_entry(offset)
+        self.__max_seqid = max(self.__max_seqid, seqid)
+        self.__num_rows += 1
+
+    def close(self):
+        if self.__idxfp is not None:
+            self.__idxfp.close()
+            self.__idxfp = None
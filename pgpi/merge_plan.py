@@ -9,10 +9,8 @@ This file defines a set of classes to adjust the effects of parallel workers.
   Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
 """
 
-import csv
 import glob
 import operator
-import os
 from .common import Log
 from .repository import Repository
 
@@ -158,98 +156,6 @@ class MergeRows(Repository, PrepareMergeRows):
     def __set_serverId(self, serverId):
         self.ServerId = serverId
 
-    def __get_actual_rows(self, Plans, depth):
-        """
-        Return the "Actual Rows" of the node whose depth is `depth` of `Plans`.
-
-        Parameters
-        ----------
-        Plans : dict
-        depth : int
-
-        Returns
-        -------
-        _rows : int
-        """
-
-        def incr(plan):
-            if "Node Type" in plan:
-                self._count += 1
-
-        def op(Plans, depth):
-            if isinstance(Plans, list):
-                for plan in Plans:
-                    incr(plan)
-                    if depth == self._count:
-                        self._rows = plan["Actual Rows"]
-                        return
-                    if "Plans" in plan:
-                        op(plan["Plans"], depth)
-                return
-            else:
-                incr(Plans)
-                if depth == self._count:
-                    self._rows = Plans["Actual Rows"]
-                    return
-                if "Plan" in Plans:
-                    op(Plans["Plan"], depth)
-                if "Plans" in Plans:
-                    op(Plans["Plans"], depth)
-                return
-
-        # Main procedure.
-        self._count = 0
-        self._rows = 0
-        op(Plans, depth)
-        return self._rows
-
-    def __add_rows(self, Plans, rows, depth):
-        """
-        Add `rows` to "Actual Rows" of the node whose depth is `depth`,
-        and Adjust "Plan Rows" using "NormalizePlanParam" if necessary.
-
-        Parameters
-        ----------
-        Plans : dict
-        rows : int
-        depth : int
-        """
-
-        def incr(plan):
-            if "Node Type" in plan:
-                self._count += 1
-
-        def add(plan, rows):
-            if "MergeFlag" in plan:
-                if plan["MergeFlag"] == "True":
-                    plan["Plan Rows"] *= plan["NormalizePlanParam"]
-                    plan["Actual Rows"] += rows
-
-        def op(Plans, rows, depth):
-            if isinstance(Plans, list):
-                for plan in Plans:
-                    incr(plan)
-                    if depth == self._count:
-                        add(plan, rows)
-                        return
-                    elif "Plans" in plan:
-                        op(plan["Plans"], rows, depth)
-                return
-            else:
-                incr(Plans)
-                if depth == self._count:
-                    add(Plans, rows)
-                    return
-                if "Plan" in Plans:
-                    op(Plans["Plan"], rows, depth)
-                elif "Plans" in Plans:
-                    op(Plans["Plans"], rows, depth)
-                return
-
-        # Main procedure.
-        self._count = 0
-        op(Plans, rows, depth)
-
     """
     Public methods
     """
@@ -259,24 +165,34 @@ class MergeRows(Repository, PrepareMergeRows):
         Merge the 'Plan Rows' and 'Actual Rows' of all parallel worker'
         plans(workerplans) into the leader's plan(leader_plan) if necessary.
 
+        The n-th node from the bottom of the worker's plans corresponds to
+        the n-th node from the bottom of the leader's plan, whose top nodes,
+        e.g. Gather, are not in the worker's plans. So the node lists of all
+        plans are built once and aligned from the end, and each node is
+        visited once.
+
         Parameters
         ----------
         leader_plan : dict
         worker_plans : [dict, ...]
         """
-        _num_worker_node = self.count_nodes(worker_plans[0])
-        _num_leader_node = self.count_nodes(leader_plan)
-        _i = _num_worker_node
-        _j = _num_leader_node
-        while 0 < _i:
-            rows = 0
+        _worker_nodes = [self.get_node_list(_plan) for _plan in worker_plans]
+        _leader_nodes = self.get_node_list(leader_plan)
+        _num_worker_node = len(_worker_nodes[0])
+        _offset = len(_leader_nodes) - _num_worker_node
+
+        for _i in range(max(0, -_offset), _num_worker_node):
             # Add all parallel workers' "Actual Rows" to `rows`.
-            for _k in range(0, len(worker_plans)):
-                rows += self.__get_actual_rows(worker_plans[_k], _i)
+            rows = 0
+            for _nodes in _worker_nodes:
+                if _i < len(_nodes):
+                    rows += _nodes[_i]["Actual Rows"]
             # Adjust "Plan Rows" and "Actual Rows" of `leader_plan`.
-            self.__add_rows(leader_plan, rows, _j)
-            _i -= 1
-            _j -= 1
+            _plan = _leader_nodes[_offset + _i]
+            if "MergeFlag" in _plan:
+                if _plan["MergeFlag"] == "True":
+                    _plan["Plan Rows"] *= _plan["NormalizePlanParam"]
+                    _plan["Actual Rows"] += rows
 
     def extrapolate_rows(self, leader_plan, num_actual_workers, num_workers):
         """
@@ -360,40 +276,22 @@ class AddRows(Repository, PrepareMergeRows):
             return
 
     """
-    Public method
+    Public methods
     """
 
-    def add_rows(self, seqid, queryid, planid):
+    def merge_workers_rows(self, Plans):
         """
         Add the parallel worker's values("Plan Rows", "Actual Rows",
         and "Actual Loops") to the leader's corresponding values in
-        the plan whose seqid is `seqid`.
+        the plan Plans, and Return it.
         """
-        _jdirpath = self.get_plan_json_dir_path(self.ServerId, queryid, planid)
-        _jpath = self.path(_jdirpath, str(seqid))
-
-        if os.path.isfile(_jpath):
-            if Log.notice <= self.LogLevel:
-                print("Notice: seqid({}) already exists.".format(str(seqid)))
-            return
-
-        # Read plan.
-        _jpath = self.path(_jdirpath, str(seqid) + ".tmp")
-        if os.path.isfile(_jpath) == False:
-            if Log.warning <= self.LogLevel:
-                print("Warning: '{}' not found.".format(_jpath))
-            return
-        else:
-            _dict0 = self.read_plan_json(_jpath)
-
-        _plan = _dict0.copy()
 
         """
-        Add three objects in each node of `_plan` to prepare to execute
+        Add three objects in each node of `Plans` to prepare to execute
         AddRows.__add_rows(), and Return numbers of workers of both
         planned and launched.
         """
-        (_numPlanWorkers, _numWorkers) = self.prepare_merge_rows(_plan)
+        (_numPlanWorkers, _numWorkers) = self.prepare_merge_rows(Plans)
 
         """
         Add the values of "Plan Rows", "Actual Rows" and "Actual Loops"
@@ -401,18 +299,8 @@ class AddRows(Repository, PrepareMergeRows):
         respectively.
         """
         if _numWorkers > 1:
-            self.__add_rows(_plan)
-
-        # Delete 'MergeFlag' objects from _plan.
-        ####self.delete_unnecessary_objects(self.delete_flags, _plan)
-
-        # Write _plan.
-        _jpath = self.path(_jdirpath, str(seqid))
-        self.write_plan_json(_plan, _jpath)
-        # Delete tmp file.
-        if os.path.isfile(_jpath):
-            _jpath = self.path(_jdirpath, str(seqid) + ".tmp")
-            os.remove(_jpath)
+            self.__add_rows(Plans)
+        return Plans
 
 
 class MergePlan(AddRows, MergeRows):
@@ -463,41 +351,3 @@ class MergePlan(AddRows, MergeRows):
             self.extrapolate_rows(_leader_plan, len(worker_plans) + 1, _numWorkers)
 
         return _leader_plan
-
-    def add_workers_rows(self, serverId, current_seqid, max_seqid):
-        """
-        For the plans with seqid `current_seqid` to `max_seqid`, add the parallel
-        worker's values("Plan Rows", "Actual Rows", and "Actual Loops") to the
-        leader's corresponding values in each plan.
-
-        This is called by GetTables.get_tables().
-
-        Parameters
-        ----------
-        serverId : str
-          The serverId of the database server that is described in the hosts.conf.
-        current_seqid : int
-          The maximum seqid for plans already stored in the repository.
-        max_seqid : int
-          The maximum seqid for plans stored in the database.
-
-        Returns
-        -------
-        None
-        """
-
-        self.__set_serverId(serverId)
-
-        """
-        Read log.csv to get the json plans whose seqid are between current_seqid
-        and max_seqid.
-        """
-        with open(self.get_log_csv_path(self.ServerId), newline="") as f:
-            _reader = csv.reader(f, delimiter=",", quoting=csv.QUOTE_NONE)
-            for row in _reader:
-                _seqid = int(row[0])
-                _queryid = int(row[6])
-                _planid = int(row[7])
-                if current_seqid < _seqid and _seqid <= max_seqid:
-                    self.add_rows(_seqid, _queryid, _planid)
-        f.close()
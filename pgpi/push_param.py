@@ -6,8 +6,10 @@ push_param.py
   Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
 """
 
+import concurrent.futures
 import sys
 import csv
+import io
 import psycopg2
 from six import string_types
 
@@ -21,7 +23,7 @@ class PushParam(Database, Repository):
         self.set_base_dir(base_dir)
         self.LogLevel = log_level
 
-    def __trans(self, Plans, depth):
+    def __trans(self, plan):
         def merge(schemas, relations):
             result = []
             if type(schemas) is not list:
@@ -191,71 +193,20 @@ class PushParam(Database, Repository):
             else:
                 return None
 
-        def incr(plan):
-            if "Node Type" in plan:
-                self._count += 1
-
-        def op(Plans):
-            if isinstance(Plans, list):
-                for i in range(0, len(Plans)):
-                    incr(Plans[i])
-                    if self._depth == self._count:
-                        self._params = get_items(Plans[i])
-                        return
-                    elif "Plans" in Plans[i]:
-                        op(Plans[i]["Plans"])
-            else:
-                incr(Plans)
-                if self._depth == self._count:
-                    self._params = get_items(Plans)
-                    return
-                elif "Plans" in Plans:
-                    op(Plans["Plans"])
-
-        self._depth = depth
-        self._count = 0
-        self._params = ""
-        op(Plans)
-        return self._params
+        return get_items(plan)
 
     def __transform(self, reg_path):
 
         _result = ""
-        i = self.count_nodes(reg_path)
-        while 0 < i:
-            _params = self.__trans(reg_path["Plan"], i)
+        for _plan in reversed(self.get_node_list(reg_path["Plan"])):
+            _params = self.__trans(_plan)
             if _params != None:
                 if not _result:
                     _result = _params
                 else:
                     _result = _result + ";" + _params
-            i -= 1
         return _result
 
-    def __get_database_list(self, serverId):
-        """Get database list."""
-        _ret = []
-        with open(self.get_log_csv_path(serverId), newline="") as f:
-            _reader = csv.reader(f, delimiter=",", quoting=csv.QUOTE_NONE)
-            for _row in _reader:
-                _database = _row[3]
-                if _database not in _ret:
-                    _ret.append(_database)
-        return _ret
-
-    def __get_queryid_and_param_list(self, serverId, db):
-        _dict = {}
-        with open(self.get_log_csv_path(serverId), newline="") as f:
-            _reader = csv.reader(f, delimiter=",", quoting=csv.QUOTE_NONE)
-            for _row in _reader:
-                _seqid = int(_row[0])
-                _database = _row[3]
-                _queryid = int(_row[6])
-                _planid = int(_row[7])
-                if _database == db:
-                    _dict[_queryid] = str(_planid)
-        return _dict
-
     def __check_object(self, connection, sql):
         _cur = connection.cursor()
         try:
@@ -324,28 +275,38 @@ class PushParam(Database, Repository):
         _sql += ");"
         self.__execute_sql(connection, _sql)
 
-    def __truncate_table(self, connection):
-        _sql = "TRUNCATE " + self.SCHEMA + "." + self.REG_PARAMS_TABLE + ";"
-        self.__execute_sql(connection, _sql)
-
-    def __insert_reg_params(self, connection, serverId, queryid_list, work_mem):
-        _cur = connection.cursor()
+    def __execute_in_transaction(self, cursor, sql):
         try:
-            _cur.execute("START TRANSACTION;")
+            cursor.execute(sql)
         except Exception as err:
-            _cur.close()
-            print("Error! Could not execute sql:{}.".format("START TRANSACTION"))
+            cursor.close()
+            print("Error! Could not execute sql:{}.".format(sql))
             sys.exit(1)
 
+    def __get_reg_params(self, serverId, queryid_list, work_mem):
+        """
+        Return the rows (queryid, sort_space_used, params) of queryid_list
+        {queryid: planid}, and write the formatted reg param files.
+        """
+        _rows = []
         for _queryid in queryid_list:
             _planid = int(queryid_list[_queryid])
             _reg_path = self.get_regression_param(serverId, _queryid, _planid)
+            if _reg_path is None:
+                """The regression has not been done yet; push it next time."""
+                if Log.debug1 <= self.LogLevel:
+                    print(
+                        "Debug1: no regression params: queryid={} planid={}".format(
+                            _queryid, _planid
+                        )
+                    )
+                continue
 
             _result = self.__transform(_reg_path)
             _sort_space_used = None
             if work_mem == True:
                 if "SortSpaceUsed" in _reg_path:
-                    _sort_space_used = _reg_path["SortSpaceUsed"]
+                    _sort_space_used = int(_reg_path["SortSpaceUsed"])
 
             if Log.debug3 <= self.LogLevel:
                 print(
@@ -354,105 +315,300 @@ class PushParam(Database, Repository):
                     )
                 )
 
-            _sql = "INSERT INTO " + self.SCHEMA + "." + self.REG_PARAMS_TABLE
+            _params = str(_result).replace("'", '"')
+            _rows.append((str(_queryid), _sort_space_used, _params))
 
-            if _sort_space_used is None:
-                _sql += " (queryid, params) VALUES ("
-            else:
-                _sql += " (queryid, sort_space_used, params) VALUES ("
-            _sql += "'" + str(_queryid) + "',"
-            if _sort_space_used is not None:
-                _sql += str(int(_sort_space_used)) + ","
-            _sql += "'" + str(_result).replace("'", '"') + "'"
-            _sql += ");"
+            # Write formatted reg param file
+            self.write_formatted_regression_params(serverId, str(_queryid), _params)
+        return _rows
 
-            try:
-                _cur.execute(_sql)
-            except Exception as err:
-                _cur.close()
-                print("Error! Could not execute sql:{}.".format(_sql))
-                sys.exit(1)
+    def __push_reg_params(
+        self, connection, serverId, queryid_list, work_mem, upsert, complete
+    ):
+        """
+        Push the params of queryid_list {queryid: planid} to the reg table.
+
+        The rows are streamed by COPY into a temporary staging table, and
+        merged into the reg table in a single statement:
+
+          upsert == False : the reg table is truncated and replaced by the
+                            staging table. complete must be True.
+          upsert == True  : the rows of the staging table are upserted, and
+                            the reg table is written only where the params
+                            have changed. If complete is True, i.e. the
+                            staging table has all queryids of the database,
+                            the rows of the other queryids are deleted.
+
+        Returns
+        -------
+        _num_rows : int
+           Return the number of rows written to the reg table.
+        """
+        _rows = self.__get_reg_params(serverId, queryid_list, work_mem)
+        if len(_rows) == 0 and complete == False:
+            return 0
 
-            # Write formatted reg param file
-            self.write_formatted_regression_params(
-                serverId, str(_queryid), str(_result).replace("'", '"')
-            )
+        _table = self.SCHEMA + "." + self.REG_PARAMS_TABLE
+        _stage = self.REG_PARAMS_STAGING_TABLE
+        _columns = "queryid, sort_space_used, params" if work_mem else "queryid, params"
+
+        _buf = io.StringIO()
+        _writer = csv.writer(_buf, lineterminator="\n")
+        for (_queryid, _sort_space_used, _params) in _rows:
+            if work_mem == True:
+                _writer.writerow([_queryid, _sort_space_used, _params])
+            else:
+                _writer.writerow([_queryid, _params])
+        _buf.seek(0)
 
+        _cur = connection.cursor()
+        self.__execute_in_transaction(_cur, "START TRANSACTION;")
+        self.__execute_in_transaction(
+            _cur,
+            "CREATE TEMP TABLE "
+            + _stage
+            + " (LIKE "
+            + _table
+            + " INCLUDING DEFAULTS) ON COMMIT DROP;",
+        )
+        _sql = "COPY " + _stage + " (" + _columns + ") FROM STDIN"
+        _sql += " WITH (FORMAT csv, FORCE_NOT_NULL (params));"
         try:
-            _cur.execute("COMMIT;")
+            _cur.copy_expert(_sql, _buf)
         except Exception as err:
             _cur.close()
-            print("Error! Could not execute sql:{}.".format("COMMIT"))
+            print("Error! Could not execute sql:{}.".format(_sql))
             sys.exit(1)
+
+        if upsert == False:
+            self.__execute_in_transaction(_cur, "TRUNCATE " + _table + ";")
+            _sql = "INSERT INTO " + _table + " (" + _columns + ")"
+            _sql += " SELECT " + _columns + " FROM " + _stage + ";"
+            self.__execute_in_transaction(_cur, _sql)
+            _num_rows = _cur.rowcount
+        else:
+            _sql = "INSERT INTO " + _table + " AS r (" + _columns + ")"
+            _sql += " SELECT " + _columns + " FROM " + _stage
+            _sql += " ON CONFLICT (queryid) DO UPDATE SET"
+            if work_mem == True:
+                _sql += " sort_space_used = EXCLUDED.sort_space_used,"
+                _sql += " params = EXCLUDED.params"
+                _sql += " WHERE (r.sort_space_used, r.params) IS DISTINCT FROM"
+                _sql += " (EXCLUDED.sort_space_used, EXCLUDED.params);"
+            else:
+                _sql += " params = EXCLUDED.params"
+                _sql += " WHERE r.params IS DISTINCT FROM EXCLUDED.params;"
+            self.__execute_in_transaction(_cur, _sql)
+            _num_rows = _cur.rowcount
+            if complete == True:
+                _sql = "DELETE FROM " + _table + " AS r WHERE NOT EXISTS"
+                _sql += " (SELECT 1 FROM " + _stage + " AS s"
+                _sql += " WHERE s.queryid = r.queryid);"
+                self.__execute_in_transaction(_cur, _sql)
+                _num_rows += _cur.rowcount
+
+        self.__execute_in_transaction(_cur, "COMMIT;")
         _cur.close()
+        return _num_rows
+
+    def __push_database(
+        self, serverId, database, conn, plans, watermark, work_mem, upsert
+    ):
+        """
+        Push the params of plans {queryid: (planid, seqid)} to database.
+
+        Returns
+        -------
+        (_num_queryids, _num_rows) : (int, int)
+           Return the number of the pushed queryids and the written rows.
+        """
+
+        """
+        Connect to the database
+        """
+        try:
+            _connection = psycopg2.connect(conn)
+        except psycopg2.OperationalError as e:
+            if Log.error <= self.LogLevel:
+                print("Could not connect to {}".format(database))
+            raise
+        _connection.autocommit = True
+
+        try:
+            """
+            Check schema and table; create them if necessary
+            """
+            if self.__check_schema(_connection) == False:
+                self.__create_schema(_connection)
+
+            if self.__check_table(_connection) == False:
+                self.__create_table(_connection, work_mem)
+                watermark = 0
+
+            """
+            Get queryid and its latest planid whose params may have changed.
+            """
+            _queryid_list = {
+                _queryid: _planid
+                for (_queryid, (_planid, _seqid)) in plans.items()
+                if watermark < _seqid
+            }
+
+            if Log.debug3 <= self.LogLevel:
+                print("Debug3: queryid_list={}".format(_queryid_list))
+            if Log.info <= self.LogLevel:
+                print(
+                    "Info: Push {} of {} queryids to {}.".format(
+                        len(_queryid_list), len(plans), database
+                    )
+                )
+
+            """
+            Push reg_param
+            """
+            _num_rows = self.__push_reg_params(
+                _connection,
+                serverId,
+                _queryid_list,
+                work_mem,
+                upsert == True or 0 < watermark,
+                watermark == 0,
+            )
+        finally:
+            _connection.close()
+
+        return (len(_queryid_list), _num_rows)
 
     """
     Public method
     """
 
-    def push_param(self, serverId, work_mem=True):
+    def push_param(self, serverId, work_mem=True, full=False, upsert=False, jobs=1):
+        """
+        Push the regression params to each database of serverId.
+
+        The params of a database are pushed incrementally: only the queryids
+        whose latest rows are newer than the push watermark of the database,
+        i.e. the seqid of the regression stage at the last push, are
+        replaced, because the params of the others have not changed since
+        then. If the params have never been pushed to the database, or full
+        is True, all params are pushed.
+
+        The params are loaded by COPY through a staging table. The pushed
+        params are upserted, so only the changed rows are written; when all
+        params are pushed, the reg table is replaced by them unless upsert
+        is True, in which case the rows of the removed queryids are deleted
+        instead of truncating the table.
+
+        Parameters
+        ----------
+        serverId : str
+          The serverId of the database server that is described in the hosts.conf.
+        work_mem : bool
+          Whether to push sort_space_used.
+        full : bool
+          If True, push all params regardless of the push watermarks.
+        upsert : bool
+          If True, never truncate the reg table.
+        jobs : int
+          The number of databases pushed concurrently.
+
+        Returns
+        -------
+        _summary : dict
+           Return {database: (the number of the pushed queryids, the number of
+           the written rows)}, or {database: the exception} if failed.
+        """
+
         """
         Check formatted regression params subdir, and create it if not exists.
         """
         self.check_formatted_regression_params_dir(serverId)
 
         """
-        Get database list from log.csv.
+        Get {database: {queryid: (planid, seqid)}} from log.csv in one pass.
         """
-        _database_list = self.__get_database_list(serverId)
-        if len(_database_list) == 0:
+        _latest_plans = self.get_log_latest_plans(serverId)
+        if len(_latest_plans) == 0:
             if Log.info <= self.LogLevel:
                 print("Info: There is no data.")
             sys.exit(0)
 
         if Log.debug3 <= self.LogLevel:
-            print("Debug3: _database_list={}".format(_database_list))
+            print("Debug3: _database_list={}".format(list(_latest_plans)))
+
+        _regression_seqid = self.get_seqid_from_regression_stat(serverId)
+        if full == True:
+            self.truncate_formatted_regression_params(serverId)
 
         """
-        Main loop
+        Get connection param of each database. They are got here, not in
+        the pool, since the password may be prompted.
         """
         db = Database(self.base_dir, self.LogLevel)
-        for _db in _database_list:
-            """
-            Get queryid and its latest param list in each database.
-            """
-            _queryid_list = self.__get_queryid_and_param_list(serverId, _db)
+        _tasks = [
+            (
+                _db,
+                db.get_connection_param(serverId, _db),
+                _latest_plans[_db],
+                0 if full == True else self.get_seqid_from_push_stat(serverId, _db),
+            )
+            for _db in _latest_plans
+        ]
+        del db
 
-            if Log.debug3 <= self.LogLevel:
-                print("Debug3: queryid_list={}".format(_queryid_list))
+        """
+        Main loop
 
-            """
-            Get connection param of each database
-            """
-            _conn = db.get_connection_param(serverId, _db)
+        The databases are pushed by a pool of jobs threads, each of which
+        holds one connection at a time. An error in a database does not
+        stop the others, and the push watermark of a database is updated
+        only if its params have been pushed.
+        """
 
-            """
-            Connect to each database
-            """
+        def push_database(task):
+            (_db, _conn, _plans, _watermark) = task
             try:
-                _connection = psycopg2.connect(_conn)
-            except psycopg2.OperationalError as e:
-                print("Could not connect to {}".format(_db))
-                continue
-            _connection.autocommit = True
-
-            """
-            Check schema and table; create them if necessary
-            """
-            if self.__check_schema(_connection) == False:
-                self.__create_schema(_connection)
-
-            if self.__check_table(_connection):
-                self.__truncate_table(_connection)
-            else:
-                self.__create_table(_connection, work_mem)
-
-            """
-            Insert reg_param
-            """
-            self.truncate_formatted_regression_params(serverId)
-            self.__insert_reg_params(_connection, serverId, _queryid_list, work_mem)
+                return self.__push_database(
+                    serverId, _db, _conn, _plans, _watermark, work_mem, upsert
+                )
+            except (Exception, SystemExit) as err:
+                return err
+
+        _summary = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as _pool:
+            _futures = {_pool.submit(push_database, _t): _t[0] for _t in _tasks}
+            for _future in concurrent.futures.as_completed(_futures):
+                _db = _futures[_future]
+                _summary[_db] = _future.result()
+                if not isinstance(_summary[_db], BaseException):
+                    self.update_push_stat_file(serverId, _db, _regression_seqid)
 
-            _connection.close()
+        """
+        Show the summary.
+        """
+        _failed = [
+            _db for _db in _latest_plans if isinstance(_summary[_db], BaseException)
+        ]
+        if Log.info <= self.LogLevel:
+            print("Info: Summary:")
+            for _db in _latest_plans:
+                _result = _summary[_db]
+                if isinstance(_result, SystemExit):
+                    print("\t{}: failed".format(_db))
+                elif isinstance(_result, BaseException):
+                    print("\t{}: failed: {}".format(_db, str(_result).strip()))
+                else:
+                    print(
+                        "\t{}: {} queryids pushed, {} rows written".format(
+                            _db, _result[0], _result[1]
+                        )
+                    )
+        if _failed and Log.error <= self.LogLevel:
+            print(
+                "Error: Could not push to {} of {} databases: {}".format(
+                    len(_failed), len(_tasks), ", ".join(_failed)
+                )
+            )
 
-        del db
+        return _summary
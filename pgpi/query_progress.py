@@ -282,7 +282,7 @@ class CalcNode(Node):
     the point increments 2000.
 
     When estimating the progress of the query, the 'Plan Points' and the
-    'Actual Points' are calculated in each node by the calc_node() method, where
+    'Actual Points' are calculated in each node by the calc_nodes() method, where
     the 'Plan Points' is the estimated point to get eventually, and the
     'Actual Points' is the actual point.
 
@@ -378,7 +378,7 @@ class CalcNode(Node):
 
     def prepare_calc_node(self, plans, regression=False):
         """
-        Prepare to execute the calc_node() method. That is, add four objects,
+        Prepare to execute the calc_nodes() method. That is, add four objects,
         which are described in the __set_objects() method, in all nodes of plans,
         and set the appropriate state to the 'CurrentState' object.
         """
@@ -449,35 +449,31 @@ class CalcNode(Node):
         self.regression = regression
         op(plans)
 
+    def calc_nodes(self, plans, regression):
+        """
+        Calculate the 'Plan Points' and the 'Actual Points' of all nodes in order,
+        from the bottom node to the top node.
+
+        This is equivalent to calling calc_node() for each depth from the number
+        of nodes down to 1, but the plan tree is walked only once.
+        """
+        self.regression = regression
+        for _plan in reversed(self.get_node_list(plans)):
+            self.calc(_plan, self.regression)
+
     def count_points(self, plans):
         """
         Count up the 'Plan Points' and the 'Actual Points', and Return the proportion
         of the actual and planned points.
         """
 
-        def op(Plans):
-            """Count up the planned and actual points recursively."""
-            self._i += 1
-            if isinstance(Plans, list):
-                for plan in Plans:
-                    if "Plans" in plan:
-                        if "ActualPoints" in plan:
-                            self._plan_points += plan["PlanPoints"]
-                            self._actual_points += plan["ActualPoints"]
-                        op(plan["Plans"])
-            else:
-                if "Plans" in Plans:
-                    if "ActualPoints" in Plans:
-                        self._plan_points += Plans["PlanPoints"]
-                        self._actual_points += Plans["ActualPoints"]
-                    op(Plans["Plans"])
-            return
-
         # Main procedure.
-        self._i = 0
         self._actual_points = 0
         self._plan_points = 0
-        op(plans)
+        for plan in self.get_node_list(plans):
+            if "Plans" in plan and "ActualPoints" in plan:
+                self._plan_points += plan["PlanPoints"]
+                self._actual_points += plan["ActualPoints"]
         if self._plan_points == 0:
             return 0.0
         return min(self._actual_points / self._plan_points, 1)
@@ -596,10 +592,7 @@ class QueryProgress(MergePlan, Replace, Rules, CalcNode):
         Calculate the "Plan Points" and "Actual Points" in order,
         from the bottom node to the top node.
         """
-        _i = _numNode
-        while 0 < _i:
-            self.calc_node(Plans, _i, _regression)
-            _i -= 1
+        self.calc_nodes(Plans, _regression)
 
         """
         Count up the "Plan Points" and "Actual Points".
@@ -13,9 +13,8 @@ import operator
 
 from .common import Common, Log
 from .repository import Repository
+from .sufficient_stats import SufficientStats
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error
 
 
 class CalcRegression:
@@ -38,27 +37,33 @@ class CalcRegression:
           * Model(no bias): y = a * x
           * Loss function: Mean Square Error
         """
-        _sumY = sum(Y)
-        _sumX = sum(X)
         if Log.debug3 <= self.LogLevel:
             print("Debug3: ----- SCAN ----")
             print("Debug3:       ===> X = {}".format(X))
             print("Debug3:       ===> Y = {}".format(Y))
+        return self.scan_sums(sum(X), sum(Y), len(Y))
+
+    def scan_sums(self, sumX, sumY, num):
+        """
+        The same as scan(), but calculated from sum(X), sum(Y) and len(Y).
+        """
+        _sumY = sumY
+        _sumX = sumX
         if 250 * _sumY < _sumX:
             # Assume that this data set is fit to a constant function.
             if Log.debug3 <= self.LogLevel:
                 print(
                     "Debug3:       ==> coef = 0    intercept = {}".format(
-                        float(round(_sumY / len(Y), 5))
+                        float(round(_sumY / num, 5))
                     )
                 )
-            return (0.0, float(round(_sumY / len(Y), 5)))
+            return (0.0, float(round(_sumY / num, 5)))
         else:
             if Log.debug3 <= self.LogLevel:
                 if _sumX == 0:
                     print(
                         "Debug3:       ==> coef = 0   intercept = {}".format(
-                            float(round(_sumY / len(Y), 5))
+                            float(round(_sumY / num, 5))
                         )
                     )
                 else:
@@ -69,7 +74,7 @@ class CalcRegression:
                     )
 
             if _sumX == 0:
-                return (0.0, float(round(_sumY / len(Y), 5)))
+                return (0.0, float(round(_sumY / num, 5)))
             else:
                 return (float(_sumY / _sumX), 0.0)
 
@@ -117,191 +122,281 @@ class CalcRegression:
             _sumY += Y[i] * Xinner[i] * Xouter[i]
             _sumX += Xinner[i] **2 * Xouter[i] **2
         """
-        _sumY = sum(list(map(operator.mul, list(map(operator.mul, Xinner, Xouter)), Y)))
-        _sumX = sum(
-            list(
-                map(
-                    operator.mul,
-                    list(map(lambda x: x ** 2, Xinner)),
-                    list(map(lambda x: x ** 2, Xouter)),
-                )
-            )
-        )
+        _sumY = sum([_i * _o * _y for (_i, _o, _y) in zip(Xinner, Xouter, Y)])
+        _sumX = sum([_i ** 2 * _o ** 2 for (_i, _o) in zip(Xinner, Xouter)])
         if Log.debug3 <= self.LogLevel:
             print("Debug3: +++++ NESTED LOOP JOIN +++++")
             print("Debug3:       ===> Xouter = {}".format(Xouter))
             print("Debug3:       ===> Xinner = {}".format(Xinner))
             print("Debug3:       ===>      Y = {}".format(Y))
-            if _sumX == 0:
+        return self.nested_loop_sums(_sumY, _sumX)
+
+    def nested_loop_sums(self, sumXY, sumXX):
+        """
+        The same as nested_loop(), but calculated from
+        sumXY = sum(Xinner * Xouter * Y) and sumXX = sum(Xinner^2 * Xouter^2).
+        """
+        if Log.debug3 <= self.LogLevel:
+            if sumXX == 0:
                 print("Debug3:       ==> coef=1")
             else:
-                print("Debug3:       ==> coef={}".format(str(round(_sumY / _sumX, 5))))
+                print("Debug3:       ==> coef={}".format(str(round(sumXY / sumXX, 5))))
 
-        return 1.0 if _sumX == 0 else float(_sumY / _sumX)
+        return 1.0 if sumXX == 0 else float(sumXY / sumXX)
 
-    def merge_or_hash_join(self, Xouter, Xinner, Y, add_bias_0=True):
-        def multi_regression(Xouter, Xinner, Y, add_bias_0=True):
-            _X = []
-            _Y = []
-
-            """Format _Y and _X"""
-            for i in range(0, len(Y)):
-                _Y.append(Y[i])
-                _X.append([Xouter[i], Xinner[i]])
-            if add_bias_0:
-                # Add a constraint because we assume that the bias is 0
-                _X.append([0.0, 0.0])
-                _Y.append(0.0)
-            if Log.debug3 <= self.LogLevel:
-                print("Debug3: ****MERGE OR HASH JOIN*****")
-                print("Debug3:       ===> Xouter = {}".format(Xouter))
-                print("Debug3:       ===> Xinner = {}".format(Xinner))
-                print("Debug3:       ===> X ={}".format(_X))
-                print("Debug3:       ===> Plan Rows ={}  Y={}".format(Y, _Y))
+    """Threshold of det(A) / (A[0][0] * A[1][1]) to regard A as rank deficient."""
+    RANK_TOLERANCE = 1e-12
 
+    """
+    Difference of RMSEs, relative to the root mean square of Y, under which
+    two models fit equally well. The RMSEs calculated from the statistics
+    have rounding errors of about sqrt(machine epsilon) of that scale.
+    """
+    RMSE_TOLERANCE = 1e-6
+
+    def __least_squares(self, num, mean, m2, bias, cols):
+        """
+        Solve the least-squares problems Y = X * coef + intercept of all
+        data sets at once, in the same way as sklearn's LinearRegression does,
+        i.e. the data are centered and the minimum norm solution is returned
+        if the problem is rank deficient.
+
+        Parameters
+        ----------
+        num : ndarray, shape (K,)
+          The number of samples of each data set.
+        mean : ndarray, shape (K, 3)
+          The means of [Xouter, Xinner, Y] of each data set.
+        m2 : ndarray, shape (K, 3, 3)
+          The centered sums of products of [Xouter, Xinner, Y].
+        bias : int
+          If 1, a sample (Xouter=0, Xinner=0, Y=0) is added to each data set,
+          i.e. the constraint that the bias is 0.
+        cols : list
+          The explanatory variables, i.e. [0, 1], [0] or [1].
+
+        Returns
+        -------
+        coef : ndarray, shape (K, len(cols))
+        intercept : ndarray, shape (K,)
+        rmse : ndarray, shape (K,)
+        """
+
+        """
+        Add the zero sample to the statistics. The data sets without samples,
+        i.e. num = 0, are regarded as having one to avoid dividing by zero.
+        """
+        _n = np.maximum(num + bias, 1)
+        _w = (bias * num / _n)[:, None, None]
+        _C = m2 + _w * mean[:, :, None] * mean[:, None, :]
+        _mean = mean * (num / _n)[:, None]
+
+        """The normal equations of the centered data: A * coef = r."""
+        _A = _C[:, cols][:, :, cols]
+        _r = _C[:, cols, 2]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if len(cols) == 1:
+                _a = _A[:, 0, 0]
+                _coef = np.where(0 < _a, _r[:, 0] / _a, 0.0)[:, None]
+            else:
+                _a = _A[:, 0, 0]
+                _b = _A[:, 0, 1]
+                _c = _A[:, 1, 1]
+                _det = _a * _c - _b * _b
+                _full = self.RANK_TOLERANCE * _a * _c < _det
+                _coef0 = (_c * _r[:, 0] - _b * _r[:, 1]) / _det
+                _coef1 = (_a * _r[:, 1] - _b * _r[:, 0]) / _det
+                _coef = np.stack([_coef0, _coef1], axis=1)
+                """
+                If A is rank deficient, A = lambda * v * v^T where lambda is
+                the trace of A, so pinv(A) = A / lambda^2.
+                """
+                _trace = _a + _c
+                _pinv = np.einsum("kjl,kl->kj", _A, _r) / (_trace ** 2)[:, None]
+                _pinv[_trace == 0] = 0.0
+                _coef = np.where(_full[:, None], _coef, _pinv)
+
+        _intercept = _mean[:, 2] - np.sum(_mean[:, cols] * _coef, axis=1)
+
+        """Calculate RMSE from the statistics."""
+        _sse = (
+            _C[:, 2, 2]
+            - 2 * np.sum(_coef * _r, axis=1)
+            + np.einsum("kj,kjl,kl->k", _coef, _A, _coef)
+        )
+        _rmse = np.sqrt(np.maximum(_sse, 0.0) / _n)
+
+        return (_coef, _intercept, _rmse)
+
+    def __merge_or_hash_join(self, num, mean, m2):
+        """
+        Calculate the regression parameters of the merge or hash join nodes
+        whose statistics are num, mean and m2. See __least_squares().
+
+        The six regressions of each node, i.e. the multiple regression and
+        the single regressions of Xouter and Xinner with and without the
+        constraint that the bias is 0, are solved in one batch.
+
+        A single regression is chosen only if its RMSE is lower than the
+        RMSE of the models before it by more than RMSE_TOLERANCE times the
+        root mean square of Y. If the problem is rank deficient, e.g. there are only one or two samples,
+        Xouter or Xinner is constant, or they are collinear, several models
+        fit equally well; then the multiple regression is preferred, and
+        Xouter is preferred to Xinner, instead of being decided by the
+        rounding errors of the RMSEs.
+        """
+        if len(num) == 0:
+            return []
+
+        _results = {}
+        for _bias in (1, 0):
+            for _key, _cols in (("multi", [0, 1]), ("outer", [0]), ("inner", [1])):
+                (_c, _i, _r) = self.__least_squares(num, mean, m2, _bias, _cols)
+                _results[(_key, _bias)] = (_c.tolist(), _i.tolist(), _r.tolist())
+        _tolerance = (
+            self.RMSE_TOLERANCE
+            * np.sqrt((m2[:, 2, 2] + num * mean[:, 2] ** 2) / np.maximum(num, 1))
+        ).tolist()
+
+        def regression(key, k, bias):
+            (_c, _i, _r) = _results[(key, bias)]
+            _coef = [float(round(_v, 5)) for _v in _c[k]]
+            return (_coef, float(round(_i[k] + 0.0, 5)), _r[k])
+
+        def is_better(k, rmse, best_rmse):
+            return rmse < best_rmse - _tolerance[k]
+
+        _ret = []
+        for _k in range(0, len(num)):
             """
-            Calc regression
             Multiple linear regression
             * Model(no bias): Y = a1 * Xouter + a2 * Xinner
             * Loss function: Mean Square Error
             """
-            scireg = LinearRegression()
-            scireg.fit(_X, _Y)
-            _list = scireg.coef_.tolist()
-            _coef = [float(round(_list[n], 5)) for n in range(len(_list))]
-            _intercept = float(round(scireg.intercept_ + 0.0, 5))
-
-            """Predict and calculate RMSE."""
-            _y_pred = scireg.predict(_X)
-            _rmse = np.sqrt(mean_squared_error(_Y, _y_pred))
-
-            del scireg
-            return (_coef, _intercept, _rmse)
-
-        def single_regression(X, Y, add_bias_0=True):
-            _X = []
-            _Y = []
-
-            """Format _Y and _X"""
-            for i in range(0, len(Y)):
-                _Y.append(Y[i])
-                _X.append([X[i]])
-            if add_bias_0:
-                # Add a constraint because we assume that the bias is 0
-                _X.append([0.0])
-                _Y.append(0.0)
-            if Log.debug3 <= self.LogLevel:
-                print("Debug3: ****MERGE OR HASHOIN*****")
-                print("Debug3:       ===> X={}".format(X))
-                print("Debug3:       ===> Plan Rows ={}  Y={}".format(Y, _Y))
+            (coef, intercept, rmse) = regression("multi", _k, 1)
+            if coef[0] < 0 or coef[1] < 0:
+                (coef, intercept, rmse) = regression("multi", _k, 0)
+            _coef = [float(coef[0]), float(coef[1])]
+            _reg = 0
+            _intercept = float(round(intercept + 0.0, 5))
+            _rmse = rmse
 
             """
-            Calc regression
-            Multiple linear regression
+            Single linear regression
             * Model: Y = a * X + b
             * Loss function: Mean Square Error
             """
-            scireg = LinearRegression()
-            scireg.fit(_X, _Y)
-            _list = scireg.coef_.tolist()
-            _coef = [float(round(_list[n], 5)) for n in range(len(_list))]
-            _intercept = float(round(scireg.intercept_ + 0.0, 5))
-
-            """Predict and calculate RMSE."""
-            _y_pred = scireg.predict(_X)
-            _rmse = np.sqrt(mean_squared_error(_Y, _y_pred))
-
-            del scireg
-            return (float(_coef[0]), float(_intercept), _rmse)
-
-        def reg(Xouter, Xinner, Y):
-            ## Same as NestedLoop
-            _sumY = sum(
-                list(map(operator.mul, list(map(operator.mul, Xinner, Xouter)), Y))
-            )
-            _sumX = sum(
-                list(
-                    map(
-                        operator.mul,
-                        list(map(lambda x: x ** 2, Xinner)),
-                        list(map(lambda x: x ** 2, Xouter)),
-                    )
-                )
-            )
-            _coef = 1.0 if _sumX == 0 else float(_sumY / _sumX)
-            # Calculate MSE
-            _mse = (
-                sum(
-                    list(
-                        map(
-                            lambda x: x ** 2,
-                            list(
-                                map(
-                                    operator.sub,
-                                    Y,
-                                    list(
-                                        map(
-                                            lambda y: _coef * y,
-                                            list(map(operator.mul, Xouter, Xinner)),
-                                        )
-                                    ),
-                                )
-                            ),
-                        )
+            (coef, intercept, rmse) = regression("outer", _k, 1)
+            if coef[0] < 0:
+                (coef, intercept, rmse) = regression("outer", _k, 0)
+            if is_better(_k, rmse, _rmse):
+                _coef = [float(coef[0]), 0.0]
+                _intercept = float(round(intercept + 0.0, 5))
+                _rmse = rmse
+
+            (coef, intercept, rmse) = regression("inner", _k, 1)
+            if coef[0] < 0:
+                (coef, intercept, rmse) = regression("inner", _k, 0)
+            if is_better(_k, rmse, _rmse):
+                _coef = [0.0, float(coef[0])]
+                _intercept = float(round(intercept + 0.0, 5))
+                _rmse = rmse
+
+            if Log.debug3 <= self.LogLevel:
+                print("Debug3: ****MERGE OR HASH JOIN*****")
+                print(
+                    "Debug3:       ==> coef={} reg={}   intercept={}".format(
+                        _coef, _reg, _intercept
                     )
                 )
-                / len(Y)
-            )
+            _ret.append((_coef, _reg, _intercept))
 
-            return (_coef, np.sqrt(_mse))
+        return _ret
 
+    def merge_or_hash_join_stats_batch(self, stats):
         """
-        Calcuate regression parameters.
-        """
-        (coef, intercept, rmse) = multi_regression(Xouter, Xinner, Y)
-        if coef[0] < 0 or coef[1] < 0:
-            (coef, intercept, rmse) = multi_regression(Xouter, Xinner, Y, False)
-        _coef = [float(coef[0]), float(coef[1])]
-        _reg = 0
-        _intercept = float(round(intercept + 0.0, 5))
-        _rmse = rmse
+        Calculate the regression parameters of many merge or hash join nodes
+        from their sufficient statistics.
 
-        (coef, intercept, rmse) = single_regression(Xouter, Y)
-        if coef < 0:
-            (coef, intercept, rmse) = single_regression(Xouter, Y, False)
-        if rmse < _rmse:
-            _coef = [float(coef), 0.0]
-            _intercept = float(round(intercept + 0.0, 5))
-            _rmse = rmse
-
-        (coef, intercept, rmse) = single_regression(Xinner, Y)
-        if coef < 0:
-            (coef, intercept, rmse) = single_regression(Xinner, Y, False)
-        if rmse < _rmse:
-            _coef = [0.0, float(coef)]
-            _intercept = float(round(intercept + 0.0, 5))
-            _rmse = rmse
+        Parameters
+        ----------
+        stats : list of dict
+          The statistics of the nodes, i.e. {"N", "Mean", "M2"}.
+          See SufficientStats.
 
+        Returns
+        -------
+        list of (coef, reg, intercept), which are the same as the results of
+        merge_or_hash_join().
         """
-        # Note: This is not used because it makes the results significantly unstable.
-        (coef, rmse) = reg(Xouter, Xinner, Y)
-        if rmse < _rmse:
-            _coef = [0, 0]
-            _intercept = 0
-            _reg = coef
+        _num = np.array([_s["N"] for _s in stats], dtype=np.float64)
+        _mean = np.array([_s["Mean"] for _s in stats], dtype=np.float64)
+        _m2 = np.empty((len(stats), 3, 3))
+        for _k, _s in enumerate(stats):
+            (_oo, _oi, _oy, _ii, _iy, _yy) = _s["M2"]
+            _m2[_k] = [[_oo, _oi, _oy], [_oi, _ii, _iy], [_oy, _iy, _yy]]
+        return self.__merge_or_hash_join(_num, _mean.reshape(-1, 3), _m2)
+
+    def merge_or_hash_join_batch(self, inputs):
         """
+        Calculate the regression parameters of many merge or hash join nodes.
+
+        All data sets are stacked into arrays, and their statistics are
+        calculated at once.
+
+        Parameters
+        ----------
+        inputs : list of (Xouter, Xinner, Y)
+
+        Returns
+        -------
+        list of (coef, reg, intercept), which are the same as the results of
+        merge_or_hash_join().
+        """
+        if len(inputs) == 0:
+            return []
+
+        _num = np.array([len(_y) for (_xo, _xi, _y) in inputs], dtype=np.int64)
+        _seg = np.repeat(np.arange(len(inputs)), _num)
+        _Z = np.stack(
+            [
+                np.concatenate([np.asarray(_v[_j], dtype=np.float64) for _v in inputs])
+                for _j in range(0, 3)
+            ],
+            axis=1,
+        )
+
+        def segment_sum(values):
+            return np.bincount(_seg, weights=values, minlength=len(inputs))
+
+        _mean = np.stack([segment_sum(_Z[:, _j]) for _j in range(0, 3)], axis=1)
+        _mean /= _num[:, None]
+        _Zc = _Z - _mean[_seg]
+        _m2 = np.empty((len(inputs), 3, 3))
+        for _j in range(0, 3):
+            for _l in range(_j, 3):
+                _m2[:, _j, _l] = segment_sum(_Zc[:, _j] * _Zc[:, _l])
+                _m2[:, _l, _j] = _m2[:, _j, _l]
 
         if Log.debug3 <= self.LogLevel:
-            print(
-                "Debug3:       ==> coef={} reg={}   intercept={}".format(
-                    _coef, _reg, _intercept
-                )
-            )
+            for (_xo, _xi, _y) in inputs:
+                print("Debug3: ****MERGE OR HASH JOIN*****")
+                print("Debug3:       ===> Xouter = {}".format(list(_xo)))
+                print("Debug3:       ===> Xinner = {}".format(list(_xi)))
+                print("Debug3:       ===> Plan Rows ={}".format(list(_y)))
 
-        return (_coef, _reg, _intercept)
+        return self.__merge_or_hash_join(_num.astype(np.float64), _mean, _m2)
 
+    def merge_or_hash_join(self, Xouter, Xinner, Y, add_bias_0=True):
+        """
+        Calculate the regression parameters of a merge or hash join node.
+        See merge_or_hash_join_batch().
+        """
+        return self.merge_or_hash_join_batch([(Xouter, Xinner, Y)])[0]
 
-class Regression(Repository, CalcRegression):
+
+class Regression(Repository, CalcRegression, SufficientStats):
     def __init__(self, base_dir=".", log_level=Log.error):
         self.ServerId = ""
         self.Level = 0
@@ -310,6 +405,7 @@ class Regression(Repository, CalcRegression):
 
     def __set_serverId(self, serverId):
         self.ServerId = serverId
+        self.set_plan_codec(serverId)
 
     """
     Handle self.Level value.
@@ -345,9 +441,10 @@ class Regression(Repository, CalcRegression):
                 plan.pop(k)
         return plan
 
-    def __calc_regression(self, plan, reg, queryid, planid, depth):
+    def __calc_regression(self, plan, stat, reg, queryid, planid, depth):
         """
-        Calculate the regression parameters of plan, and Set the results into reg.
+        Calculate the regression parameters of plan from its sufficient
+        statistics stat, and Set the results into reg.
         """
 
         self.__incr_level()
@@ -358,84 +455,50 @@ class Regression(Repository, CalcRegression):
         """
         nested loop type
         """
-        for n in (
-            "Append",
-            "Merge Append",
-            "Recursive Union",
-            "Nested Loop",
-            "BitmapAnd",
-            "BitmapOr",
-        ):
-            if n == _node_type:
-                (
-                    _Xouter,
-                    _Xinner,
-                    _RR,
-                ) = self.get_inputs(plan)
-                """
-                Calculate the regression parameter.
-                """
-                if Log.debug3 <= self.LogLevel:
-                    print("Debug3: === NodeType={}".format(n))
-                    print("Debug3: *** Y ActualRows={}".format(plan["Actual Rows"]))
-                    print(
-                        "Debug3: *** Xouter ={}    Xinner ={}".format(_Xouter, _Xinner)
+        if _node_type in self.NESTED_LOOP_TYPES:
+            """
+            Calculate the regression parameter.
+            """
+            if Log.debug3 <= self.LogLevel:
+                print("Debug3: === NodeType={}".format(_node_type))
+                print(
+                    "Debug3: *** N={}  SumXY={}  SumXX={}".format(
+                        stat["N"], stat["SumXY"], stat["SumXX"]
                     )
+                )
 
-                _Y = plan["Actual Rows"]
-                _coef = self.nested_loop(_Xouter, _Xinner, _Y)
+            _coef = self.nested_loop_sums(stat["SumXY"], stat["SumXX"])
 
-                """
-                Set the result to the reg dict.
-                """
-                if type(_coef) is list:
-                    reg.update(Coefficient=_coef)
-                else:
-                    reg.update(Coefficient=[_coef])
-                return
+            """
+            Set the result to the reg dict.
+            """
+            reg.update(Coefficient=[_coef])
+            return
 
         """
         hash or merge join
         """
-        for n in ("Merge Join", "Hash Join"):
-            if n == _node_type:
-                (
-                    _Xouter,
-                    _Xinner,
-                    _RR,
-                ) = self.get_inputs(plan)
-                """
-                Calculate the  regression parameter.
-                """
-                if Log.debug3 <= self.LogLevel:
-                    print(
-                        "Debug3: HASH or MERGE depth={}  RR={}  queryid={} planid={}".format(
-                            depth, _RR, queryid, planid
-                        )
+        if _node_type in self.JOIN_TYPES:
+            if Log.debug3 <= self.LogLevel:
+                print(
+                    "Debug3: HASH or MERGE depth={}  queryid={} planid={}".format(
+                        depth, queryid, planid
                     )
-                if Log.debug3 <= self.LogLevel:
-                    print("Debug3: === NodeType={}".format(n))
-                    print("Debug3: *** Y ActualRows={}".format(plan["Actual Rows"]))
-                    print(
-                        "Debug3: *** Xouter ={}    Xinner ={}".format(_Xouter, _Xinner)
+                )
+                print("Debug3: === NodeType={}".format(_node_type))
+                print(
+                    "Debug3: *** N={}  Mean={}  M2={}".format(
+                        stat["N"], stat["Mean"], stat["M2"]
                     )
-
-                _Y = plan["Actual Rows"]
-                (_coef, _reg, _intercept) = self.merge_or_hash_join(
-                    _Xouter, _Xinner, _Y
                 )
 
-                """
-                Set the result to the reg dict.
-                """
-                if type(_coef) is list:
-                    reg.update(Coefficient=_coef)
-                else:
-                    reg.update(Coefficient=[_coef])
-                reg.update(Coefficient2=[round(_reg + 0.0, 5)])
-                reg.update(Intercept=[round(_intercept + 0.0, 5)])
-
-                return
+            """
+            The regression parameters of all merge and hash join nodes are
+            calculated in a batch by __flush_joins(), so Store the statistics
+            and the reg dict.
+            """
+            self.__pending_joins.append((stat, reg))
+            return
 
         """
         scan type
@@ -445,29 +508,57 @@ class Regression(Repository, CalcRegression):
         if Log.debug3 <= self.LogLevel:
             print("Debug3: === NodeType={}".format(_node_type))
             print(
-                "Debug3: *** Plan Rows={}      NormalizeParam={}      NormalizePlanParam={}".format(
-                    plan["Plan Rows"],
-                    plan["NormalizeParam"],
-                    plan["NormalizePlanParam"],
+                "Debug3: *** N={}  Sum of Plan Rows={}  Sum of Actual Rows={}".format(
+                    stat["N"], stat["SumX"], stat["SumY"]
                 )
             )
-            print("Debug3: *** Actual Rows={}".format(plan["Actual Rows"]))
 
-        (_coef, _intercept) = self.scan(plan["Plan Rows"], plan["Actual Rows"])
+        (_coef, _intercept) = self.scan_sums(stat["SumX"], stat["SumY"], stat["N"])
 
         """
         Set the result to the reg dict.
         """
-        if type(_coef) is list:
-            reg.update(Coefficient=_coef)
-        else:
-            reg.update(Coefficient=[_coef])
+        reg.update(Coefficient=[_coef])
         reg.update(Intercept=[round(_intercept + 0.0, 5)])
         return
 
-    def __set_relations(self, Plans, depth):
+    """Number of the join nodes calculated in one batch."""
+    BATCH_JOINS = 1 << 16
+
+    def __init_batch(self):
+        self.__pending_joins = []
+        self.__pending_writes = []
+
+    def __flush_joins(self):
+        """
+        Calculate the regression parameters of the pending join nodes, and
+        Write the pending results to the regression directory.
         """
-        Set "Relation Name" in Plans by gathering children's "Relation Name" up if Plans does not have it.
+        _results = self.merge_or_hash_join_stats_batch(
+            [_stat for (_stat, _reg) in self.__pending_joins]
+        )
+        for (_stat, reg), (_coef, _reg, _intercept) in zip(
+            self.__pending_joins, _results
+        ):
+            """
+            Set the result to the reg dict.
+            """
+            reg.update(Coefficient=_coef)
+            reg.update(Coefficient2=[round(_reg + 0.0, 5)])
+            reg.update(Intercept=[round(_intercept + 0.0, 5)])
+
+        for (_reg_param, _rpath) in self.__pending_writes:
+            self.write_plan_json(_reg_param, _rpath)
+
+            if Log.debug3 <= self.LogLevel:
+                print("Debug3: Rpath={}".format(_rpath))
+                print("Debug3:   reg_param={}".format(_reg_param))
+
+        self.__init_batch()
+
+    def __set_relations(self, plan):
+        """
+        Set "Relation Name" in plan by gathering children's "Relation Name" up if plan does not have it.
 
         For example, if the node type of Plans is "Sort" and the node type of Plans' child is "Seq Scan",
         the relation name of Plans is set to the relation name of Plans' child.
@@ -565,51 +656,27 @@ class Regression(Repository, CalcRegression):
                     if "Alias" in __plan:
                         plan.update([("Alias", __plan["Alias"])])
 
-        def incr(plan):
-            if "Node Type" in plan:
-                self._count += 1
-
-        def op(Plans):
-            if isinstance(Plans, list):
-                for i in range(0, len(Plans)):
-                    incr(Plans[i])
-                    if self._depth == self._count:
-                        get_relations(Plans[i])
-                        return
-                    elif "Plans" in Plans[i]:
-                        op(Plans[i]["Plans"])
-            else:
-                incr(Plans)
-                if self._depth == self._count:
-                    get_relations(Plans)
-                    return
-                elif "Plans" in Plans:
-                    op(Plans["Plans"])
-
-        self._depth = depth
-        self._count = 0
-        op(Plans)
+        get_relations(plan)
 
     def __add_relations(self, Plans):
         """
-        Add "Relation Name"
+        Add "Relation Name" in each node, from the bottom node to the top node.
         """
-        i = self.count_nodes(Plans)
-        while 0 < i:
-            self.__set_relations(Plans["Plan"], i)
-            i -= 1
+        for _plan in reversed(self.get_node_list(Plans["Plan"])):
+            self.__set_relations(_plan)
 
-    def __regression(self, Plans, reg_param, queryid, planid):
+    def __regression(self, stats, reg_param, queryid, planid):
         """
-        Calculate the regression parameters of Plans, and Set the results into
-        reg_param.
+        Calculate the regression parameters of a grouped plan, and Set the
+        results into reg_param.
 
         Parameters
         ----------
-        Plans : dict
-          A plan grouped with the same queryid-planid.
+        stats : dict
+          The sufficient statistics of a plan grouped with the same
+          queryid-planid. See SufficientStats.
         reg_param : dict
-          A dict type skeleton with the same structure as Plans.
+          A dict type skeleton with the same structure as the grouped plan.
         queryid : int
         planid : int
 
@@ -620,83 +687,146 @@ class Regression(Repository, CalcRegression):
 
         """
 
-        def incr(plan):
-            if "Node Type" in plan:
-                self._count += 1
+        _reg_nodes = self.get_node_list(reg_param)
+        for _i, _stat in enumerate(stats["Nodes"]):
+            _reg = _reg_nodes[_i]
+            self.__calc_regression(_reg, _stat, _reg, queryid, planid, _i + 1)
 
-        def op(Plans, reg_param, queryid, planid):
-            if isinstance(Plans, list):
-                for i in range(0, len(Plans)):
-                    incr(Plans[i])
-                    self.__calc_regression(
-                        Plans[i], reg_param[i], queryid, planid, self._count
-                    )
-                    if "Plans" in Plans[i]:
-                        op(Plans[i]["Plans"], reg_param[i]["Plans"], queryid, planid)
-                return
-            else:
-                incr(Plans)
-                self.__calc_regression(Plans, reg_param, queryid, planid, self._count)
-                if "Plans" in Plans:
-                    op(Plans["Plans"], reg_param["Plans"], queryid, planid)
-                return
+    def __get_stats(self, gpath):
+        """
+        Return the sufficient statistics of the grouped plan (gpath).
+        If not found, i.e. the grouped plan was stored by a previous version,
+        they are made from all samples and stored.
+        """
+        _stats = self.read_grouping_stats(gpath)
+        if _stats is None:
+            _skeleton = self.read_plan_json(gpath)
+            _seqid = 0
+            if self.GROUPING_STORE_KEY in _skeleton:
+                _seqid = self.get_grouping_last_seqid(
+                    gpath, _skeleton[self.GROUPING_STORE_KEY]
+                )
+            _json_dict = self.read_grouping_plan(gpath)
+            _stats = self.new_statistics(_json_dict)
+            self.update_statistics(_stats, _json_dict, _seqid)
+            self.write_grouping_stats(_stats, gpath)
+        return _stats
+
+    def __get_changed_plans(self, regression_seqid, grouping_seqid):
+        """
+        Return the list of (subdir, filename) of the grouped plans changed in
+        the seqid range (regression_seqid, grouping_seqid].
+
+        The manifests written by Grouping.grouping() are used if they cover
+        the range; otherwise, all grouped plans are returned.
+        """
+        _plans = self.get_grouping_manifest(
+            self.ServerId, regression_seqid, grouping_seqid
+        )
+        if _plans is not None:
+            if Log.debug1 <= self.LogLevel:
+                print(
+                    "Debug1: {} plans are found in the manifests.".format(len(_plans))
+                )
+            return _plans
+
+        if Log.debug1 <= self.LogLevel:
+            print("Debug1: manifests are not found. Scan all grouped plans.")
+        _plans = []
+        for _hash_subdir in self.get_grouping_dir_list(self.ServerId):
+            _gsdirpath = self.get_grouping_subdir_path(self.ServerId, _hash_subdir)
+            if os.path.isdir(_gsdirpath):
+                for f in self.get_grouping_subdir_list(self.ServerId, _hash_subdir):
+                    _plans.append((_hash_subdir, f))
+        return _plans
 
-        # Main procedure.
-        self._count = 0
-        op(Plans, reg_param, queryid, planid)
+    """
+    Public method
+    """
 
-    def __get_sort_space_used(self, Plans, queryid, planid):
+    def regression_plans(self, serverId, plans, regression_seqid, work_mem=True):
         """
-        Get and return the max "Sort Space Used" value if "Sort Space Type" is "Disk"
+        Calculate the regression parameters of plans, and Write them to the
+        regression directory.
+
+        This is called by regression() directly or by its workers, one call
+        per set of hash subdirs.
 
         Parameters
         ----------
-        Plans : dict
-          A plan grouped with the same queryid-planid.
-        queryid : int
-        planid : int
+        serverId : str
+        plans : list of (subdir, filename)
+          The grouped plans.
+        regression_seqid : int
+          The seqid of the last regression; the plans which have no sample
+          added after it are skipped.
+        work_mem : bool
+        """
+        self.__set_serverId(serverId)
+        self.set_log_level(self.LogLevel)
 
-        Returns
-        -------
-        Max "Sort Space Used" value.
-
-        """
-
-        def pickup_sort_space_used(plan, queryid, planid):
-            if "Sort Space Type" in plan:
-                _type = plan["Sort Space Type"]
-                _used = plan["Sort Space Used"]
-                for i in range(len(_type)):
-                    if _type[i] == "Disk":
-                        if self._max_sort_space_used < _used[i]:
-                            self._max_sort_space_used = _used[i]
-
-        def op(Plans, queryid, planid):
-            if isinstance(Plans, list):
-                for i in range(0, len(Plans)):
-                    pickup_sort_space_used(Plans[i], queryid, planid)
-                    if "Plans" in Plans[i]:
-                        op(Plans[i]["Plans"], queryid, planid)
-                return
-            else:
-                pickup_sort_space_used(Plans, queryid, planid)
-                if "Plans" in Plans:
-                    op(Plans["Plans"], queryid, planid)
-                return
+        self.__init_batch()
+        for (_hash_subdir, f) in plans:
+            _gpath = self.path(
+                self.get_grouping_subdir_path(self.ServerId, _hash_subdir), f
+            )
+            _rsdirpath = self.get_regression_subdir_path(self.ServerId, _hash_subdir)
+            _rpath = self.path(_rsdirpath, f)
+            _qp_id = str(f).split(".")
+            _queryid = _qp_id[0]
+            _planid = _qp_id[1]
 
-        # Main procedure.
-        self._max_sort_space_used = 0
-        op(Plans, queryid, planid)
-        return None if self._max_sort_space_used == 0 else self._max_sort_space_used
+            """
+            Get the sufficient statistics of the grouped plan, and Skip it
+            if no sample has been added since the last regression.
+            """
+            _stats = self.__get_stats(_gpath)
+            if _stats["Seqid"] <= regression_seqid and os.path.exists(_rpath):
+                continue
 
-    """
-    Public method
-    """
+            if Log.debug3 <= self.LogLevel:
+                print("Debug3: >>>>>> gpath={}".format(_gpath))
 
-    def regression(self, serverId, work_mem=True):
+            """
+            Use the skeleton of the grouped plan as the skeleton of _reg_param.
+            """
+            _reg_param = self.read_grouping_skeleton(_gpath)
+            self.__add_relations(_reg_param)
+            self.delete_unnecessary_objects(self.__delete_objects, _reg_param)
+
+            """
+            Calculate the regression parameters in each plan and Store into
+            _reg_param.
+            """
+            self.__init_level()
+            self.__regression(_stats, _reg_param["Plan"], _queryid, _planid)
+
+            """
+            Add "Sort Space Used" item if "Sort Space Type" is "Disk".
+            """
+            if work_mem == True:
+                if 0 < _stats["SortSpaceUsed"]:
+                    _reg_param.update({"SortSpaceUsed": _stats["SortSpaceUsed"]})
+
+            """
+            Write the result (regression parameters) to the regression
+            directory.
+            """
+            if os.path.exists(_rsdirpath) == False:
+                os.makedirs(_rsdirpath)
+            self.__pending_writes.append((_reg_param, _rpath))
+            if self.BATCH_JOINS <= len(self.__pending_joins):
+                self.__flush_joins()
+
+        self.__flush_joins()
+
+    def regression(self, serverId, work_mem=True, jobs=1):
         """
         Calculate the regression parameters of all serverId's query plans
         in the repository.
+
+        If jobs is greater than 1, the hash subdirs are processed by a pool of
+        jobs processes, and the stat file is updated after all of them finish.
         """
 
         if self.check_serverId(serverId) == False:
@@ -733,65 +863,37 @@ class Regression(Repository, CalcRegression):
         """
         if _regression_seqid < _grouping_seqid:
 
-            for _hash_subdir in self.get_grouping_dir_list(self.ServerId):
-                _gsdirpath = self.get_grouping_subdir_path(self.ServerId, _hash_subdir)
-                if os.path.isdir(_gsdirpath):
-                    _gsdirlist = self.get_grouping_subdir_list(
-                        self.ServerId, _hash_subdir
-                    )
-                    for f in _gsdirlist:
-                        _gpath = self.path(_gsdirpath, f)
-                        _qp_id = str(f).split(".")
-                        _queryid = _qp_id[0]
-                        _planid = _qp_id[1]
-                        if Log.debug3 <= self.LogLevel:
-                            print("Debug3: >>>>>> gpath={}".format(_gpath))
-
-                        _json_dict = self.read_plan_json(_gpath)
-                        _reg_param = self.read_plan_json(_gpath)
-                        self.__add_relations(_reg_param)
-                        self.delete_unnecessary_objects(
-                            self.__delete_objects, _reg_param
-                        )
-
-                        """
-                        Calculate the regression parameters in each plan
-                        and Store into _reg_param.
-                        """
-                        self.__init_level()
-                        self.__regression(
-                            _json_dict["Plan"], _reg_param["Plan"], _queryid, _planid
-                        )
+            _plans = self.__get_changed_plans(_regression_seqid, _grouping_seqid)
 
-                        """
-                        Add "Sort Space Used" item if "Sort Space Type" is "Disk".
-                        """
-                        if work_mem == True:
-                            self.__init_level()
-                            _max_sort_space_used = self.__get_sort_space_used(
-                                _json_dict["Plan"], _queryid, _planid
-                            )
-                            if _max_sort_space_used is not None:
-                                _reg_param.update(
-                                    {"SortSpaceUsed": _max_sort_space_used}
-                                )
-
-                        """
-                        Write the result (regression parameters) to the regression
-                        directory.
-                        """
-                        _rsdirpath = self.get_regression_subdir_path(
-                            self.ServerId, _hash_subdir
-                        )
-                        if os.path.exists(_rsdirpath) == False:
-                            os.makedirs(_rsdirpath)
+            if jobs <= 1:
+                self.regression_plans(
+                    self.ServerId, _plans, _regression_seqid, work_mem
+                )
+            else:
+                """Divide the plans by the hash subdir."""
+                _buckets = {}
+                for _plan in _plans:
+                    _buckets.setdefault(_plan[0], []).append(_plan)
+                _tasks = [
+                    (
+                        self.base_dir[:-1],
+                        self.LogLevel,
+                        self.ServerId,
+                        _buckets[_b],
+                        _regression_seqid,
+                        work_mem,
+                    )
+                    for _b in sorted(_buckets)
+                ]
+                self.run_jobs(regression_worker, _tasks, jobs)
 
-                        _rpath = self.path(_rsdirpath, f)
-                        self.write_plan_json(_reg_param, _rpath)
+            """Update stat file, and Remove the manifests already consumed."""
+            self.update_regression_stat_file(self.ServerId, _grouping_seqid)
+            self.remove_grouping_manifests(self.ServerId, _grouping_seqid)
 
-                        if Log.debug3 <= self.LogLevel:
-                            print("Debug3: Rpath={}".format(_rpath))
-                            print("Debug3:   reg_param={}".format(_reg_param))
 
-            """Update stat file"""
-            self.update_regression_stat_file(self.ServerId, _grouping_seqid)
+def regression_worker(task):
+    """Run Regression.regression_plans() in a worker process of regression()."""
+    (_base_dir, _log_level, _serverId, _plans, _regression_seqid, _work_mem) = task
+    _rg = Regression(_base_dir, log_level=_log_level)
+    _rg.regression_plans(_serverId, _plans, _regression_seqid, _work_mem)
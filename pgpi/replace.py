@@ -55,11 +55,7 @@ class Replace(Common):
         _node_type = plan["Node Type"]
 
         if Log.debug1 <= self.LogLevel:
-            print(
-                "Debug1: count={} depth={} Node Type={}".format(
-                    self._count, self._depth, plan["Node Type"]
-                )
-            )
+            print("Debug1: depth={} Node Type={}".format(depth, plan["Node Type"]))
 
         """
         nested loop type
@@ -226,39 +222,6 @@ class Replace(Common):
                 plan.update(OriginalPlanRows=plan["Plan Rows"])
         return
 
-    def __replace(self, Plans, Reg_Params, depth, queryid, planid):
-        """
-        In the depth-th node of Plans, Replace the 'Plan Rows' of original Plans
-        with the estimated 'Plan Rows' using the regression params:Reg_Params.
-        """
-
-        def incr(plan):
-            if "Node Type" in plan:
-                self._count += 1
-
-        def op(Plans, Reg_Params, queryid, planid):
-            if isinstance(Plans, list):
-                for i in range(0, len(Plans)):
-                    incr(Plans[i])
-                    if self._depth == self._count:
-                        self.__calc(
-                            Plans[i], Reg_Params[i], queryid, planid, self._count
-                        )
-                        return
-                    elif "Plans" in Plans[i]:
-                        op(Plans[i]["Plans"], Reg_Params[i]["Plans"], queryid, planid)
-            else:
-                incr(Plans)
-                if self._depth == self._count:
-                    self.__calc(Plans, Reg_Params, queryid, planid, self._count)
-                    return
-                elif "Plans" in Plans:
-                    op(Plans["Plans"], Reg_Params["Plans"], queryid, planid)
-
-        self._depth = depth
-        self._count = 0
-        op(Plans, Reg_Params, queryid, planid)
-
     """
     Public method
     """
@@ -347,11 +310,18 @@ class Replace(Common):
         ```
         """
 
-        i = numNode
+        """
+        The nodes of Plans and Reg_Params have the same structure, so the i-th
+        node of Plans corresponds to the i-th node of Reg_Params.
+        """
+        _nodes = self.get_node_list(Plans)
+        _params = self.get_node_list(Reg_Params)
+
+        i = min(numNode, len(_nodes))
         if Log.debug1 <= self.LogLevel:
             print("Debug1: >>> Start replace")
         while 0 < i:
             if Log.debug1 <= self.LogLevel:
                 print("Debug1: >>> replace i = {}".format(i))
-            self.__replace(Plans, Reg_Params, i, queryid, planid)
+            self.__calc(_nodes[i - 1], _params[i - 1], queryid, planid, i)
             i -= 1
@@ -9,13 +9,28 @@ repository.py
 
 import configparser
 import glob
+import json
+import math
+import struct
 import shutil
 import sys
 import csv
+import io
 import os
 import re
+import threading
 
-from .common import Common, Log
+from .catalog import Catalog
+from .common import Common, Log, zstandard
+from .log_index import LogIndex
+from .segment import Segment
+
+"""
+The parsed hosts.conf files shared in the process:
+{path: ((st_ino, st_mode, st_mtime_ns, st_size), ConfigParser)}.
+"""
+_hosts_conf_cache = {}
+_hosts_conf_lock = threading.Lock()
 
 
 class Repository(Common):
@@ -48,6 +63,9 @@ class Repository(Common):
             stat.write(configfile)
 
     def __update_stat_file(self, serverId, max_seqid, _dir):
+        if self.has_catalog(serverId):
+            self.get_catalog(serverId).set_seqid(_dir, max_seqid)
+            return
         _dirpath = self.dirpath([serverId, _dir])
         _path = self.path(_dirpath, self.STAT_FILE)
 
@@ -57,6 +75,8 @@ class Repository(Common):
             stat.write(configfile)
 
     def __get_seqid_from_stat_file(self, serverId, _dir):
+        if self.has_catalog(serverId):
+            return self.get_catalog(serverId).get_seqid(_dir)
         _dirpath = self.dirpath([serverId, _dir])
         _path = self.path(_dirpath, self.STAT_FILE)
 
@@ -97,6 +117,9 @@ class Repository(Common):
                     print("Debug2: rm dir '{}'".format(_rsdirpath))
                 shutil.rmtree(_rsdirpath)
                 # update_stat_file(serverId, 0)
+                if self.has_catalog(serverId):
+                    self.get_catalog(serverId).delete_rows()
+                    update_stat_file(serverId, 0)
             else:
                 _d = str(_rsdirpath) + "/" + "[0-9][0-9][0-9]"
                 _dirs = glob.glob(_d, recursive=True)
@@ -125,21 +148,40 @@ class Repository(Common):
                 sys.exit(1)
         return _path
 
+    def get_hosts_conf(self):
+        """
+        Return the ConfigParser of hosts.conf, which must not be modified.
+
+        The parsed hosts.conf is cached in the process, and it is read and
+        checked again only if its inode, mode, mtime or size has changed,
+        so it costs one stat() to get the cached one.
+        """
+        _path = os.path.abspath(
+            self.base_dir + self.REPOSITORY_DIR + "/" + self.CONF_FILE
+        )
+        try:
+            _st = os.stat(_path)
+            _key = (_st.st_ino, _st.st_mode, _st.st_mtime_ns, _st.st_size)
+        except FileNotFoundError:
+            _key = None
+        with _hosts_conf_lock:
+            _cached = _hosts_conf_cache.get(_path)
+            if _cached is None or _cached[0] != _key:
+                _config = configparser.ConfigParser()
+                _config.read(self.get_conf_file_path())
+                _cached = _hosts_conf_cache[_path] = (_key, _config)
+        return _cached[1]
+
     def check_serverId(self, serverId):
         if self.is_serverId_valid(serverId) == False:
             if Log.error <= self.LogLevel:
                 print("Error: serverId='{}' is invalid.".format(serverId))
                 print("\tserverId must be the following regular expression:[A-z0-9_]+")
             sys.exit(1)
-        _path = self.get_conf_file_path()
-        config = configparser.ConfigParser()
-        config.read(_path)
-        return config.has_section(serverId)
+        return self.get_hosts_conf().has_section(serverId)
 
     def get_serverId(self, host, port):
-        _path = self.get_conf_file_path()
-        _config = configparser.ConfigParser()
-        _config.read(_path)
+        _config = self.get_hosts_conf()
         _ret = None
         for section in _config.sections():
             if "host" in _config[section] and "port" in _config[section]:
@@ -151,6 +193,34 @@ class Repository(Common):
                     break
         return _ret
 
+    def get_plan_codec(self, serverId):
+        """
+        Return the codec of the plans of serverId, which is set by the
+        'plan_codec' key in the hosts.conf (default: 'json'). It can be set
+        in the DEFAULT section to apply to all servers.
+        """
+        _config = self.get_hosts_conf()
+        _codec = self.DEFAULT_PLAN_CODEC
+        if _config.has_section(serverId):
+            _codec = _config[serverId].get("plan_codec", _codec).strip().lower()
+        if _codec not in self.PLAN_CODECS:
+            if Log.error <= self.LogLevel:
+                print(
+                    "Error: plan_codec '{}' is invalid; it must be one of {}.".format(
+                        _codec, ", ".join(self.PLAN_CODECS)
+                    )
+                )
+            sys.exit(1)
+        if _codec == "zstd" and zstandard is None:
+            if Log.error <= self.LogLevel:
+                print("Error: plan_codec 'zstd' requires zstandard.")
+            sys.exit(1)
+        return _codec
+
+    def set_plan_codec(self, serverId):
+        """Write the plans by the codec of serverId from now on."""
+        self.PlanCodec = self.get_plan_codec(serverId)
+
     def dirpath(self, dirlist):
         _dir = self.base_dir + self.REPOSITORY_DIR + "/"
         if isinstance(dirlist, list):
@@ -222,8 +292,7 @@ class Repository(Common):
 
         # Check serverIds.
         print("Checking serverIds....")
-        _config = configparser.ConfigParser()
-        _config.read(_path)
+        _config = self.get_hosts_conf()
         _ret = True
         for s in _config.sections():
             if self.is_serverId_valid(s) == False:
@@ -319,9 +388,7 @@ class Repository(Common):
         return rm_dir(serverId)
 
     def show_hosts(self, verbose):
-        _path = self.get_conf_file_path()
-        _config = configparser.ConfigParser()
-        _config.read(_path)
+        _config = self.get_hosts_conf()
         print("ServerId:")
         for section in _config.sections():
             if "host" in _config[section]:
@@ -333,6 +400,81 @@ class Repository(Common):
                     if "username" in _config[section]:
                         print("\t\tusername = {}".format(_config[section]["username"]))
 
+    """
+    catalog
+    """
+
+    def get_catalog_path(self, serverId):
+        return self.path(self.dirpath([serverId]), self.CATALOG_FILE)
+
+    def has_catalog(self, serverId):
+        """Whether serverId uses the catalog instead of log.csv and stat.dat."""
+        return os.path.isfile(self.get_catalog_path(serverId))
+
+    def get_catalog(self, serverId):
+        """Return the Catalog of serverId, which is kept open in this object."""
+        try:
+            _catalogs = self.__catalogs
+        except AttributeError:
+            _catalogs = self.__catalogs = {}
+        if serverId not in _catalogs:
+            _catalogs[serverId] = Catalog(self.get_catalog_path(serverId))
+        return _catalogs[serverId]
+
+    def migrate_catalog(self, serverId):
+        """
+        Convert log.csv and the stat.dat files of serverId to the catalog,
+        and remove them. The catalog is made in a temporary
+        file which is renamed at last, so an interrupted migration can simply
+        be run again.
+
+        Returns
+        -------
+        _num_rows : int
+           Return the number of migrated rows.
+        """
+        if self.check_serverId(serverId) == False:
+            if Log.error <= self.LogLevel:
+                print("Error: serverId '{}' is not registered.".format(serverId))
+            sys.exit(1)
+
+        if self.has_catalog(serverId):
+            if Log.info <= self.LogLevel:
+                print("Info: '{}' already uses the catalog.".format(serverId))
+            return 0
+
+        self.check_tables_dir(serverId)
+        _tmppath = self.get_catalog_path(serverId) + ".tmp"
+        if os.path.exists(_tmppath):
+            os.remove(_tmppath)
+        _catalog = Catalog(_tmppath)
+        _num_rows = 0
+        for _row in self.read_log_csv(serverId):
+            _catalog.append_row(_row)
+            _num_rows += 1
+        for _dir in (self.TABLES_DIR, self.GROUPING_DIR, self.REGRESSION_DIR):
+            _catalog.set_seqid(_dir, self.__get_seqid_from_stat_file(serverId, _dir))
+        _catalog.close()
+        os.rename(_tmppath, self.get_catalog_path(serverId))
+
+        """Remove the files that have been replaced by the catalog."""
+        _files = [
+            self.path(self.dirpath([serverId, _dir]), self.STAT_FILE)
+            for _dir in (self.TABLES_DIR, self.GROUPING_DIR, self.REGRESSION_DIR)
+        ]
+        _files.append(self.get_log_csv_path(serverId))
+        _files.append(
+            self.path(self.dirpath([serverId, self.TABLES_DIR]), self.TABLES_INDEX_FILE)
+        )
+        _files.append(self.get_query_index_path(serverId))
+        for _file in _files:
+            if os.path.exists(_file):
+                os.remove(_file)
+
+        if Log.info <= self.LogLevel:
+            print("Info: {} rows are migrated.".format(_num_rows))
+        return _num_rows
+
     """
     tables subdir
     """
@@ -353,6 +495,102 @@ class Repository(Common):
         _csvdirpath = self.dirpath([serverId, self.TABLES_DIR])
         return self.path(_csvdirpath, self.TABLES_FILE)
 
+    def get_log_index(self, serverId):
+        """Return the LogIndex of log.csv of serverId."""
+        _csvdirpath = self.dirpath([serverId, self.TABLES_DIR])
+        return LogIndex(
+            self.path(_csvdirpath, self.TABLES_FILE),
+            self.path(_csvdirpath, self.TABLES_INDEX_FILE),
+        )
+
+    def read_log_csv(self, serverId, from_seqid=0, to_seqid=None):
+        """
+        Yield the rows of log.csv whose seqids are greater than from_seqid
+        and not greater than to_seqid (if not None), in the stored order.
+        The reading starts from the offset found by the LogIndex, or the
+        rows are read from the catalog if serverId uses it.
+
+        Parameters
+        ----------
+        serverId : str
+        from_seqid : int
+        to_seqid : int
+
+        Yields
+        ------
+        _row : list of str
+          [seqid, starttime, endtime, database, pid, nested_level,
+           queryid, planid]
+        """
+        if self.has_catalog(serverId):
+            yield from self.get_catalog(serverId).read_rows(from_seqid, to_seqid)
+            return
+        _path = self.get_log_csv_path(serverId)
+        if os.path.exists(_path) == False:
+            return
+        _offset = self.get_log_index(serverId).find_offset(from_seqid)
+        with open(_path, "rb") as _fp:
+            _fp.seek(_offset)
+            _reader = csv.reader(
+                io.TextIOWrapper(_fp, newline=""),
+                delimiter=",",
+                quoting=csv.QUOTE_NONE,
+            )
+            for _row in _reader:
+                _seqid = int(_row[0])
+                if from_seqid < _seqid and (to_seqid is None or _seqid <= to_seqid):
+                    yield _row
+
+    def truncate_log_csv(self, serverId, seqid):
+        """
+        Remove the rows whose seqids are greater than seqid from the end of
+        log.csv, and Return them as read_log_csv() yields.
+
+        Since get_tables() appends the rows in seqid order and updates the
+        tables stat file after all their files are written, the rows after
+        the first one above the tables stat seqid are the ones appended by
+        an interrupted get_tables(). They are got again by the next one.
+        """
+        _path = self.get_log_csv_path(serverId)
+        if os.path.exists(_path) == False:
+            return []
+        _offset = self.get_log_index(serverId).find_offset(seqid)
+        _rows = []
+        _cut = None
+        with open(_path, "r+b") as _fp:
+            _fp.seek(_offset)
+            for _line in _fp:
+                if _cut is None:
+                    _s = _line.split(b",", 1)[0]
+                    if _s.isdigit() and seqid < int(_s):
+                        _cut = _offset
+                if _cut is not None:
+                    _rows.append(_line.decode("utf-8").rstrip("\n").split(","))
+                _offset += len(_line)
+            if _cut is not None:
+                _fp.truncate(_cut)
+        return _rows
+
+    def get_log_latest_plans(self, serverId):
+        """
+        Return {database: {queryid: (planid (str), seqid)}} of the latest
+        rows in log.csv, which is read only once. The databases are in the
+        order they appear first.
+        """
+        if self.has_catalog(serverId):
+            _plans = self.get_catalog(serverId).get_latest_plans()
+            return {
+                _db: {_q: (str(_p), _s) for (_q, (_p, _s)) in _dict.items()}
+                for (_db, _dict) in _plans.items()
+            }
+        _plans = {}
+        for _row in self.read_log_csv(serverId):
+            _plans.setdefault(_row[3], {})[int(_row[6])] = (
+                str(int(_row[7])),
+                int(_row[0]),
+            )
+        return _plans
+
     def get_query_dir_path(self, serverId, queryid):
         return self.dirpath(
             [
@@ -390,35 +628,165 @@ class Repository(Common):
         _logdirpath = self.get_plan_json_dir_path(serverId, queryid, planid)
         return self.path(_logdirpath, str(seqid))
 
-    def get_query(self, serverId, queryid):
-        """Get Query by queryid"""
+    def get_tables_segment_dir_path(self, serverId):
+        return self.dirpath([serverId, self.TABLES_DIR, self.TABLES_SEGMENT_DIR])
 
-        _dirpath = self.dirpath(
-            [
-                serverId,
-                self.TABLES_DIR,
-                self.TABLES_QUERY_DIR,
-                self.hash_dir(int(queryid)),
-                str(queryid),
-            ]
+    def is_tables_segmented(self, serverId):
+        """Whether the tables dir of serverId uses the segment-file layout."""
+        return os.path.isdir(self.get_tables_segment_dir_path(serverId))
+
+    def get_tables_segment(self, serverId, kind):
+        """
+        Return the Segment of kind, i.e. TABLES_QUERY_DIR, TABLES_PLAN_DIR
+        or TABLES_PLAN_JSON_DIR, in the tables dir of serverId. The Segment
+        is kept open until close_tables_segments() is called.
+        """
+        try:
+            _segments = self.__segments
+        except AttributeError:
+            _segments = self.__segments = {}
+        if (serverId, kind) not in _segments:
+            _segments[(serverId, kind)] = self.new_tables_segment(
+                self.get_tables_segment_dir_path(serverId), kind
+            )
+        return _segments[(serverId, kind)]
+
+    def new_tables_segment(self, dirpath, kind):
+        """
+        Return a new Segment of kind in dirpath. Since the query texts of
+        the same queryid are almost always identical, they are stored once
+        per distinct text. The texts are written by PlanCodec, as the files
+        of the other layout are.
+        """
+        return Segment(
+            dirpath, kind, dedup=(kind == self.TABLES_QUERY_DIR), codec=self.PlanCodec
+        )
+
+    def close_tables_segments(self):
+        try:
+            _segments = self.__segments
+        except AttributeError:
+            return
+        for _segment in _segments.values():
+            _segment.close()
+        self.__segments = {}
+
+    def read_tables_plan_json(self, serverId, seqid, queryid, planid):
+        """
+        Read the plan of seqid stored in the tables dir, whichever layout
+        is used. Return None if not found.
+        """
+        if self.is_tables_segmented(serverId):
+            _segment = self.get_tables_segment(serverId, self.TABLES_PLAN_JSON_DIR)
+            _text = _segment.get(seqid)
+            return None if _text is None else json.loads(_text)
+        _path = self.get_plan_json_path(serverId, seqid, queryid, planid)
+        if os.path.isfile(_path) == False:
+            return None
+        return self.read_plan_json(_path)
+
+    def get_query_index_path(self, serverId):
+        return self.path(
+            self.dirpath([serverId, self.TABLES_DIR]), self.TABLES_QUERY_INDEX_FILE
         )
-        _files = glob.glob(_dirpath + "[0-9]*")
-        for _qf in _files:
-            _seqid_file = _qf.split("/")[-1]
-            # Get query
-            with open(_qf) as fp:
-                _query = fp.read()
-
-            # Get database from log.csv
-            with open(self.get_log_csv_path(self.ServerId), newline="") as f:
-                _reader = csv.reader(f, delimiter=",", quoting=csv.QUOTE_NONE)
-                for _row in _reader:
-                    _seqid = int(_row[0])
-                    _database = str(_row[3])
-                    _planid = int(_row[7])
-                    if int(_seqid_file) == _seqid:
-                        return (_database, _query, _planid)
-        return (None, None, None)
+
+    def __load_query_index(self, serverId):
+        """
+        Load the query index, which is the json lines of
+        [queryid, seqid, database, planid] of the first row of each queryid,
+        and [seqid] that shows the rows up to seqid have been indexed.
+        A torn line at the end is removed.
+        """
+        try:
+            _indexes = self.__query_indexes
+        except AttributeError:
+            _indexes = self.__query_indexes = {}
+        if serverId in _indexes:
+            return _indexes[serverId]
+
+        _index = {}
+        _seqid = 0
+        _path = self.get_query_index_path(serverId)
+        if os.path.exists(_path):
+            with open(_path, "rb") as _fp:
+                _data = _fp.read()
+            _end = _data.rfind(b"\n") + 1
+            if _end < len(_data):
+                with open(_path, "ab") as _fp:
+                    _fp.truncate(_end)
+            for _line in _data[:_end].splitlines():
+                _v = json.loads(_line)
+                if len(_v) == 1:
+                    _seqid = _v[0]
+                elif _v[0] not in _index:
+                    _index[_v[0]] = (_v[1], _v[2], _v[3])
+        _indexes[serverId] = [_index, _seqid]
+        return _indexes[serverId]
+
+    def update_query_index(self, serverId):
+        """
+        Add the queryids of the rows of log.csv that have not been indexed
+        to the query index. This is called by GetTables.get_tables(), and
+        catches up with the rows stored without the index as well.
+        """
+        if self.has_catalog(serverId):
+            return
+        _query_index = self.__load_query_index(serverId)
+        (_index, _seqid) = _query_index
+        _lines = []
+        _max_seqid = _seqid
+        for _row in self.read_log_csv(serverId, _seqid):
+            _queryid = int(_row[6])
+            _max_seqid = max(_max_seqid, int(_row[0]))
+            if _queryid not in _index:
+                _index[_queryid] = (int(_row[0]), str(_row[3]), int(_row[7]))
+                _lines.append([_queryid, int(_row[0]), str(_row[3]), int(_row[7])])
+        if _max_seqid == _seqid:
+            return
+        _lines.append([_max_seqid])
+        with open(self.get_query_index_path(serverId), "a") as _fp:
+            for _line in _lines:
+                _fp.write(json.dumps(_line, ensure_ascii=False) + "\n")
+        _query_index[1] = _max_seqid
+
+    def get_query(self, serverId, queryid):
+        """
+        Get Query by queryid.
+
+        The first row of queryid is looked up in the catalog or the query
+        index, and its query text is read.
+
+        Returns
+        -------
+        (database, query, planid) : (str, str, int)
+          Return (None, None, None) if not found.
+        """
+
+        """Look up the first row of queryid."""
+        if self.has_catalog(serverId):
+            _row = self.get_catalog(serverId).get_first_row_by_queryid(queryid)
+            if _row is None:
+                return (None, None, None)
+            (_seqid, _database, _planid) = (int(_row[0]), str(_row[3]), int(_row[7]))
+        else:
+            self.update_query_index(serverId)
+            _entry = self.__load_query_index(serverId)[0].get(int(queryid))
+            if _entry is None:
+                return (None, None, None)
+            (_seqid, _database, _planid) = _entry
+
+        """Get query."""
+        if self.is_tables_segmented(serverId):
+            _segment = self.get_tables_segment(serverId, self.TABLES_QUERY_DIR)
+            _query = _segment.get(_seqid)
+        else:
+            _path = self.get_query_dir_path(serverId, int(queryid)) + str(_seqid)
+            if os.path.isfile(_path) == False:
+                return (None, None, None)
+            _query = self.read_text(_path)
+        if _query is None:
+            return (None, None, None)
+        return (_database, _query, _planid)
 
     """
     grouping subdir
@@ -435,6 +803,53 @@ class Repository(Common):
 
     def reset_grouping_dir(self, serverId):
         self.__reset_dir(serverId, self.GROUPING_DIR, self.update_grouping_stat_file)
+        _mdirpath = self.get_grouping_manifest_dir_path(serverId)
+        if os.path.exists(_mdirpath):
+            if Log.debug2 <= self.LogLevel:
+                print("Debug2: rm '{}'".format(_mdirpath))
+            shutil.rmtree(_mdirpath)
+
+    def get_grouping_sample_policy(self, serverId):
+        """
+        Return (cap, decay) of the samples of the grouped plans of serverId,
+        which are set by the following keys in the hosts.conf:
+
+          sample_cap       : the max number of the samples kept per plan
+                             (default: 0, i.e. all samples are kept).
+          sample_policy    : 'reservoir' (default) or 'decay'.
+          sample_half_life : for 'decay', the number of the executions of a
+                             plan after which the weight of a sample is
+                             halved (default: sample_cap).
+
+        decay is the decay rate of the weight per execution, which is 0.0
+        for 'reservoir'.
+        """
+        _config = self.get_hosts_conf()
+        if _config.has_section(serverId) == False:
+            return (0, 0.0)
+        _section = _config[serverId]
+        try:
+            _cap = int(_section.get("sample_cap", "0"))
+            _policy = _section.get("sample_policy", "reservoir").strip().lower()
+            _half_life = float(_section.get("sample_half_life", str(_cap)))
+        except ValueError as err:
+            if Log.error <= self.LogLevel:
+                print(
+                    "Error: invalid sample settings of '{}': {}".format(serverId, err)
+                )
+            sys.exit(1)
+        if _cap < 0 or _policy not in ("reservoir", "decay"):
+            if Log.error <= self.LogLevel:
+                print("Error: sample_cap must be 0 or more.")
+                print("\tsample_policy must be 'reservoir' or 'decay'.")
+            sys.exit(1)
+        if _cap == 0 or _policy == "reservoir":
+            return (_cap, 0.0)
+        if _half_life <= 0:
+            if Log.error <= self.LogLevel:
+                print("Error: sample_half_life must be greater than 0.")
+            sys.exit(1)
+        return (_cap, math.log(2) / _half_life)
 
     def get_grouping_plan_dir_path(self, serverId, planid):
         return self.dirpath([str(serverId), self.GROUPING_DIR, self.hash_dir(planid)])
@@ -449,13 +864,199 @@ class Repository(Common):
         return self.dirpath([serverId, self.GROUPING_DIR])
 
     def get_grouping_dir_list(self, serverId):
-        return os.listdir(self.dirpath([serverId, self.GROUPING_DIR]))
+        """Return the hash subdirs, i.e. 'NNN', in the grouping dir."""
+        return [
+            _d
+            for _d in os.listdir(self.dirpath([serverId, self.GROUPING_DIR]))
+            if re.fullmatch(r"[0-9]{3}", _d)
+        ]
 
     def get_grouping_subdir_path(self, serverId, subdir):
         return self.dirpath([serverId, self.GROUPING_DIR, subdir])
 
     def get_grouping_subdir_list(self, serverId, subdir):
-        return os.listdir(self.dirpath([serverId, self.GROUPING_DIR, subdir]))
+        """Return the grouped plans, i.e. '<queryid>.<planid>', in subdir."""
+        return [
+            _f
+            for _f in os.listdir(self.dirpath([serverId, self.GROUPING_DIR, subdir]))
+            if len(_f.split(".")) == 2
+        ]
+
+    """
+    The manifests of the grouping dir.
+
+    Grouping.grouping() writes the list of the grouped plans that it has
+    touched for the seqid range (from_seqid, to_seqid] to the manifest file
+    'manifest/<from_seqid>-<to_seqid>', so Regression.regression() can visit
+    only the changed plans.
+    """
+
+    def get_grouping_manifest_dir_path(self, serverId):
+        return self.dirpath([serverId, self.GROUPING_DIR, self.GROUPING_MANIFEST_DIR])
+
+    def __get_grouping_manifest_ranges(self, serverId):
+        _mdirpath = self.get_grouping_manifest_dir_path(serverId)
+        if os.path.exists(_mdirpath) == False:
+            return []
+        _ranges = []
+        for _f in os.listdir(_mdirpath):
+            _m = re.fullmatch(r"([0-9]+)-([0-9]+)", _f)
+            if _m:
+                _ranges.append((int(_m.group(1)), int(_m.group(2)), _f))
+        return _ranges
+
+    def write_grouping_manifest(self, serverId, from_seqid, to_seqid, plans):
+        """
+        Write the manifest of the seqid range (from_seqid, to_seqid].
+
+        Parameters
+        ----------
+        plans : iterable of (subdir, filename)
+          The grouped plans touched in the range, e.g. ('001', '1001.5001').
+        """
+        _mdirpath = self.get_grouping_manifest_dir_path(serverId)
+        if os.path.exists(_mdirpath) == False:
+            os.mkdir(_mdirpath, self.DEFAULT_DIR_MODE)
+        _path = self.path(_mdirpath, str(from_seqid) + "-" + str(to_seqid))
+        with open(_path + ".tmp", "w") as _fp:
+            for (_subdir, _f) in sorted(plans):
+                _fp.write(_subdir + "/" + _f + "\n")
+        os.replace(_path + ".tmp", _path)
+
+    def get_grouping_manifest(self, serverId, from_seqid, to_seqid):
+        """
+        Return the list of (subdir, filename) of the grouped plans touched in
+        the seqid range (from_seqid, to_seqid], or None if the manifests do not
+        cover the range, e.g. the range was grouped by a previous version.
+        """
+        _ranges = self.__get_grouping_manifest_ranges(serverId)
+        _mdirpath = self.get_grouping_manifest_dir_path(serverId)
+        _plans = set()
+        _seqid = from_seqid
+        while _seqid < to_seqid:
+            """If the range was grouped twice, the wider manifest is used."""
+            _next = [_r for _r in _ranges if _r[0] == _seqid and _r[1] <= to_seqid]
+            if len(_next) == 0:
+                return None
+            (_from, _to, _f) = max(_next)
+            with open(self.path(_mdirpath, _f)) as _fp:
+                for _line in _fp:
+                    _line = _line.strip()
+                    if _line != "":
+                        _plans.add(tuple(_line.split("/", 1)))
+            _seqid = _to
+        return sorted(_plans)
+
+    def remove_grouping_manifests(self, serverId, seqid):
+        """Remove the manifests whose ranges end at seqid or before."""
+        _mdirpath = self.get_grouping_manifest_dir_path(serverId)
+        for (_from, _to, _f) in self.__get_grouping_manifest_ranges(serverId):
+            if _to <= seqid:
+                os.remove(self.path(_mdirpath, _f))
+
+    def read_grouping_skeleton(self, planpath):
+        """
+        Read the skeleton of the grouped plan from planpath, i.e. the plan
+        whose grouping objects are null. The files of the previous versions
+        are returned as is.
+        """
+        _plan = self.read_plan_json(planpath)
+        _plan.pop(self.GROUPING_STORE_KEY, None)
+        return _plan
+
+    def get_grouping_last_seqid(self, planpath, store):
+        """Return the seqid of the last sample of planpath, or 0 if not found."""
+        _path = planpath + self.GROUPING_RECORD_EXT
+        if os.path.exists(_path) == False:
+            return 0
+        _size = struct.calcsize(store["Format"])
+        with open(_path, "rb") as _fp:
+            _len = _fp.seek(0, os.SEEK_END)
+            _len -= _len % _size
+            if _len == 0:
+                return 0
+            _fp.seek(_len - _size)
+            (_seqid,) = struct.unpack("<q", _fp.read(8))
+        return _seqid
+
+    def read_grouping_stats(self, planpath):
+        """
+        Read the sufficient statistics of the grouped plan from planpath,
+        or Return None if not found. See SufficientStats.
+        """
+        _path = planpath + self.GROUPING_STATS_EXT
+        if os.path.exists(_path) == False:
+            return None
+        return self.read_plan_json(_path)
+
+    def write_grouping_stats(self, stats, planpath):
+        """Write the sufficient statistics of the grouped plan to planpath."""
+        _path = planpath + self.GROUPING_STATS_EXT
+        self.write_text(json.dumps(stats, separators=(",", ":")), _path + ".tmp")
+        os.replace(_path + ".tmp", _path)
+
+    def read_grouping_plan(self, planpath):
+        """
+        Read the grouped plan from planpath.
+
+        The grouped plan is stored as a skeleton, i.e. the plan whose
+        grouping objects are null, and the samples appended to the record
+        file (planpath + GROUPING_RECORD_EXT) and the extra file
+        (planpath + GROUPING_EXTRA_EXT) by Grouping.grouping().
+        This method returns the plan whose grouping objects are the lists
+        of the samples, so it is the same as the json plan that the
+        previous versions stored. The files of the previous versions are
+        returned as is.
+        """
+        _plan = self.read_plan_json(planpath)
+        if self.GROUPING_STORE_KEY not in _plan:
+            return _plan
+        _store = _plan.pop(self.GROUPING_STORE_KEY)
+        _struct = struct.Struct(_store["Format"])
+
+        """Read the fixed-width records; a torn record at the end is ignored."""
+        _data = b""
+        if os.path.exists(planpath + self.GROUPING_RECORD_EXT):
+            with open(planpath + self.GROUPING_RECORD_EXT, "rb") as _fp:
+                _data = _fp.read()
+        _num = len(_data) // _struct.size
+        _columns = list(zip(*_struct.iter_unpack(_data[: _num * _struct.size])))
+
+        """Read the extra values, the last line of each record wins."""
+        _extras = {}
+        _overrides = {}
+        if os.path.exists(planpath + self.GROUPING_EXTRA_EXT):
+            with open(planpath + self.GROUPING_EXTRA_EXT, "r") as _fp:
+                for _line in _fp:
+                    try:
+                        (_no, _extra, _override) = json.loads(_line)
+                    except ValueError:
+                        continue
+                    if _no < _num:
+                        _extras[_no] = _extra
+                        _overrides[_no] = _override
+        _slot_overrides = {}
+        for _no, _override in _overrides.items():
+            for _slot, _value in _override.items():
+                _slot_overrides.setdefault(int(_slot), {})[_no] = _value
+
+        _dicts = self.get_dict_list(_plan)
+        _field = 1  # The first field is seqid.
+        _j = 0
+        for _i, (_no, _key, _kind) in enumerate(_store["Slots"]):
+            if _kind == "j":
+                _values = [
+                    _extras[_r][_j] if _r in _extras else None for _r in range(_num)
+                ]
+                _j += 1
+            else:
+                _values = list(_columns[_field]) if _num > 0 else []
+                _field += 1
+                if _i in _slot_overrides:
+                    for _r, _value in _slot_overrides[_i].items():
+                        _values[_r] = _value
+            _dicts[_no][_key] = _values
+        return _plan
 
     """
     regression subdir
@@ -502,6 +1103,61 @@ class Repository(Common):
         for _file_name in os.listdir(_dir):
             os.remove(str(_dir) + "/" + str(_file_name))
 
+    def get_push_stat_file_path(self, serverId):
+        """
+        Return the path of the push watermarks. It is placed next to the
+        stat file of the regression subdir, because the formatted regression
+        parameter subdir is emptied by push --full.
+        """
+        return self.path(
+            self.dirpath([serverId, self.REGRESSION_DIR]), self.PUSH_STAT_FILE
+        )
+
+    def __get_old_push_stat_file_path(self, serverId):
+        """Return the path where the push watermarks were placed before."""
+        return self.path(
+            self.get_formatted_regression_params_subdir_path(serverId),
+            self.PUSH_STAT_FILE,
+        )
+
+    def __read_push_stat_file(self, serverId):
+        """
+        Read the push watermarks. If they have not been moved yet, read
+        them from the formatted regression parameter subdir.
+        """
+        stat = configparser.ConfigParser()
+        for _path in (
+            self.get_push_stat_file_path(serverId),
+            self.__get_old_push_stat_file_path(serverId),
+        ):
+            if os.path.exists(_path):
+                stat.read(_path)
+                break
+        return stat
+
+    def get_seqid_from_push_stat(self, serverId, database):
+        """
+        Return the push watermark of database, i.e. the seqid of the
+        regression stage when the params were pushed to database last time;
+        return 0 if they have never been pushed.
+        """
+        stat = self.__read_push_stat_file(serverId)
+        if stat.has_section(database):
+            return int(stat[database]["seqid"])
+        return 0
+
+    def update_push_stat_file(self, serverId, database, seqid):
+        _path = self.get_push_stat_file_path(serverId)
+        stat = self.__read_push_stat_file(serverId)
+        stat[database] = {"seqid": seqid}
+        with open(_path + ".tmp", "w") as configfile:
+            stat.write(configfile)
+        os.replace(_path + ".tmp", _path)
+
+        _old_path = self.__get_old_push_stat_file_path(serverId)
+        if os.path.exists(_old_path):
+            os.remove(_old_path)
+
     def write_formatted_regression_params(self, serverId, queryid, param):
         _dir = self.get_formatted_regression_params_subdir_path(serverId)
         with open(str(_dir) + "/" + str(queryid), mode="w") as _fp:
@@ -77,21 +77,11 @@ class Rules(Common):
                     if p["Parent Relationship"] == "Outer":
                         plan["Plan Rows"] = p["Plan Rows"]
 
-    # Apply the rules recursively
+    # Apply the rules to each node from the top node to the bottom node
     def __op(self, Plans):
-        if isinstance(Plans, list):
-            for plan in Plans:
-                for r in self.rules:
-                    r(plan)
-                if "Plans" in plan:
-                    self.__op(plan["Plans"])
-            return
-        else:
+        for plan in self.get_node_list(Plans):
             for r in self.rules:
-                r(Plans)
-            if "Plans" in Plans:
-                self.__op(Plans["Plans"])
-            return
+                r(plan)
 
     """
     Public method
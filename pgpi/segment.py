@@ -0,0 +1,296 @@
+"""
+segment.py
+
+This file defines an append-only store of texts keyed by seqid, which is
+used by the segment-file layout of the tables dir.
+
+
+  Formatted by black (https://pypi.org/project/black/)
+
+  Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+
+from .common import Common
+
+
+class Segment:
+    """
+    Store texts into append-only segment files with an offset index.
+
+    The texts named `name` are stored in the following files in dirpath:
+
+      <name>.idx  : index records (seqid, segment number, offset, length),
+                    each of which is appended after its text is written.
+                    The records are sorted by seqid, so a seqid is looked
+                    up by bisecting the mapped file.
+      <name>.dig  : digest records (sha1 digest, segment number, offset,
+                    length) of the distinct texts, if dedup is True.
+      <name>.NNNN : segment files that contain the texts encoded in utf-8,
+                    each of which is compressed if codec is zlib or zstd.
+                    A new segment file is started when the current one
+                    exceeds SEGMENT_SIZE bytes.
+
+    The codec of each text is detected on read as Common.read_text() does,
+    so the texts written by different codecs can be mixed in a segment file.
+
+    If a seqid which is not greater than the last stored one is appended,
+    e.g. the rows are got again after a crash, the index records from that
+    seqid on are dropped first, so the last stored text of a seqid is used.
+
+    If dedup is True, the texts are content-addressed: a text which has been
+    stored already is not written again, and the index record of its seqid
+    points to the stored one. The digests are appended to the digest file,
+    so they are loaded without reading the stored texts. The digest is taken
+    from the text before compression, so a text is not stored again after
+    the codec is changed.
+    """
+
+    INDEX_FORMAT = "<qqqq"
+    INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+    DIGEST_FORMAT = "<20sqqq"
+    DIGEST_SIZE = struct.calcsize(DIGEST_FORMAT)
+    SEGMENT_SIZE = 1 << 28
+
+    def __init__(self, dirpath, name, dedup=False, codec=Common.DEFAULT_PLAN_CODEC):
+        self.dirpath = dirpath
+        self.name = name
+        self.dedup = dedup
+        self.codec = codec
+        self.__common = Common()
+        self.__index = None
+        self.__digests = None
+        self.__segno = 0
+        self.__last_seqid = None
+        self.__idxfp = None
+        self.__datafp = None
+        self.__digfp = None
+        self.__readers = {}
+
+    def __index_path(self):
+        return os.path.join(self.dirpath, self.name + ".idx")
+
+    def __digest_path(self):
+        return os.path.join(self.dirpath, self.name + ".dig")
+
+    def __segment_path(self, segno):
+        return os.path.join(self.dirpath, "{}.{:04d}".format(self.name, segno))
+
+    def __last_segno(self):
+        """Return the number of the last segment file, from the file names."""
+        _prefix = self.name + "."
+        _segnos = [
+            int(_f[len(_prefix) :])
+            for _f in os.listdir(self.dirpath)
+            if _f.startswith(_prefix) and _f[len(_prefix) :].isdigit()
+        ]
+        return max(_segnos, default=0)
+
+    def __load_index(self):
+        """
+        Return the index records mapped into memory, without the torn record
+        at the end, if any. The file is mapped again if its size has been
+        changed, e.g. by the writer of another Segment object.
+        """
+        if self.__idxfp is not None:
+            self.__idxfp.flush()
+        _path = self.__index_path()
+        _size = os.path.getsize(_path) if os.path.exists(_path) else 0
+        _size -= _size % self.INDEX_SIZE
+        if self.__index is None or len(self.__index) != _size:
+            self.__unmap_index()
+            if _size == 0:
+                self.__index = b""
+            else:
+                with open(_path, "rb") as _fp:
+                    self.__index = mmap.mmap(
+                        _fp.fileno(), _size, access=mmap.ACCESS_READ
+                    )
+        return self.__index
+
+    def __unmap_index(self):
+        if self.__index:
+            self.__index.close()
+        self.__index = None
+
+    def __bisect(self, index, seqid):
+        """Return the position of the first record whose seqid >= seqid."""
+        (_lo, _hi) = (0, len(index) // self.INDEX_SIZE)
+        while _lo < _hi:
+            _mid = (_lo + _hi) // 2
+            if struct.unpack_from("<q", index, _mid * self.INDEX_SIZE)[0] < seqid:
+                _lo = _mid + 1
+            else:
+                _hi = _mid
+        return _lo
+
+    def __lookup(self, seqid):
+        """Return the entry (segno, offset, length) of seqid, or None."""
+        _index = self.__load_index()
+        _pos = self.__bisect(_index, seqid) * self.INDEX_SIZE
+        if len(_index) <= _pos:
+            return None
+        (_seqid, _segno, _offset, _length) = struct.unpack_from(
+            self.INDEX_FORMAT, _index, _pos
+        )
+        return (_segno, _offset, _length) if _seqid == seqid else None
+
+    def __open_writer(self):
+        """
+        Open the files to append. Only the last segment number and the last
+        index record are read, since the texts are appended to the end.
+        """
+        self.__segno = self.__last_segno()
+        self.__idxfp = open(self.__index_path(), "ab")
+        _size = self.__idxfp.tell()
+        if _size % self.INDEX_SIZE != 0:
+            _size -= _size % self.INDEX_SIZE
+            self.__idxfp.truncate(_size)
+            self.__idxfp.seek(0, os.SEEK_END)
+        if 0 < _size:
+            with open(self.__index_path(), "rb") as _fp:
+                _fp.seek(_size - self.INDEX_SIZE)
+                self.__last_seqid = struct.unpack(
+                    self.INDEX_FORMAT, _fp.read(self.INDEX_SIZE)
+                )[0]
+        self.__datafp = open(self.__segment_path(self.__segno), "ab")
+        if self.dedup:
+            self.__load_digests()
+
+    def __get_reader(self, segno):
+        if self.__datafp is not None and segno == self.__segno:
+            self.__datafp.flush()
+        if segno not in self.__readers:
+            self.__readers[segno] = open(self.__segment_path(segno), "rb")
+        return self.__readers[segno]
+
+    def __read(self, entry):
+        """Return the text at entry (segno, offset, length), or None if torn."""
+        (_segno, _offset, _length) = entry
+        _fp = self.__get_reader(_segno)
+        _fp.seek(_offset)
+        _data = _fp.read(_length)
+        if len(_data) != _length:
+            return None
+        return self.__common.decode_text(_data, self.__segment_path(_segno))
+
+    def __load_digests(self):
+        """
+        Map the digests of the stored texts to their locations by reading
+        the digest file, and open it to append. If there is no digest file,
+        e.g. the texts have been stored by an older version, it is made from
+        the stored texts once.
+        """
+        _path = self.__digest_path()
+        _exists = os.path.exists(_path)
+        self.__digfp = open(_path, "ab")
+        _size = self.__digfp.tell()
+        if _size % self.DIGEST_SIZE != 0:
+            _size -= _size % self.DIGEST_SIZE
+            self.__digfp.truncate(_size)
+            self.__digfp.seek(0, os.SEEK_END)
+        if self.__digests is not None:
+            return
+
+        self.__digests = {}
+        if _exists:
+            with open(_path, "rb") as _fp:
+                _data = _fp.read(_size)
+            _sizes = {}
+            for (_digest, _segno, _offset, _length) in struct.iter_unpack(
+                self.DIGEST_FORMAT, _data
+            ):
+                if _segno not in _sizes:
+                    _segpath = self.__segment_path(_segno)
+                    _sizes[_segno] = (
+                        os.path.getsize(_segpath) if os.path.exists(_segpath) else 0
+                    )
+                """Skip the texts that have not been written, e.g. by a crash."""
+                if _offset + _length <= _sizes[_segno]:
+                    self.__digests[_digest] = (_segno, _offset, _length)
+        else:
+            _entries = dict.fromkeys(
+                tuple(_record[1:])
+                for _record in struct.iter_unpack(
+                    self.INDEX_FORMAT, self.__load_index()
+                )
+            )
+            for _entry in _entries:
+                _text = self.__read(_entry)
+                if _text is not None:
+                    _digest = hashlib.sha1(_text.encode("utf-8")).digest()
+                    self.__add_digest(_digest, _entry)
+
+    def __add_digest(self, digest, entry):
+        self.__digests[digest] = entry
+        self.__digfp.write(struct.pack(self.DIGEST_FORMAT, digest, *entry))
+
+    """
+    Public methods
+    """
+
+    def append(self, seqid, text):
+        """Append text of seqid."""
+        if self.__datafp is None:
+            self.__open_writer()
+        if self.__last_seqid is not None and seqid <= self.__last_seqid:
+            """Drop the index records from seqid on to keep them sorted."""
+            self.__idxfp.truncate(
+                self.__bisect(self.__load_index(), seqid) * self.INDEX_SIZE
+            )
+            self.__idxfp.seek(0, os.SEEK_END)
+            self.__unmap_index()
+        if self.SEGMENT_SIZE <= self.__datafp.tell():
+            self.__datafp.close()
+            self.__segno += 1
+            self.__datafp = open(self.__segment_path(self.__segno), "ab")
+
+        _entry = None
+        if self.dedup:
+            _digest = hashlib.sha1(text.encode("utf-8")).digest()
+            _entry = self.__digests.get(_digest)
+        if _entry is None:
+            _data = self.__common.encode_text(text, self.codec)
+            _entry = (self.__segno, self.__datafp.tell(), len(_data))
+            self.__datafp.write(_data)
+            if self.dedup:
+                self.__add_digest(_digest, _entry)
+        self.__idxfp.write(struct.pack(self.INDEX_FORMAT, seqid, *_entry))
+        self.__last_seqid = seqid
+
+    def get(self, seqid):
+        """Return the text of seqid, or None if not found."""
+        _entry = self.__lookup(seqid)
+        if _entry is None:
+            return None
+        return self.__read(_entry)
+
+    def seqids(self):
+        """Return the sorted list of the stored seqids."""
+        return [
+            _record[0]
+            for _record in struct.iter_unpack(self.INDEX_FORMAT, self.__load_index())
+        ]
+
+    def __contains__(self, seqid):
+        return self.__lookup(seqid) is not None
+
+    def close(self):
+        """Close the files. The texts are flushed before their index records."""
+        if self.__datafp is not None:
+            self.__datafp.close()
+            if self.__digfp is not None:
+                self.__digfp.close()
+                self.__digfp = None
+            self.__idxfp.close()
+            self.__datafp = None
+            self.__idxfp = None
+            self.__last_seqid = None
+        for _fp in self.__readers.values():
+            _fp.close()
+        self.__readers = {}
+        self.__unmap_index()
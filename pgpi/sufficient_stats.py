@@ -0,0 +1,157 @@
+"""
+sufficient_stats.py
+
+This file defines the running sufficient statistics of the regression
+parameters of grouped plans.
+
+
+  Formatted by black (https://pypi.org/project/black/)
+
+  Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
+"""
+
+from array import array
+
+
+class SufficientStats:
+    """
+    Keep the statistics that the regression of each node needs, so that the
+    regression parameters can be updated with new samples only.
+
+    The statistics of a plan are the following dict:
+
+      Seqid         : seqid of the last sample added.
+      SortSpaceUsed : max "Sort Space Used" of the samples whose
+                      "Sort Space Type" is "Disk" (0 if not found).
+      Nodes         : the statistics of the nodes in the same order as
+                      Common.get_node_list().
+
+    The statistics of a node depend on its node type:
+
+      nested loop type    : N, SumXY = sum(Xinner * Xouter * Y),
+                            SumXX = sum(Xinner^2 * Xouter^2)
+      merge or hash join  : N, Mean = means of [Xouter, Xinner, Y],
+                            M2 = centered sums of products of them,
+                            i.e. [oo, oi, oy, ii, iy, yy]
+      scan type (others)  : N, SumX = sum(Plan Rows), SumY = sum(Actual Rows)
+
+    The sums are added in the order of the samples, so the regression
+    parameters of the nested loop and scan types are the same as the ones
+    calculated from all samples. M2 is updated by Welford's method.
+
+    A nested loop type or join node which has less than two children, e.g.
+    an Append whose subplans are removed by runtime pruning, has no inputs,
+    so its statistics are not updated, i.e. N stays 0.
+    """
+
+    NESTED_LOOP_TYPES = (
+        "Append",
+        "Merge Append",
+        "Recursive Union",
+        "Nested Loop",
+        "BitmapAnd",
+        "BitmapOr",
+    )
+
+    JOIN_TYPES = ("Merge Join", "Hash Join")
+
+    def __values(self, plan, key):
+        """Return the values of key as a list; a single sample is a scalar."""
+        _value = plan[key]
+        if isinstance(_value, (list, array)):
+            return _value
+        return [_value]
+
+    def __get_inputs(self, plan):
+        """Get outer and inner actual rows, as Common.get_inputs() does."""
+        _X = [[], []]
+        for i in range(0, 2):  # Ignore SubPlans
+            p = plan["Plans"][i]
+            k = 0 if p["Parent Relationship"] == "Outer" else 1
+            _X[k] += self.__values(p, "Actual Rows")
+        return (_X[0], _X[1])
+
+    def __new_node_statistics(self, plan):
+        _node_type = plan["Node Type"]
+        if _node_type in self.NESTED_LOOP_TYPES:
+            return {"N": 0, "SumXY": 0, "SumXX": 0}
+        elif _node_type in self.JOIN_TYPES:
+            return {"N": 0, "Mean": [0.0, 0.0, 0.0], "M2": [0.0] * 6}
+        return {"N": 0, "SumX": 0, "SumY": 0}
+
+    def __update_node_statistics(self, stat, plan):
+        _node_type = plan["Node Type"]
+        if _node_type in self.NESTED_LOOP_TYPES or _node_type in self.JOIN_TYPES:
+            if len(plan.get("Plans", ())) < 2:
+                return
+        _Y = self.__values(plan, "Actual Rows")
+
+        if _node_type in self.NESTED_LOOP_TYPES:
+            (_Xouter, _Xinner) = self.__get_inputs(plan)
+            for _i, _o, _y in zip(_Xinner, _Xouter, _Y):
+                stat["SumXY"] += _i * _o * _y
+                stat["SumXX"] += _i ** 2 * _o ** 2
+            stat["N"] += len(_Y)
+
+        elif _node_type in self.JOIN_TYPES:
+            (_Xouter, _Xinner) = self.__get_inputs(plan)
+            _mean = stat["Mean"]
+            _m2 = stat["M2"]
+            for _z in zip(_Xouter, _Xinner, _Y):
+                stat["N"] += 1
+                _d = [_z[0] - _mean[0], _z[1] - _mean[1], _z[2] - _mean[2]]
+                for _j in range(0, 3):
+                    _mean[_j] += _d[_j] / stat["N"]
+                _e = [_z[0] - _mean[0], _z[1] - _mean[1], _z[2] - _mean[2]]
+                _m2[0] += _d[0] * _e[0]
+                _m2[1] += _d[0] * _e[1]
+                _m2[2] += _d[0] * _e[2]
+                _m2[3] += _d[1] * _e[1]
+                _m2[4] += _d[1] * _e[2]
+                _m2[5] += _d[2] * _e[2]
+
+        else:
+            for _x in self.__values(plan, "Plan Rows"):
+                stat["SumX"] += _x
+            for _y in _Y:
+                stat["SumY"] += _y
+            stat["N"] += len(_Y)
+
+    """
+    Public methods
+    """
+
+    def new_statistics(self, Plans):
+        """Create the empty statistics of the plan Plans."""
+        return {
+            "Seqid": 0,
+            "SortSpaceUsed": 0,
+            "Nodes": [self.__new_node_statistics(p) for p in self.get_node_list(Plans)],
+        }
+
+    def update_statistics(self, stats, Plans, seqid=0):
+        """
+        Add the samples of Plans to stats.
+
+        Parameters
+        ----------
+        stats : dict
+          The statistics created by new_statistics().
+        Plans : dict
+          A plan of a sample, or a grouped plan whose values are the lists
+          of the samples.
+        seqid : int
+          seqid of the last sample of Plans.
+        """
+        _nodes = self.get_node_list(Plans)
+        for _i, _plan in enumerate(_nodes):
+            self.__update_node_statistics(stats["Nodes"][_i], _plan)
+            if "Sort Space Type" in _plan:
+                _type = self.__values(_plan, "Sort Space Type")
+                _used = self.__values(_plan, "Sort Space Used")
+                for i in range(len(_type)):
+                    if _type[i] == "Disk":
+                        if stats["SortSpaceUsed"] < _used[i]:
+                            stats["SortSpaceUsed"] = _used[i]
+        stats["Seqid"] = max(stats["Seqid"], seqid)
+        return stats
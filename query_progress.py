@@ -7,6 +7,7 @@ This script shows the actual state and progress of the running query.
 Usage:
  query_progress.py [--host XXX] [--port NNN] [--dbname XXX] [--username XXX] [--password] [--verbose] [--pid NNN]
  query_progress.py [--basedir XXX] [--verbose] [--pid NNN] --serverid XXX
+ query_progress.py [connection options] --all [--interval SEC] [--limit NNN] [--min-duration SEC]
 
 
   Formatted by black (https://pypi.org/project/black/)
@@ -22,6 +23,7 @@ import os
 import hashlib
 import re
 import math
+import time
 
 from pgpi import Database, Repository, QueryProgress, Log
 
@@ -40,6 +42,130 @@ if __name__ == "__main__":
         else:
             os.system("clear")
 
+    def make_plan_list(rows):
+        """
+        Make the plan_list of QueryProgress.query_progress() from the rows
+        of pg_query_plan(), and Return it with the query of the last row.
+        """
+        _X = []
+        _query = ""
+        for row in rows:
+            _worker_type = row[2]
+            _queryid = int(row[4])
+            _query = row[5]
+            _planid = int(row[6])
+            _plan_json = row[8]
+
+            if Log.debug1 <= LOG_LEVEL:
+                print("Debug1: queryid={}  planid={}".format(_queryid, _planid))
+            _X.append(
+                [
+                    _worker_type,
+                    _queryid,
+                    _planid,
+                    _plan_json,
+                    int(
+                        hashlib.md5(str(_query).encode()).hexdigest(), 16
+                    ),  # For version 13.
+                ]
+            )
+        return (_X, _query)
+
+    def get_all_progress(connection, qp, server_id, limit, min_duration):
+        """
+        Estimate the progress of the queries of the active client backends
+        which have been running for min_duration seconds or more. At most
+        limit backends, from the longest running one, are processed, so the
+        cost of a refresh is bounded however many queries are running.
+
+        Return the number of such backends and the list of [pid, database,
+        elapsed, progress, remaining, query] sorted by the estimated
+        remaining seconds in descending order; progress and remaining are
+        None if they cannot be estimated.
+        """
+        sql = "SELECT pid, datname, EXTRACT(EPOCH FROM now() - query_start), query,"
+        sql += " count(*) OVER ()"
+        sql += " FROM pg_stat_activity"
+        sql += " WHERE state = 'active' AND backend_type = 'client backend'"
+        sql += "   AND pid <> pg_backend_pid()"
+        sql += "   AND now() - query_start >= make_interval(secs => %s)"
+        sql += " ORDER BY query_start LIMIT %s"
+        cur = connection.cursor()
+        cur.execute(sql, (float(min_duration), int(limit)))
+        _backends = cur.fetchall()
+        cur.close()
+
+        _num_backends = _backends[0][4] if _backends else 0
+        _results = []
+        for (_pid, _database, _elapsed, _query, _count) in _backends:
+            _elapsed = float(_elapsed)
+            _progress = None
+            if re.match(explain_stmt, str.lower(str(_query))) is None:
+                sql = "SELECT pid, database, worker_type, nested_level, queryid, query, planid, plan, plan_json"
+                sql += " FROM pg_query_plan(%s) ORDER BY nested_level"
+                cur = connection.cursor()
+                try:
+                    cur.execute(sql, (_pid,))
+                    (_X, _q) = make_plan_list(cur)
+                except Exception as err:
+                    """The query has finished, for example."""
+                    _X = []
+                cur.close()
+                if _X:
+                    """Use the progress of the top-level query of the backend."""
+                    try:
+                        for _p in qp.query_progress(_X, server_id):
+                            if _p[0] == _X[0][1] or _progress is None:
+                                _progress = _p[1]
+                    except Exception as err:
+                        if Log.warning <= LOG_LEVEL:
+                            print("Warning: pid={}: {}".format(_pid, err))
+            _remaining = None
+            if _progress is not None and 0 < _progress:
+                _remaining = _elapsed * (1 - _progress) / _progress
+            _results.append([_pid, _database, _elapsed, _progress, _remaining, _query])
+
+        """The queries whose remaining work is unknown are listed first."""
+        _results.sort(
+            key=lambda r: (r[4] is not None, -(r[4] or 0), -r[2]),
+        )
+        return (_num_backends, _results)
+
+    def show_all_progress(qp, num_backends, results, limit, verbose):
+        _msg = "{}  {} active queries".format(
+            time.strftime("%Y-%m-%d %H:%M:%S"), num_backends
+        )
+        if limit < num_backends:
+            _msg += " (the longest {} are shown)".format(limit)
+        print(_msg)
+        print(
+            "{:>8} {:<16} {:>10} {:>8}  {:<26} {:>10}  {}".format(
+                "pid", "database", "elapsed", "progress", "", "remaining", "query"
+            )
+        )
+        for (_pid, _database, _elapsed, _progress, _remaining, _query) in results:
+            if _progress is None:
+                _percent = "-"
+                _pb = ""
+            else:
+                _p = math.floor(_progress * 100 * 10 ** 2) / (10 ** 2)
+                _percent = "{:.2f}%".format(_p)
+                _pb = qp.make_progress_bar(_p, small=True)
+            _query = " ".join(str(_query).split())
+            if verbose == False and 60 < len(_query):
+                _query = _query[:57] + "..."
+            print(
+                "{:>8} {:<16} {:>9.1f}s {:>8}  {:<26} {:>10}  {}".format(
+                    _pid,
+                    str(_database)[:16],
+                    _elapsed,
+                    _percent,
+                    _pb,
+                    "-" if _remaining is None else "{:.1f}s".format(_remaining),
+                    _query,
+                )
+            )
+
     LOG_LEVEL = Log.info
     explain_stmt = re.compile(r"^explain")
 
@@ -84,6 +210,29 @@ if __name__ == "__main__":
         default="0",
     )
     parser.add_argument("--verbose", action="store_true", help="Show all")
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Show the progress of all active queries, refreshing it until Ctrl-C",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        help="Seconds between refreshes with --all (default: 5)",
+        default=5.0,
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        help="Max number of queries processed per refresh with --all (default: 20)",
+        default=20,
+    )
+    parser.add_argument(
+        "--min-duration",
+        type=float,
+        help="Show only the queries running for this many seconds or more with --all (default: 1)",
+        default=1.0,
+    )
     parser._add_action(
         argparse._HelpAction(
             option_strings=["--help", "-H"], help="Show this help message and exit"
@@ -128,6 +277,26 @@ if __name__ == "__main__":
 
     connection.autocommit = True
 
+    """
+    Batch mode.
+    """
+    if args.all == True:
+        """The messages of each query are suppressed in this mode."""
+        qp = QueryProgress(base_dir, min(LOG_LEVEL, Log.notice))
+        try:
+            while True:
+                (_num_backends, _results) = get_all_progress(
+                    connection, qp, server_id, args.limit, args.min_duration
+                )
+                clear_console()
+                show_all_progress(qp, _num_backends, _results, args.limit, args.verbose)
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            print("\n")
+        connection.close()
+        del qp
+        sys.exit(0)
+
     clear_console()
 
     """
@@ -197,27 +366,7 @@ if __name__ == "__main__":
             continue
 
         # Prepare data to calcurate the progress of the queries.
-        _X = []
-        for row in cur:
-            _worker_type = row[2]
-            _queryid = int(row[4])
-            _query = row[5]
-            _planid = int(row[6])
-            _plan_json = row[8]
-
-            if Log.debug1 <= LOG_LEVEL:
-                print("Debug1: queryid={}  planid={}".format(_queryid, _planid))
-            _X.append(
-                [
-                    _worker_type,
-                    _queryid,
-                    _planid,
-                    _plan_json,
-                    int(
-                        hashlib.md5(str(_query).encode()).hexdigest(), 16
-                    ),  # For version 13.
-                ]
-            )
+        (_X, _query) = make_plan_list(cur)
 
         # Show the progress of the queries if the queries are NOT EXPLAIN.
         if re.match(explain_stmt, str.lower(_query)) is None:
@@ -5,14 +5,16 @@ This is a repository management tool for the plan_analyzer module.
 
 Usage:
  repo_mgr.py create [--basedir XXX]
- repo_mgr.py get    [--basedir XXX] serverid
- repo_mgr.py push   [--basedir XXX] serverid
+ repo_mgr.py get    [--basedir XXX] [--jobs N] [--workers N] {--all | serverid [serverid ...]}
+ repo_mgr.py follow [--basedir XXX] [--jobs N] [--interval SEC] serverid
+ repo_mgr.py push   [--basedir XXX] [--full] [--upsert] [--jobs N] serverid
  repo_mgr.py show   [--basedir XXX] [--verbose]
  repo_mgr.py check  [--basedir XXX]
  repo_mgr.py rename [--basedir XXX] old_serverid new_serverid
  repo_mgr.py delete [--basedir XXX] serverid
  repo_mgr.py reset  [--basedir XXX] serverid
- repo_mgr.py recalc [--basedir XXX] serverid
+ repo_mgr.py recalc [--basedir XXX] [--jobs N] serverid
+ repo_mgr.py migrate [--basedir XXX] --to {segment,sqlite} serverid
 
   Formatted by black (https://pypi.org/project/black/)
 
@@ -21,7 +23,16 @@ Usage:
 
 import argparse
 import sys
-from pgpi import Common, Repository, GetTables, Grouping, Regression, Log, PushParam
+from pgpi import (
+    Common,
+    Repository,
+    GetTables,
+    Grouping,
+    Regression,
+    Log,
+    PushParam,
+    Ingest,
+)
 
 if __name__ == "__main__":
 
@@ -30,6 +41,7 @@ if __name__ == "__main__":
 
     msg_basedir = "Base directory of repository (Default: '.')"
     msg_serverid = "Server identifier"
+    msg_jobs = "Number of processes for grouping and regression (Default: 1)"
 
     # Functions
     def repository_create(args):
@@ -41,25 +53,50 @@ if __name__ == "__main__":
 
     def get_data(args):
         base_dir = args.basedir
-        serverId = args.serverid
+        if args.all == (len(args.serverid) > 0):
+            parser_get.error("specify either --all or serverid")
         print("Use {}:".format(base_dir + "/" + REPOSITORY))
+        if args.all == True or len(args.serverid) > 1:
+            ig = Ingest(base_dir, log_level=LOG_LEVEL)
+            _summary = ig.ingest(
+                None if args.all == True else args.serverid,
+                workers=args.workers,
+                jobs=args.jobs,
+            )
+            del ig
+            if any("error" in _result for _result in _summary.values()):
+                sys.exit(1)
+            return
+        serverId = args.serverid[0]
         gt = GetTables(base_dir, log_level=LOG_LEVEL)
         _num_rows = gt.get_tables(serverId)
         if _num_rows > 0:
             gp = Grouping(base_dir, log_level=LOG_LEVEL)
-            gp.grouping(serverId)
+            gp.grouping(serverId, jobs=args.jobs)
             rg = Regression(base_dir, log_level=LOG_LEVEL)
-            rg.regression(serverId)
+            rg.regression(serverId, jobs=args.jobs)
             del gp, rg
         del gt
 
+    def follow_data(args):
+        base_dir = args.basedir
+        serverId = args.serverid
+        print("Use {}:".format(base_dir + "/" + REPOSITORY))
+        ig = Ingest(base_dir, log_level=LOG_LEVEL)
+        ig.follow(serverId, interval=args.interval, jobs=args.jobs)
+        del ig
+
     def push_data(args):
         base_dir = args.basedir
         serverId = args.serverid
         print("Use {}:".format(base_dir + "/" + REPOSITORY))
         pp = PushParam(base_dir, log_level=LOG_LEVEL)
-        pp.push_param(serverId)
+        _summary = pp.push_param(
+            serverId, full=args.full, upsert=args.upsert, jobs=args.jobs
+        )
         del pp
+        if any(isinstance(_result, BaseException) for _result in _summary.values()):
+            sys.exit(1)
 
     def check_data(args):
         base_dir = args.basedir
@@ -140,11 +177,24 @@ if __name__ == "__main__":
         serverId = args.serverid
         print("Use {}:".format(base_dir + "/" + REPOSITORY))
         gp = Grouping(base_dir, log_level=LOG_LEVEL)
-        gp.grouping(serverId)
+        gp.grouping(serverId, jobs=args.jobs)
         rg = Regression(base_dir, log_level=LOG_LEVEL)
-        rg.regression(serverId)
+        rg.regression(serverId, jobs=args.jobs)
         del gp, rg
 
+    def migrate_data(args):
+        base_dir = args.basedir
+        serverId = args.serverid
+        print("Use {}:".format(base_dir + "/" + REPOSITORY))
+        if args.to == "sqlite":
+            rp = Repository(base_dir, log_level=LOG_LEVEL)
+            rp.migrate_catalog(serverId)
+            del rp
+        else:
+            gt = GetTables(base_dir, log_level=LOG_LEVEL)
+            gt.migrate_tables(serverId)
+            del gt
+
     # Create command parser.
     parser = argparse.ArgumentParser(
         description="This is a repository management tool for the plan_analyze module."
@@ -162,15 +212,53 @@ if __name__ == "__main__":
         help="Get the rows from the query_plan.log table of the specified server",
     )
     parser_get.add_argument("--basedir", nargs="?", default=".", help=msg_basedir)
-    parser_get.add_argument("serverid", help=msg_serverid)
+    parser_get.add_argument("--jobs", type=int, default=1, help=msg_jobs)
+    parser_get.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of servers got concurrently (Default: 1)",
+    )
+    parser_get.add_argument(
+        "--all", action="store_true", help="Get from all servers in the hosts.conf"
+    )
+    parser_get.add_argument("serverid", nargs="*", help=msg_serverid)
     parser_get.set_defaults(handler=get_data)
 
+    # follow command.
+    parser_follow = subparsers.add_parser(
+        "follow",
+        help="Get the rows from the specified server continuously until interrupted",
+    )
+    parser_follow.add_argument("--basedir", nargs="?", default=".", help=msg_basedir)
+    parser_follow.add_argument("--jobs", type=int, default=1, help=msg_jobs)
+    parser_follow.add_argument(
+        "--interval",
+        type=float,
+        default=Ingest.FOLLOW_INTERVAL,
+        help="Seconds between polls (Default: {})".format(Ingest.FOLLOW_INTERVAL),
+    )
+    parser_follow.add_argument("serverid", help=msg_serverid)
+    parser_follow.set_defaults(handler=follow_data)
+
     # push command.
     parser_push = subparsers.add_parser(
         "push",
         help="Push the regression params to the specified server",
     )
     parser_push.add_argument("--basedir", nargs="?", default=".", help=msg_basedir)
+    parser_push.add_argument(
+        "--full", action="store_true", help="Push all the regression params"
+    )
+    parser_push.add_argument(
+        "--upsert", action="store_true", help="Never truncate the reg table"
+    )
+    parser_push.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of databases pushed concurrently (Default: 1)",
+    )
     parser_push.add_argument("serverid", help=msg_serverid)
     parser_push.set_defaults(handler=push_data)
 
@@ -222,9 +310,25 @@ if __name__ == "__main__":
         help="Recalculate the grouping and regression data of the specified server-id in the repository",
     )
     parser_recalc.add_argument("--basedir", nargs="?", default=".", help=msg_basedir)
+    parser_recalc.add_argument("--jobs", type=int, default=1, help=msg_jobs)
     parser_recalc.add_argument("serverid", help=msg_serverid)
     parser_recalc.set_defaults(handler=recalc_data)
 
+    # migrate command.
+    parser_migrate = subparsers.add_parser(
+        "migrate",
+        help="Convert the tables data of the specified server-id to another layout",
+    )
+    parser_migrate.add_argument("--basedir", nargs="?", default=".", help=msg_basedir)
+    parser_migrate.add_argument(
+        "--to",
+        required=True,
+        choices=["segment", "sqlite"],
+        help="Layout to convert to ('segment': append-only segment files, 'sqlite': SQLite catalog instead of log.csv and stat.dat)",
+    )
+    parser_migrate.add_argument("serverid", help=msg_serverid)
+    parser_migrate.set_defaults(handler=migrate_data)
+
     # Main procedure.
     args = parser.parse_args()
     if hasattr(args, "handler"):
@@ -392,7 +392,7 @@ class Analyze(Repository, ExtendedStatistics, NN, Histogram):
                     _queryid = _qp_id[0]
                     _planid = _qp_id[1]
 
-                    _json_dict = self.read_plan_json(_gpath)
+                    _json_dict = self.read_grouping_plan(_gpath)
 
                     # Calculate regression parameters in each plan and Store into _reg_param.
                     self.__init_level()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+A micro-benchmark script for the plan tree traversals of the pgpi module.
+
+Usage:
+   bench_plan.py walk  [--nodes NNN [NNN ...]] [--repeat NNN]
+   bench_plan.py merge [--nodes NNN [NNN ...]] [--workers NNN [NNN ...]] [--repeat NNN]
+
+
+  Formatted by black (https://pypi.org/project/black/)
+
+  Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
+"""
+
+import argparse
+import copy
+import json
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from pgpi import *
+
+if __name__ == "__main__":
+
+    # Functions
+    def make_plan(num_nodes):
+        """
+        Make a synthetic left-deep plan which has about num_nodes nodes.
+
+        Nested Loop
+          ->  Outer: Nested Loop
+                ->  Outer: ...
+                ->  Inner: Index Scan
+          ->  Inner: Index Scan
+        """
+
+        def scan(no, relationship):
+            return {
+                "Node Type": "Seq Scan" if no == 0 else "Index Scan",
+                "Parent Relationship": relationship,
+                "Relation Name": "tbl" + str(no),
+                "Plan Rows": 100,
+                "Actual Rows": 50,
+                "Actual Loops": 1,
+            }
+
+        _plan = scan(0, "Outer")
+        for _i in range(1, max(1, num_nodes // 2)):
+            _plan = {
+                "Node Type": "Nested Loop",
+                "Parent Relationship": "Outer",
+                "Plan Rows": 100,
+                "Actual Rows": 50,
+                "Actual Loops": 1,
+                "Plans": [_plan, scan(_i, "Inner")],
+            }
+        del _plan["Parent Relationship"]
+        return {"Plan": _plan}
+
+    def legacy_walk(Plans, num_nodes, func):
+        """
+        Visit the nodes from the bottom node to the top node by digging down
+        the plan tree to each depth, as the previous implementation did.
+        """
+
+        def op(Plans, depth):
+            if isinstance(Plans, list):
+                for plan in Plans:
+                    _count[0] += 1
+                    if depth == _count[0]:
+                        func(plan)
+                        return
+                    elif "Plans" in plan:
+                        op(plan["Plans"], depth)
+            else:
+                _count[0] += 1
+                if depth == _count[0]:
+                    func(Plans)
+                    return
+                elif "Plans" in Plans:
+                    op(Plans["Plans"], depth)
+
+        _i = num_nodes
+        while 0 < _i:
+            _count = [0]
+            op(Plans, _i)
+            _i -= 1
+
+    def index_walk(Plans, num_nodes, func):
+        """Visit the nodes from the bottom node to the top node using the node list."""
+        for _plan in reversed(Common().get_node_list(Plans)):
+            func(_plan)
+
+    def make_parallel_plan(num_nodes, num_workers):
+        """
+        Make a synthetic parallel plan, i.e. the leader's plan and the
+        num_workers worker's plans, whose nodes under Gather are made by
+        make_plan().
+        """
+        _inner = make_plan(num_nodes)["Plan"]
+        _inner["Parent Relationship"] = "Outer"
+        _leader = {
+            "Plan": {
+                "Node Type": "Gather",
+                "Workers Planned": num_workers,
+                "Workers Launched": num_workers,
+                "Plan Rows": 100,
+                "Actual Rows": 50,
+                "Actual Loops": 1,
+                "Plans": [_inner],
+            }
+        }
+        _workers = [{"Plan": copy.deepcopy(_inner)} for _i in range(num_workers)]
+        return (_leader, _workers)
+
+    def legacy_merge(leader_plan, worker_plans):
+        """
+        Merge the worker's rows into the leader's plan by digging down the
+        plan trees to each depth, as the previous implementation did.
+        """
+
+        def find(Plans, depth):
+            def op(Plans):
+                if isinstance(Plans, list):
+                    for plan in Plans:
+                        _count[0] += 1
+                        if depth == _count[0]:
+                            return plan
+                        if "Plans" in plan:
+                            _plan = op(plan["Plans"])
+                            if _plan is not None:
+                                return _plan
+                    return None
+                if "Node Type" in Plans:
+                    _count[0] += 1
+                    if depth == _count[0]:
+                        return Plans
+                for _key in ("Plan", "Plans"):
+                    if _key in Plans:
+                        _plan = op(Plans[_key])
+                        if _plan is not None:
+                            return _plan
+                return None
+
+            _count = [0]
+            return op(Plans)
+
+        cm = Common()
+        _i = cm.count_nodes(worker_plans[0])
+        _j = cm.count_nodes(leader_plan)
+        while 0 < _i:
+            rows = 0
+            for _plan in worker_plans:
+                _node = find(_plan, _i)
+                rows += 0 if _node is None else _node["Actual Rows"]
+            _node = find(leader_plan, _j)
+            if _node is not None and _node["MergeFlag"] == "True":
+                _node["Plan Rows"] *= _node["NormalizePlanParam"]
+                _node["Actual Rows"] += rows
+            _i -= 1
+            _j -= 1
+
+    def measure(func, repeat):
+        _start = time.perf_counter()
+        for _i in range(0, repeat):
+            func()
+        return (time.perf_counter() - _start) / repeat * 1000
+
+    def walk(args):
+        repeat = int(args.repeat)
+        cm = Common()
+        qp = QueryProgress(log_level=Log.error)
+
+        print(
+            "{:>8} {:>14} {:>14} {:>9} {:>14}".format(
+                "nodes", "legacy[ms]", "index[ms]", "speedup", "progress[ms]"
+            )
+        )
+        for _n in args.nodes:
+            _plan = make_plan(int(_n))
+            _num_nodes = cm.count_nodes(_plan)
+
+            _visited = []
+            legacy_walk(_plan["Plan"], _num_nodes, _visited.append)
+            _expected = [id(p) for p in _visited]
+            _visited = []
+            index_walk(_plan["Plan"], _num_nodes, _visited.append)
+            assert _expected == [id(p) for p in _visited]
+
+            _legacy = measure(
+                lambda: legacy_walk(_plan["Plan"], _num_nodes, lambda p: None), repeat
+            )
+            _index = measure(
+                lambda: index_walk(_plan["Plan"], _num_nodes, lambda p: None), repeat
+            )
+            _json = json.dumps(_plan)
+            _progress = measure(lambda: qp._progress(json.loads(_json)), repeat)
+
+            print(
+                "{:>8} {:>14.3f} {:>14.3f} {:>8.1f}x {:>14.3f}".format(
+                    _num_nodes, _legacy, _index, _legacy / _index, _progress
+                )
+            )
+
+    def merge(args):
+        repeat = int(args.repeat)
+        mp = MergePlan(log_level=Log.error)
+
+        print(
+            "{:>8} {:>8} {:>14} {:>14} {:>9}".format(
+                "nodes", "workers", "legacy[ms]", "lockstep[ms]", "speedup"
+            )
+        )
+        for _n in args.nodes:
+            for _w in args.workers:
+                (_leader, _workers) = make_parallel_plan(int(_n), int(_w))
+                mp.prepare_merge_rows(_leader)
+                _num_nodes = mp.count_nodes(_leader)
+
+                _expected = copy.deepcopy(_leader)
+                legacy_merge(_expected, _workers)
+                _merged = copy.deepcopy(_leader)
+                mp.merge_rows(_merged, _workers)
+                assert _expected == _merged
+
+                """The merged values grow in each repetition, which does not matter."""
+                _legacy = measure(lambda: legacy_merge(_leader, _workers), repeat)
+                _lockstep = measure(lambda: mp.merge_rows(_leader, _workers), repeat)
+
+                print(
+                    "{:>8} {:>8} {:>14.3f} {:>14.3f} {:>8.1f}x".format(
+                        _num_nodes, _w, _legacy, _lockstep, _legacy / _lockstep
+                    )
+                )
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="This script measures the plan tree traversals of the pgpi module."
+    )
+    subparsers = parser.add_subparsers()
+
+    # walk command.
+    parser_walk = subparsers.add_parser(
+        "walk",
+        help="Compare the depth-counting traversal with the node list traversal",
+    )
+    parser_walk.add_argument(
+        "--nodes",
+        nargs="+",
+        help="Numbers of nodes of the synthetic plans (default: 50 150 300 600)",
+        default=["50", "150", "300", "600"],
+    )
+    parser_walk.add_argument(
+        "--repeat", help="Number of repetitions (default: 20)", default="20"
+    )
+    parser_walk.set_defaults(handler=walk)
+
+    # merge command.
+    parser_merge = subparsers.add_parser(
+        "merge",
+        help="Compare the depth-counting merge of the parallel worker's rows with the lockstep merge",
+    )
+    parser_merge.add_argument(
+        "--nodes",
+        nargs="+",
+        help="Numbers of nodes of the synthetic plans (default: 50 150 300)",
+        default=["50", "150", "300"],
+    )
+    parser_merge.add_argument(
+        "--workers",
+        nargs="+",
+        help="Numbers of parallel workers (default: 8 16)",
+        default=["8", "16"],
+    )
+    parser_merge.add_argument(
+        "--repeat", help="Number of repetitions (default: 20)", default="20"
+    )
+    parser_merge.set_defaults(handler=merge)
+
+    args = parser.parse_args()
+    if hasattr(args, "handler"):
+        args.handler(args)
+    else:
+        parser.print_help()
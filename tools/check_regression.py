@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+A check script for the regressions of the pgpi module.
+
+Usage:
+   check_regression.py join [--cases NNN] [--seed NNN]
+
+
+  Formatted by black (https://pypi.org/project/black/)
+
+  Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
+"""
+
+import argparse
+import math
+import random
+import sys
+import os
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from pgpi import *
+
+if __name__ == "__main__":
+
+    # Functions
+    def make_inputs(rnd, kind):
+        """
+        Make the (Xouter, Xinner, Y) of a join node.
+        Except for "full", the least-squares problems are rank deficient.
+        """
+        _n = {"n1": 1, "n2": 2}.get(kind, rnd.randint(3, 8))
+        _xo = [rnd.randint(1, 100) for _i in range(0, _n)]
+        _xi = [rnd.randint(1, 100) for _i in range(0, _n)]
+        _y = [rnd.randint(0, 5000) for _i in range(0, _n)]
+        if kind in ("const_outer", "const_both"):
+            _xo = [5] * _n
+        if kind in ("const_inner", "const_both"):
+            _xi = [7] * _n
+        if kind == "collinear":
+            _xi = [2 * _x for _x in _xo]
+        if kind == "zero_x":
+            (_xo, _xi) = ([0] * _n, [0] * _n)
+        if kind == "zero_y":
+            _y = [0] * _n
+        return (_xo, _xi, _y)
+
+    def lstsq(X, Y, bias):
+        """
+        Solve Y = X * coef + intercept by np.linalg.lstsq as sklearn's
+        LinearRegression does, and Return (coef, intercept, rmse).
+        If bias is 1, the sample (X=0, Y=0) is added.
+        """
+        if bias == 1:
+            X = np.vstack([X, np.zeros((1, X.shape[1]))])
+            Y = np.append(Y, 0.0)
+        _xmean = X.mean(axis=0)
+        _ymean = Y.mean()
+        _coef = np.linalg.lstsq(X - _xmean, Y - _ymean, rcond=None)[0]
+        _intercept = _ymean - _xmean @ _coef
+        _rmse = math.sqrt(np.mean((X @ _coef + _intercept - Y) ** 2))
+        return ([float(round(_c, 5)) for _c in _coef], _intercept, _rmse)
+
+    def reference(Xouter, Xinner, Y):
+        """
+        Calculate the regression parameters of a join node by lstsq(), with
+        the same model selection as CalcRegression.merge_or_hash_join().
+        The RMSEs are calculated from the residuals, so the ties are exact.
+        """
+        _X = np.array([Xouter, Xinner], dtype=np.float64).T
+        _Y = np.array(Y, dtype=np.float64)
+        _tolerance = CalcRegression.RMSE_TOLERANCE * math.sqrt(np.mean(_Y ** 2))
+
+        def fit(cols):
+            (coef, intercept, rmse) = lstsq(_X[:, cols], _Y, 1)
+            if any(_c < 0 for _c in coef):
+                (coef, intercept, rmse) = lstsq(_X[:, cols], _Y, 0)
+            return (coef, float(round(intercept + 0.0, 5)), rmse)
+
+        (_coef, _intercept, _rmse) = fit([0, 1])
+        (coef, intercept, rmse) = fit([0])
+        if rmse < _rmse - _tolerance:
+            (_coef, _intercept, _rmse) = ([coef[0], 0.0], intercept, rmse)
+        (coef, intercept, rmse) = fit([1])
+        if rmse < _rmse - _tolerance:
+            (_coef, _intercept, _rmse) = ([0.0, coef[0]], intercept, rmse)
+        return (_coef, 0, _intercept)
+
+    def is_close(a, b):
+        """Compare the regression parameters allowing the rounding errors."""
+        (_ca, _ra, _ia) = a
+        (_cb, _rb, _ib) = b
+        return _ra == _rb and all(
+            math.isclose(x, y, rel_tol=1e-4, abs_tol=1e-4)
+            for (x, y) in zip(_ca + [_ia], _cb + [_ib])
+        )
+
+    def check_join(args):
+        """
+        Check that merge_or_hash_join() returns the same parameters as the
+        reference also if the problems are rank deficient, i.e. the ties of
+        the models are broken by the rule, not by the rounding errors, and
+        that the results do not depend on the order of the samples.
+        """
+        _kinds = (
+            "full",
+            "n1",
+            "n2",
+            "const_outer",
+            "const_inner",
+            "const_both",
+            "collinear",
+            "zero_x",
+            "zero_y",
+        )
+        rnd = random.Random(int(args.seed))
+        cr = CalcRegression()
+        cr.set_log_level(Log.error)
+        _inputs = []
+        for _i in range(0, int(args.cases)):
+            _kind = _kinds[_i % len(_kinds)]
+            (_xo, _xi, _y) = make_inputs(rnd, _kind)
+            _inputs.append((_xo, _xi, _y))
+            _ret = cr.merge_or_hash_join(_xo, _xi, _y)
+            _ref = reference(_xo, _xi, _y)
+            assert is_close(_ret, _ref), (_kind, _xo, _xi, _y, _ret, _ref)
+            _rev = cr.merge_or_hash_join(_xo[::-1], _xi[::-1], _y[::-1])
+            assert is_close(_ret, _rev), (_kind, _xo, _xi, _y, _ret, _rev)
+
+        _batch = cr.merge_or_hash_join_batch(_inputs)
+        for ((_xo, _xi, _y), _ret) in zip(_inputs, _batch):
+            assert is_close(_ret, cr.merge_or_hash_join(_xo, _xi, _y))
+        print("join: ok")
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="This script checks the regressions of the pgpi module."
+    )
+    subparsers = parser.add_subparsers()
+
+    # join command.
+    parser_join = subparsers.add_parser(
+        "join",
+        help="Check the merge and hash join regressions of degenerate inputs",
+    )
+    parser_join.add_argument(
+        "--cases", help="Number of join nodes (default: 900)", default="900"
+    )
+    parser_join.add_argument("--seed", help="Random seed (default: 1)", default="1")
+    parser_join.set_defaults(handler=check_join)
+
+    args = parser.parse_args()
+    if hasattr(args, "handler"):
+        args.handler(args)
+    else:
+        parser.print_help()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+A check script for the on-disk stores of the pgpi module.
+
+Usage:
+   check_store.py segment  [--rows NNN] [--codec XXX]
+   check_store.py logindex [--rows NNN] [--interval NNN]
+   check_store.py truncate [--rows NNN] [--interval NNN]
+   check_store.py stats    [--rows NNN] [--rounds NNN]
+   check_store.py pushstat
+
+
+  Formatted by black (https://pypi.org/project/black/)
+
+  Copyright (c) 2021-2025, Hironobu Suzuki @ interdb.jp
+"""
+
+import argparse
+import math
+import random
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from pgpi import *
+
+if __name__ == "__main__":
+
+    # Functions
+    def tear(path, size):
+        """Cut size bytes from the end of path, as a crash while appending does."""
+        with open(path, "r+b") as _fp:
+            _fp.truncate(os.path.getsize(path) - size)
+
+    def check_segment(args):
+        """
+        Check that a Segment ignores the torn records at the end of its
+        index and digest files, and that the rows got again from the middle
+        replace the stored ones. They are written by codec, so the texts of
+        the different codecs are mixed in the segment file.
+        """
+        num_rows = int(args.rows)
+        with tempfile.TemporaryDirectory() as _dir:
+            _texts = {}
+            _seg = Segment(_dir, "query", dedup=True)
+            for _seqid in range(1, num_rows + 1):
+                _texts[_seqid] = "select {}".format(_seqid % 7)
+                _seg.append(_seqid, _texts[_seqid])
+            _seg.close()
+
+            tear(os.path.join(_dir, "query.idx"), Segment.INDEX_SIZE // 2)
+            tear(os.path.join(_dir, "query.dig"), Segment.DIGEST_SIZE // 2)
+            del _texts[num_rows]
+            _seg = Segment(_dir, "query", dedup=True, codec=args.codec)
+            assert _seg.seqids() == sorted(_texts)
+            assert all(_seg.get(_s) == _t for (_s, _t) in _texts.items())
+            assert _seg.get(num_rows) is None
+
+            """Get the rows again from the middle, as get_tables() does after a crash."""
+            for _seqid in range(num_rows // 2, num_rows + 1):
+                _texts[_seqid] = "select {}".format(_seqid % 11)
+                _seg.append(_seqid, _texts[_seqid])
+            _seg.close()
+
+            _seg = Segment(_dir, "query")
+            assert _seg.seqids() == sorted(_texts)
+            assert all(_seg.get(_s) == _t for (_s, _t) in _texts.items())
+            assert num_rows + 1 not in _seg
+            _seg.close()
+        print("segment: ok")
+
+    def write_log_csv(logindex, csvpath, seqids):
+        """Append the rows of seqids to csvpath, as get_tables() does."""
+        with open(csvpath, "a") as _fp:
+            for _seqid in seqids:
+                logindex.add(_seqid, _fp.tell())
+                _fp.write("{},t0,t1,db,1,0,1,1\n".format(_seqid))
+
+    def read_log_csv(csvpath):
+        """Return the list of (offset, seqid) of the rows in csvpath."""
+        _rows = []
+        _offset = 0
+        with open(csvpath, "rb") as _fp:
+            for _line in _fp:
+                _rows.append((_offset, int(_line.split(b",", 1)[0])))
+                _offset += len(_line)
+        return _rows
+
+    def check_offsets(logindex, csvpath, max_seqid):
+        """
+        Check that find_offset() returns a row boundary before which no row
+        has a seqid greater than the given one.
+        """
+        _rows = read_log_csv(csvpath)
+        _boundaries = set([_o for (_o, _s) in _rows] + [os.path.getsize(csvpath)])
+        for _seqid in range(0, max_seqid + 1):
+            _offset = logindex.find_offset(_seqid)
+            assert _offset in _boundaries
+            assert all(_s <= _seqid for (_o, _s) in _rows if _o < _offset)
+
+    def check_logindex(args):
+        """
+        Check that a LogIndex ignores the torn entry at the end of its file,
+        also when some rows are stored twice, i.e. after a crash.
+        """
+        num_rows = int(args.rows)
+        with tempfile.TemporaryDirectory() as _dir:
+            _csvpath = os.path.join(_dir, "log.csv")
+            _idxpath = os.path.join(_dir, "log.idx")
+            _li = LogIndex(_csvpath, _idxpath)
+            _li.INTERVAL = int(args.interval)
+            _li.open()
+            write_log_csv(_li, _csvpath, range(1, num_rows + 1))
+            write_log_csv(_li, _csvpath, range(num_rows // 2, num_rows + 1))
+            _li.close()
+
+            tear(_idxpath, LogIndex.SIZE // 2)
+            _li = LogIndex(_csvpath, _idxpath)
+            _li.INTERVAL = int(args.interval)
+            check_offsets(_li, _csvpath, num_rows + 1)
+
+            """open() cuts the torn entry, and the new rows are indexed after it."""
+            _li.open()
+            assert os.path.getsize(_idxpath) % LogIndex.SIZE == 0
+            write_log_csv(_li, _csvpath, range(num_rows + 1, 2 * num_rows + 1))
+            _li.close()
+            check_offsets(_li, _csvpath, 2 * num_rows + 1)
+        print("logindex: ok")
+
+    def check_truncate(args):
+        """
+        Check that truncate_log_csv() removes the rows above the watermark,
+        i.e. the rows appended by an interrupted get_tables(), and that the
+        rows got again are read back.
+        """
+        num_rows = int(args.rows)
+        _watermark = num_rows // 3
+        _serverId = "check"
+        with tempfile.TemporaryDirectory() as _dir:
+            rp = Repository(_dir, log_level=Log.error)
+            rp.create_repo()
+            rp.check_tables_dir(_serverId)
+            _csvpath = rp.get_log_csv_path(_serverId)
+
+            _li = rp.get_log_index(_serverId)
+            _li.INTERVAL = int(args.interval)
+            _li.open()
+            write_log_csv(_li, _csvpath, range(1, num_rows + 1))
+            _li.close()
+
+            _rows = rp.truncate_log_csv(_serverId, _watermark)
+            assert [int(_r[0]) for _r in _rows] == list(
+                range(_watermark + 1, num_rows + 1)
+            )
+            assert [_s for (_o, _s) in read_log_csv(_csvpath)] == list(
+                range(1, _watermark + 1)
+            )
+            assert rp.truncate_log_csv(_serverId, _watermark) == []
+
+            _li = rp.get_log_index(_serverId)
+            _li.INTERVAL = int(args.interval)
+            _li.open()
+            write_log_csv(_li, _csvpath, range(_watermark + 1, num_rows + 1))
+            _li.close()
+            for _seqid in (0, _watermark, num_rows - 1):
+                _rows = rp.read_log_csv(_serverId, _seqid)
+                assert [int(_r[0]) for _r in _rows] == list(
+                    range(_seqid + 1, num_rows + 1)
+                )
+        print("truncate: ok")
+
+    def make_plan(rnd, node_type, num_children=2):
+        """
+        Make a synthetic plan whose top node is node_type over two scans,
+        with random rows.
+
+        Sort
+          ->  node_type
+                ->  Outer: Seq Scan
+                ->  Inner: Seq Scan (under Hash if node_type is Hash Join)
+
+        If num_children is 1, the inner scan is removed, as runtime pruning
+        removes the subplans of an Append.
+        """
+
+        def node(node_type, relationship, plans=None):
+            _node = {
+                "Node Type": node_type,
+                "Parent Relationship": relationship,
+                "Plan Rows": rnd.randint(1, 1000),
+                "Actual Rows": rnd.randint(0, 1000),
+                "Actual Loops": 1,
+            }
+            if plans is not None:
+                _node["Plans"] = plans
+            return _node
+
+        _inner = node("Seq Scan", "Inner")
+        if node_type == "Hash Join":
+            _inner["Parent Relationship"] = "Outer"
+            _inner = node("Hash", "Inner", [_inner])
+        _join = node(node_type, "Outer", [node("Seq Scan", "Outer"), _inner])
+        del _join["Plans"][num_children:]
+        _sort = node("Sort", None, [_join])
+        del _sort["Parent Relationship"]
+        _sort["Sort Space Type"] = rnd.choice(["Disk", "Memory"])
+        _sort["Sort Space Used"] = rnd.randint(1, 10000)
+        return {"Plan": _sort}
+
+    def is_close(a, b):
+        """Compare the statistics allowing the rounding errors of the floats."""
+        if isinstance(a, dict):
+            return a.keys() == b.keys() and all(is_close(a[k], b[k]) for k in a)
+        if isinstance(a, list):
+            return len(a) == len(b) and all(is_close(x, y) for (x, y) in zip(a, b))
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+
+    def check_stats(args):
+        """
+        Check that the sufficient statistics (.stat) updated by grouping()
+        round by round are equal to the ones rebuilt from all samples of the
+        grouped plans, and that the nested loop type and join nodes which
+        have only one child are skipped.
+        """
+        num_rows = int(args.rows)
+        _serverId = "server_1"
+        _plans = {
+            (1, 11): ("Nested Loop", 2),
+            (2, 21): ("Hash Join", 2),
+            (3, 31): ("Merge Join", 2),
+            (4, 41): ("Append", 1),
+            (5, 51): ("Hash Join", 1),
+        }
+        rnd = random.Random(1)
+        with tempfile.TemporaryDirectory() as _dir:
+            rp = Repository(_dir, log_level=Log.error)
+            rp.create_repo()
+            rp.check_tables_dir(_serverId)
+            mp = MergePlan(log_level=Log.error)
+            mp.set_base_dir(_dir)
+
+            _seqid = 0
+            _last_seqids = {}
+            for _round in range(0, int(args.rounds)):
+                with open(rp.get_log_csv_path(_serverId), "a") as _fp:
+                    for _i in range(0, num_rows):
+                        _seqid += 1
+                        (_queryid, _planid) = rnd.choice(list(_plans))
+                        _fp.write(
+                            "{},t0,t1,db,1,0,{},{}\n".format(_seqid, _queryid, _planid)
+                        )
+                        _path = rp.get_plan_json_path(
+                            _serverId, _seqid, _queryid, _planid
+                        )
+                        os.makedirs(os.path.dirname(_path), exist_ok=True)
+                        _plan = make_plan(rnd, *_plans[(_queryid, _planid)])
+                        mp.write_plan_json(mp.merge_workers_rows(_plan), _path)
+                        _last_seqids[(_queryid, _planid)] = _seqid
+                rp.update_tables_stat_file(_serverId, _seqid)
+                Grouping(_dir, log_level=Log.error).grouping(_serverId)
+
+            gp = Grouping(_dir, log_level=Log.error)
+            for ((_queryid, _planid), _seqid) in _last_seqids.items():
+                _planpath = rp.get_grouping_plan_path(_serverId, _queryid, _planid)
+                _grouped = gp.read_grouping_plan(_planpath)
+                _stats = gp.new_statistics(_grouped)
+                gp.update_statistics(_stats, _grouped, _seqid)
+                assert is_close(rp.read_grouping_stats(_planpath), _stats)
+                if _plans[(_queryid, _planid)][1] == 1:
+                    assert _stats["Nodes"][1]["N"] == 0
+
+            """The regression also runs with the skipped nodes."""
+            Regression(_dir, log_level=Log.error).regression(_serverId)
+            for (_queryid, _planid) in _last_seqids:
+                assert rp.get_regression_param(_serverId, _queryid, _planid)
+        print("stats: ok")
+
+    def check_pushstat(args):
+        """
+        Check that the push watermarks survive the truncation of the formatted
+        regression parameters by push --full, and that the watermarks stored
+        in the formatted regression parameter subdir are still read.
+        """
+        _serverId = "server_1"
+        with tempfile.TemporaryDirectory() as _dir:
+            rp = Repository(_dir, log_level=Log.error)
+            rp.create_repo()
+            rp.check_regression_dir(_serverId)
+            rp.check_formatted_regression_params_dir(_serverId)
+            _params_dir = rp.get_formatted_regression_params_subdir_path(_serverId)
+
+            """The watermarks stored before are read, and moved by the update."""
+            _old_path = os.path.join(_params_dir, Common.PUSH_STAT_FILE)
+            with open(_old_path, "w") as _fp:
+                _fp.write("[db1]\nseqid = 10\n\n[db2]\nseqid = 20\n")
+            assert rp.get_seqid_from_push_stat(_serverId, "db1") == 10
+            rp.update_push_stat_file(_serverId, "db1", 30)
+            assert os.path.exists(_old_path) == False
+            assert rp.get_seqid_from_push_stat(_serverId, "db1") == 30
+            assert rp.get_seqid_from_push_stat(_serverId, "db2") == 20
+
+            rp.write_formatted_regression_params(_serverId, 1, "param")
+            rp.truncate_formatted_regression_params(_serverId)
+            assert os.listdir(_params_dir) == []
+            assert rp.get_seqid_from_push_stat(_serverId, "db1") == 30
+            assert rp.get_seqid_from_push_stat(_serverId, "db2") == 20
+            assert rp.get_seqid_from_push_stat(_serverId, "db3") == 0
+        print("pushstat: ok")
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="This script checks the on-disk stores of the pgpi module."
+    )
+    subparsers = parser.add_subparsers()
+
+    # segment command.
+    parser_segment = subparsers.add_parser(
+        "segment",
+        help="Check the torn-tail recovery and the refetch of a Segment",
+    )
+    parser_segment.add_argument(
+        "--rows", help="Number of rows (default: 1000)", default="1000"
+    )
+    parser_segment.add_argument(
+        "--codec",
+        help="Codec of the rows got again (default: zlib)",
+        choices=Common.PLAN_CODECS,
+        default="zlib",
+    )
+    parser_segment.set_defaults(handler=check_segment)
+
+    # logindex command.
+    parser_logindex = subparsers.add_parser(
+        "logindex",
+        help="Check the torn-tail recovery of a LogIndex",
+    )
+    parser_logindex.add_argument(
+        "--rows", help="Number of rows (default: 1000)", default="1000"
+    )
+    parser_logindex.add_argument(
+        "--interval",
+        help="Number of rows per index entry (default: 16)",
+        default="16",
+    )
+    parser_logindex.set_defaults(handler=check_logindex)
+
+    # truncate command.
+    parser_truncate = subparsers.add_parser(
+        "truncate",
+        help="Check that truncate_log_csv() removes the rows above the watermark",
+    )
+    parser_truncate.add_argument(
+        "--rows", help="Number of rows (default: 1000)", default="1000"
+    )
+    parser_truncate.add_argument(
+        "--interval",
+        help="Number of rows per index entry (default: 16)",
+        default="16",
+    )
+    parser_truncate.set_defaults(handler=check_truncate)
+
+    # stats command.
+    parser_stats = subparsers.add_parser(
+        "stats",
+        help="Check that the incremental sufficient statistics equal the rebuilt ones",
+    )
+    parser_stats.add_argument(
+        "--rows", help="Number of rows per round (default: 100)", default="100"
+    )
+    parser_stats.add_argument(
+        "--rounds", help="Number of rounds of grouping (default: 5)", default="5"
+    )
+    parser_stats.set_defaults(handler=check_stats)
+
+    # pushstat command.
+    parser_pushstat = subparsers.add_parser(
+        "pushstat",
+        help="Check that the push watermarks survive push --full",
+    )
+    parser_pushstat.set_defaults(handler=check_pushstat)
+
+    args = parser.parse_args()
+    if hasattr(args, "handler"):
+        args.handler(args)
+    else:
+        parser.print_help()